@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the admin check done by every protected endpoint
+
+Compares re-parsing the config file on each call (the previous behaviour)
+with the in-memory ConfigCache used by verify_admin().
+
+Usage: python3 bench_auth.py [--calls N]
+"""
+
+import argparse
+import configparser
+import os
+import tempfile
+import time
+
+import server
+
+
+def verify_admin_uncached(chat_id):
+    """The previous verify_admin: stat, open and parse the config every call"""
+    config = configparser.ConfigParser()
+    if os.path.exists("config"):
+        config.read("config")
+        if "SecretConfig" in config:
+            return str(chat_id) == str(config["SecretConfig"].get("admincid", ""))
+    return True
+
+
+def measure(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func("131728488")
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000, help="checks per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with open("config", "w") as f:
+            f.write("[SecretConfig]\ntoken = 123:abc\nadmincid = 131728488\n")
+
+        before = measure(verify_admin_uncached, args.calls)
+        after = measure(server.verify_admin, args.calls)
+
+    print(f"{'':>10} {'per call':>12}")
+    print(f"{'uncached':>10} {before * 1e6:>9.2f} us")
+    print(f"{'cached':>10} {after * 1e6:>9.2f} us")
+    print(f"speedup: {before / after:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
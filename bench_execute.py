@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the shared execution engine in server.py
+
+Runs a fixed batch of CPU-bound commands through run_subprocess() at
+increasing concurrency and reports throughput, then shows that the event
+loop keeps serving other work while a slow command is running.
+
+Usage: python3 bench_execute.py [--jobs N] [--work N]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import server
+
+
+async def run_batch(command, jobs, concurrency):
+    """Run `jobs` copies of command with at most `concurrency` in flight"""
+    server._exec_semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        server.run_subprocess(command, shell=True) for _ in range(jobs)
+    ])
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if r.timed_out or r.returncode != 0)
+    return elapsed, failed
+
+
+async def loop_latency_during(command, probes=20, interval=0.05):
+    """Measure worst event loop delay while `command` runs"""
+    task = asyncio.ensure_future(server.run_subprocess(command, shell=True))
+    worst = 0.0
+    for _ in range(probes):
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    await task
+    return worst
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=32, help="commands per batch")
+    parser.add_argument("--work", type=int, default=3000000, help="loop size of each command")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    command = f'{sys.executable} -c "sum(range({args.work}))"'
+
+    print(f"CPU cores: {cores}, jobs per batch: {args.jobs}")
+    print(f"{'concurrency':>12} {'seconds':>10} {'jobs/sec':>10} {'speedup':>8}")
+
+    baseline = None
+    concurrency = 1
+    while concurrency <= cores * 2:
+        elapsed, failed = await run_batch(command, args.jobs, concurrency)
+        throughput = args.jobs / elapsed
+        baseline = baseline or throughput
+        note = f"  ({failed} failed)" if failed else ""
+        print(f"{concurrency:>12} {elapsed:>10.2f} {throughput:>10.1f} {throughput / baseline:>7.2f}x{note}")
+        concurrency *= 2
+
+    worst = await loop_latency_during("sleep 1")
+    print(f"\nWorst event loop delay while 'sleep 1' runs: {worst * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
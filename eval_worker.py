@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Python evaluation for the /api/eval endpoint
+
+evaluate() holds the execution logic shared by the server's in-process mode
+and the worker pool. Run as a script, this module becomes a pool worker: it
+reads one JSON request per line from stdin and answers with one JSON line,
+so a single warm interpreter can serve many evaluations. Requests marked
+"persist" share one namespace, which is how eval kernels keep variables.
+"""
+
+import ast
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import traceback
+from collections import OrderedDict
+from io import StringIO
+
+
+def make_namespace():
+    """Create a fresh namespace for executing user code"""
+    return {
+        '__builtins__': __builtins__,
+        'os': os,
+        'subprocess': subprocess,
+        'asyncio': asyncio,
+        'json': json,  # Add json module for better formatting
+    }
+
+
+def is_async_code(code):
+    """Check if code contains await (indicating async code)"""
+    # Use AST parsing for more accurate detection
+    try:
+        tree = ast.parse(code)
+        has_await = any(isinstance(node, (ast.Await, ast.AsyncWith, ast.AsyncFor))
+                        for node in ast.walk(tree))
+        has_async_def = any(isinstance(node, ast.AsyncFunctionDef)
+                            for node in ast.walk(tree))
+        return has_await or has_async_def
+    except SyntaxError:
+        # If parsing fails, fall back to simple string check
+        return 'await ' in code or code.strip().startswith('async ')
+
+
+class CodeCache:
+    """Bounded LRU cache of compiled snippets keyed by a hash of the source
+
+    Re-running the same snippet skips the AST walk and compile() entirely.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, code):
+        """Return (kind, code object) for code, compiling it on a miss
+
+        kind is "async" (a module defining __async_exec), "eval" or "exec".
+        Raises SyntaxError for invalid code, which is not cached.
+        """
+        key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = compile_code(code)
+        if self.size > 0:
+            self._entries[key] = entry
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "size": self.size}
+
+
+def compile_code(code):
+    """Classify and compile code the way evaluate() runs it"""
+    if is_async_code(code):
+        # Wrap code in async function so it can be awaited
+        indented_code = textwrap.indent(code, '    ')
+        async_code = f"""
+async def __async_exec():
+{indented_code}
+"""
+        return "async", compile(async_code, "<string>", "exec")
+    # Try to evaluate as expression first
+    try:
+        return "eval", compile(code, "<string>", "eval")
+    except SyntaxError:
+        pass
+    # If it fails, execute as statement
+    return "exec", compile(code, "<string>", "exec")
+
+
+code_cache = CodeCache(int(os.environ.get("HFS_EVAL_CODE_CACHE_SIZE", 256)))
+
+
+async def evaluate(code, namespace):
+    """Execute code in namespace, printing the result of expressions
+
+    Output goes to sys.stdout; capturing it is up to the caller.
+    """
+    kind, compiled = code_cache.get(code)
+    if kind == "async":
+        # Define the async function, then await it
+        exec(compiled, namespace)
+        result = await namespace['__async_exec']()
+        if result is not None:
+            print(result)
+    elif kind == "eval":
+        result = eval(compiled, namespace)
+        if result is not None:
+            # If result is dict or list, auto-format as JSON
+            if isinstance(result, (dict, list)):
+                print(json.dumps(result, indent=2, ensure_ascii=False))
+            else:
+                print(result)
+    else:
+        exec(compiled, namespace)
+
+
+def format_output(output):
+    """Tidy captured output for the response"""
+    if not output:
+        return "Code executed successfully (no output)"
+
+    # Try to detect and format JSON output
+    try:
+        # Check if output looks like JSON (starts with { or [)
+        stripped = output.strip()
+        if (stripped.startswith('{') or stripped.startswith('[')) and (stripped.endswith('}') or stripped.endswith(']')):
+            # Try to parse and reformat as JSON
+            json_obj = json.loads(stripped)
+            output = json.dumps(json_obj, indent=2, ensure_ascii=False)
+    except (json.JSONDecodeError, ValueError):
+        # Not valid JSON, keep original output
+        pass
+    return output
+
+
+def format_error(e):
+    """Format an exception raised by user code for the response"""
+    return f"{type(e).__name__}: {str(e)}\\n{traceback.format_exc()}"
+
+
+def exit_response(e, output):
+    """Response for code that called exit() or sys.exit()
+
+    Exiting with status 0 or None is a success; other statuses are errors.
+    """
+    if e.code is None or e.code == 0:
+        return {"success": True, "output": format_output(output)}
+    return {"success": False, "error": f"SystemExit: {e.code}", "output": output}
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_request(loop, request, namespace):
+    """Evaluate one request in namespace and build the response dict"""
+    old_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        loop.run_until_complete(evaluate(request["code"], namespace))
+        response = {"success": True, "output": format_output(sys.stdout.getvalue())}
+    except SystemExit as e:
+        # Ends the snippet, not the worker
+        response = exit_response(e, sys.stdout.getvalue())
+    except Exception as e:
+        response = {"success": False, "error": format_error(e)}
+    finally:
+        sys.stdout = old_stdout
+    return response
+
+
+def main():
+    # Keep a private copy of the real stdout for responses and point fd 1 at
+    # stderr, so output from child processes can't corrupt the protocol
+    channel = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    # Likewise for requests: user code reading stdin, or exit() closing it,
+    # gets /dev/null instead
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    # Warm up commonly used modules once, before any request arrives
+    for name in filter(None, os.environ.get("HFS_EVAL_PREIMPORT", "").split(",")):
+        try:
+            __import__(name.strip())
+        except ImportError as e:
+            print(f"eval worker: could not preimport {name}: {e}", file=sys.stderr)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Namespace kept alive across requests when the worker serves as a kernel
+    kernel_namespace = make_namespace()
+
+    for line in iter(requests.readline, ""):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        namespace = kernel_namespace if request.get("persist") else make_namespace()
+        hits = code_cache.hits
+        response = run_request(loop, request, namespace)
+        response["cache_hit"] = code_cache.hits > hits
+        response["rss"] = current_rss()
+        channel.write(json.dumps(response) + "\n")
+        channel.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Install a local copy of the Monaco editor for the web interface
+
+Downloads the monaco-editor package from the npm registry and keeps only
+its minified build, without source maps, translations or languages the UI
+doesn't offer. Each file gets gzip (and brotli, when installed) copies next
+to it for the server to send as-is. When the copy is present the server
+serves it under /monaco instead of loading the editor from the CDN.
+
+Usage: python3 fetch_monaco.py [--version X] [--registry URL] [--dest DIR]
+"""
+
+import argparse
+import gzip
+import io
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DEST = os.environ.get("HFS_MONACO_DIR", os.path.join(BASE_DIR, "static", "monaco"))
+DEFAULT_REGISTRY = os.environ.get("HFS_NPM_REGISTRY", "https://registry.npmjs.org")
+
+# Languages offered by the editor's language selector, and the Monaco
+# modules they need (JavaScript highlighting builds on TypeScript's)
+BASIC_LANGUAGES = {"python", "javascript", "typescript", "html", "css", "shell"}
+LANGUAGE_SERVICES = {"typescript", "html", "css", "json"}
+
+COMPRESS_EXTENSIONS = (".js", ".css", ".json", ".svg", ".ttf")
+
+
+def template_version():
+    """Monaco version the UI template loads from the CDN"""
+    with open(os.path.join(BASE_DIR, "ui_template.html"), encoding="utf-8") as f:
+        match = re.search(r"/monaco-editor/([\w.-]+)/min/vs", f.read())
+    if match is None:
+        sys.exit("Could not find the Monaco version in ui_template.html, pass --version")
+    return match.group(1)
+
+
+def download(url):
+    print(f"Downloading {url}")
+    with urllib.request.urlopen(url, timeout=120) as response:
+        return response.read()
+
+
+def keep(path):
+    """Whether a file below min/vs belongs in the local copy"""
+    parts = path.split("/")
+    if re.search(r"\.nls\.[\w-]+\.js$", path):
+        return False
+    if parts[0] == "basic-languages" and len(parts) > 2:
+        return parts[1] in BASIC_LANGUAGES
+    if parts[0] == "language" and len(parts) > 2:
+        return parts[1] in LANGUAGE_SERVICES
+    return True
+
+
+def extract(tarball, dest):
+    """Unpack package/min/vs from the npm tarball into dest/vs"""
+    kept = 0
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode="r:gz") as archive:
+        for member in archive.getmembers():
+            if not member.isfile() or not member.name.startswith("package/min/vs/"):
+                continue
+            path = member.name[len("package/min/vs/"):]
+            if ".." in path.split("/") or not keep(path):
+                continue
+            target = os.path.join(dest, "vs", *path.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.extractfile(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            kept += 1
+    return kept
+
+
+def precompress(root):
+    """Write .gz and .br copies of every compressible file below root"""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(COMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path + ".gz", "wb") as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(path + ".br", "wb") as f:
+                    f.write(brotli.compress(data, quality=11))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--version", help="monaco-editor version (default: the one ui_template.html uses)")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY, help="npm registry URL")
+    parser.add_argument("--dest", default=DEFAULT_DEST, help="directory to install into")
+    args = parser.parse_args()
+
+    version = args.version or template_version()
+    target = os.path.join(args.dest, version)
+    if os.path.isfile(os.path.join(target, "vs", "loader.js")):
+        print(f"Monaco {version} is already installed in {target}")
+        return
+
+    tarball = download(f"{args.registry.rstrip('/')}/monaco-editor/-/monaco-editor-{version}.tgz")
+    os.makedirs(args.dest, exist_ok=True)
+    # Build in a temporary directory so a failed run never leaves half a copy
+    staging = tempfile.mkdtemp(prefix=f".{version}-", dir=args.dest)
+    try:
+        kept = extract(tarball, staging)
+        if not os.path.isfile(os.path.join(staging, "vs", "loader.js")):
+            sys.exit("Downloaded package has no min/vs/loader.js")
+        precompress(staging)
+        os.chmod(staging, 0o755)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    print(f"Installed Monaco {version} ({kept} files) in {target}"
+          f"{'' if brotli else ' - install brotli for .br copies'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local OpenAI-compatible server for trying the AI features offline
+
+Answers POST /v1/chat/completions, streamed or not, by echoing the last
+user message back one word at a time. Point the server at it with
+OPENAI_BASE_URL=http://127.0.0.1:8089/v1 and any API key; the key
+"invalid" is rejected, so error handling can be exercised too.
+
+Usage: python3 mock_openai.py [--port N] [--token-delay S] [--missing-models a,b]
+                              [--slow-models a,b --slow-delay S]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+
+def error_response(status, message, code):
+    return web.json_response({"error": {"message": message, "type": "invalid_request_error", "code": code}}, status=status)
+
+
+def make_app(token_delay, missing_models, slow_models=(), slow_delay=0):
+    async def chat_completions(request):
+        if request.headers.get("Authorization") == "Bearer invalid":
+            return error_response(401, "Incorrect API key provided: invalid", "invalid_api_key")
+        data = await request.json()
+        model = data.get("model", "")
+        if model in missing_models:
+            return error_response(404, f"The model `{model}` does not exist or you do not have access to it.", "model_not_found")
+        if model in slow_models:
+            await asyncio.sleep(slow_delay)
+
+        prompt = next((m["content"] for m in reversed(data.get("messages", [])) if m.get("role") == "user"), "")
+        words = f"Echo: {prompt}".split(" ")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not data.get("stream"):
+            await asyncio.sleep(token_delay * len(words))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(words), "total_tokens": len(prompt.split()) + len(words)},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            await asyncio.sleep(token_delay)
+            await send({"content": word if i == 0 else " " + word})
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089, help="port to listen on")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="seconds between streamed words")
+    parser.add_argument("--missing-models", default="", help="comma-separated models to answer with 404")
+    parser.add_argument("--slow-models", default="", help="comma-separated models that wait --slow-delay before answering")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="extra seconds taken by slow models")
+    args = parser.parse_args()
+
+    missing_models = set(filter(None, args.missing_models.split(",")))
+    slow_models = set(filter(None, args.slow_models.split(",")))
+    web.run_app(make_app(args.token_delay, missing_models, slow_models, args.slow_delay), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env node
+/*
+ * Warm JavaScript runner for the /api/run-javascript endpoint
+ *
+ * Reads one JSON request per line from stdin ({code, cwd, timeout, max_output,
+ * max_spill, spill}), runs the code as a CommonJS module in a fresh vm context
+ * and answers with one line on stdout: "\x1eHFS" followed by {stdout, stderr,
+ * return_code, recycle}. A run is finished once the code and every timer,
+ * socket or file operation it started have completed. Timers still pending
+ * when a run ends early are cleared; if anything else is left behind, recycle
+ * asks the server to replace this worker.
+ *
+ * stdout and stderr are base64: the first max_output bytes of each stream.
+ * Anything beyond that is written to the file named in spill.stdout or
+ * spill.stderr, up to max_spill bytes.
+ */
+
+'use strict';
+
+const asyncHooks = require('async_hooks');
+const fs = require('fs');
+const Module = require('module');
+const path = require('path');
+const readline = require('readline');
+const util = require('util');
+const vm = require('vm');
+
+const MARKER = '\x1eHFS';
+const realStdoutWrite = process.stdout.write.bind(process.stdout);
+
+let current = null;   // state of the run in progress
+let internal = false; // set while the runner itself creates async resources
+
+// Output of one stream: the start in memory, the rest in the spill file
+class Sink {
+    constructor(limit, spillPath, spillLimit) {
+        this.chunks = [];
+        this.kept = 0;
+        this.limit = limit === undefined ? Infinity : limit;
+        this.spillPath = spillPath;
+        this.spillLimit = spillLimit === undefined ? Infinity : spillLimit;
+        this.spilled = 0;
+        this.fd = null;
+    }
+
+    write(data) {
+        const room = this.limit - this.kept;
+        if (room > 0) {
+            const head = data.subarray(0, room);
+            this.chunks.push(head);
+            this.kept += head.length;
+            data = data.subarray(head.length);
+        }
+        data = data.subarray(0, Math.max(this.spillLimit - this.spilled, 0));
+        if (!data.length || !this.spillPath) return;
+        if (this.fd === null) this.fd = fs.openSync(this.spillPath, 'w');
+        fs.writeSync(this.fd, data);
+        this.spilled += data.length;
+    }
+
+    finish() {
+        if (this.fd !== null) fs.closeSync(this.fd);
+        return Buffer.concat(this.chunks).toString('base64');
+    }
+}
+
+// All writes to stdout/stderr belong to the current run
+function capture(name) {
+    return (chunk, encoding, callback) => {
+        if (typeof encoding === 'function') callback = encoding;
+        if (current) {
+            current[name].write(typeof chunk === 'string'
+                ? Buffer.from(chunk, typeof encoding === 'string' ? encoding : 'utf8')
+                : Buffer.from(chunk));
+        }
+        if (callback) callback();
+        return true;
+    };
+}
+process.stdout.write = capture('stdout');
+process.stderr.write = capture('stderr');
+
+// Track async resources created by user code so we know when it is done,
+// and can clean up after runs that end while some are still alive
+const pending = new Map();
+asyncHooks.createHook({
+    init(asyncId, type, triggerAsyncId, resource) {
+        if (current && !internal && type !== 'PROMISE') pending.set(asyncId, { type, resource });
+    },
+    destroy(asyncId) {
+        pending.delete(asyncId);
+    },
+}).enable();
+
+class ExitSignal {
+    constructor(code) {
+        this.code = code;
+    }
+}
+
+function reportError(err) {
+    if (err instanceof ExitSignal) {
+        current.returnCode = err.code;
+        return;
+    }
+    let text = err && err.stack ? err.stack : util.inspect(err);
+    // Drop the runner's own frames from the trace
+    text = text.split('\n').filter((line) => !line.includes(__filename) && !/[( ]node:/.test(line)).join('\n');
+    current.stderr.write(Buffer.from(text + '\n'));
+    current.returnCode = 1;
+}
+
+process.on('uncaughtException', (err) => {
+    if (current) {
+        reportError(err);
+        finish();
+    }
+});
+process.on('unhandledRejection', (err) => {
+    if (current) {
+        reportError(err);
+        finish();
+    }
+});
+
+// Forget modules loaded by earlier runs so each run sees fresh module state
+function purgeRequireCache() {
+    for (const key of Object.keys(require.cache)) {
+        if (key !== __filename) delete require.cache[key];
+    }
+}
+
+function makeContext(filename) {
+    purgeRequireCache();
+    const userRequire = Module.createRequire(filename);
+    // process.exit() ends the run instead of the worker
+    const userProcess = Object.create(process, {
+        exit: {
+            value: (code) => {
+                throw new ExitSignal(code === undefined ? 0 : code);
+            },
+        },
+    });
+    const context = {
+        console,
+        process: userProcess,
+        Buffer,
+        URL,
+        URLSearchParams,
+        TextEncoder,
+        TextDecoder,
+        AbortController,
+        setTimeout,
+        clearTimeout,
+        setInterval,
+        clearInterval,
+        setImmediate,
+        clearImmediate,
+        queueMicrotask,
+        structuredClone,
+        fetch: globalThis.fetch,
+        require: userRequire,
+    };
+    context.global = context;
+    context.globalThis = context;
+    return vm.createContext(context);
+}
+
+// Stop what the run left running; returns true if some of it can't be stopped
+function releasePending() {
+    let leftover = false;
+    for (const { type, resource } of pending.values()) {
+        if (type === 'Timeout') {
+            clearTimeout(resource); // also clears intervals
+        } else if (type === 'Immediate') {
+            clearImmediate(resource);
+        } else if (type !== 'TickObject' && type !== 'Microtask') {
+            // Sockets, servers, file and DNS requests: close what we can,
+            // but the worker can't be trusted to be clean any more
+            if (resource && typeof resource.close === 'function') {
+                try {
+                    resource.close();
+                } catch (err) {
+                    // Already closing
+                }
+            }
+            leftover = true;
+        }
+    }
+    pending.clear();
+    return leftover;
+}
+
+function finish() {
+    if (!current || current.done) return;
+    current.done = true;
+    const result = {
+        stdout: current.stdout.finish(),
+        stderr: current.stderr.finish(),
+        return_code: current.returnCode,
+    };
+    current = null;
+    result.recycle = releasePending();
+    realStdoutWrite(MARKER + JSON.stringify(result) + '\n');
+}
+
+// Poll until user code has no outstanding async work
+function waitForIdle() {
+    if (!current || current.done) return;
+    if (pending.size === 0) {
+        finish();
+        return;
+    }
+    internal = true;
+    setTimeout(waitForIdle, 5);
+    internal = false;
+}
+
+function run(request) {
+    const spill = request.spill || {};
+    current = {
+        stdout: new Sink(request.max_output, spill.stdout, request.max_spill),
+        stderr: new Sink(request.max_output, spill.stderr, request.max_spill),
+        returnCode: 0,
+        done: false,
+    };
+    const cwd = request.cwd || process.cwd();
+    try {
+        process.chdir(cwd);
+    } catch (err) {
+        // Keep the previous directory
+    }
+    const filename = path.join(process.cwd(), '[eval].js');
+
+    try {
+        const context = makeContext(filename);
+        context.__hfs_module = { exports: {}, filename, id: '.', loaded: false };
+        context.__filename = filename;
+        context.__dirname = path.dirname(filename);
+        // Wrap like a CommonJS module, invoking it inside the script so the
+        // vm timeout also covers the synchronous part of the run
+        const source = '(function (exports, require, module, __filename, __dirname) {' + request.code +
+            '\n}).call(__hfs_module.exports, __hfs_module.exports, require, __hfs_module, __filename, __dirname);';
+        vm.runInContext(source, context, {
+            filename,
+            displayErrors: false,
+            timeout: request.timeout ? request.timeout * 1000 : undefined,
+        });
+    } catch (err) {
+        reportError(err);
+        finish();
+        return;
+    }
+
+    // Let microtasks settle before checking for pending work
+    internal = true;
+    setImmediate(waitForIdle);
+    internal = false;
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+lines.on('line', (line) => {
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (err) {
+        return;
+    }
+    run(request);
+});
+lines.on('close', () => process.exit(0));
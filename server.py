@@ -6,20 +6,49 @@ This keeps the space alive and provides a basic web interface
 """
 
 from fastapi import FastAPI, Request, HTTPException, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
 import uvicorn
 import os
 import logging
 import subprocess
 import configparser
 import tempfile
-import traceback
 import json
 import sys
+import asyncio
+import signal
+import codecs
+import time
+import uuid
+import pty
+import termios
+import contextvars
+import shutil
+import hashlib
+import resource
+import socket
+import shlex
+import base64
+import py_compile
+import hmac
+import contextlib
+import gzip
+import re
+import sqlite3
+import concurrent.futures
+import math
+import mimetypes
+from collections import OrderedDict, deque
 from io import StringIO
 
+import eval_worker
+import metrics
+
 # Configure logging first
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
@@ -37,11 +66,17 @@ except ImportError:
     logger.warning("OpenAI library not available. AI chat features will be disabled.")
 
 try:
-    import requests as req_lib
-    REQUESTS_AVAILABLE = True
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    logger.warning("aiohttp library not available. API testing features will be disabled.")
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
 except ImportError:
-    REQUESTS_AVAILABLE = False
-    logger.warning("Requests library not available. API testing features will be disabled.")
+    BROTLI_AVAILABLE = False
 
 app = FastAPI()
 
@@ -54,42 +89,2022 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global state for persistent shell session
+# Admission control: endpoint class -> (max running, max waiting), each
+# overridable as HFS_LIMIT_<CLASS>=running:waiting, e.g. HFS_LIMIT_RUN_FILE=4:8
+ADMISSION_DEFAULTS = {
+    "execute": (32, 64),
+    "eval": (16, 32),
+    "run-file": (8, 16),
+    "run-javascript": (16, 32),
+    "ai-chat": (16, 32),
+    "test-api": (16, 32),
+}
+ADMISSION_ROUTES = {
+    "/api/execute": "execute",
+    "/api/execute/stream": "execute",
+    "/api/eval": "eval",
+    "/api/run-file": "run-file",
+    "/api/run-javascript": "run-javascript",
+    "/api/ai-chat": "ai-chat",
+    "/api/ai-chat/stream": "ai-chat",
+    "/api/test-api": "test-api",
+    "/api/test-api/load": "test-api",
+}
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("HFS_ADMISSION_QUEUE_TIMEOUT", 10))
+
+def _admission_limits(name):
+    running, waiting = ADMISSION_DEFAULTS[name]
+    value = os.environ.get("HFS_LIMIT_" + name.upper().replace("-", "_"), "")
+    if value:
+        running_text, _, waiting_text = value.partition(":")
+        running = int(running_text)
+        waiting = int(waiting_text) if waiting_text else running * 2
+    return running, waiting
+
+class AdmissionGate:
+    """Bounds the requests of one endpoint class running and waiting at once
+    
+    A request is admitted when fewer than limit are running, otherwise it
+    waits in a queue of at most queue_limit. A full queue is refused at
+    once (429) and a request that waits longer than queue_timeout gives up
+    (503); both carry a Retry-After estimated from recent request times.
+    """
+
+    def __init__(self, name, limit, queue_limit, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._semaphore = None
+        self._durations = deque(maxlen=50)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, at least 1"""
+        mean = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(mean * (self.waiting + 1) / self.limit))
+
+    async def acquire(self):
+        """Wait for a slot; returns None when admitted, else the HTTP status to refuse with"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_limit:
+                self.rejected_queue_full += 1
+                admission_rejected.inc(self.name, "queue_full")
+                return 429
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                admission_rejected.inc(self.name, "timeout")
+                return 503
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.running += 1
+        self.admitted += 1
+        return None
+
+    def release(self, duration):
+        self.running -= 1
+        self._durations.append(duration)
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_limit": self.queue_limit,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+admission_gates = {
+    name: AdmissionGate(name, *_admission_limits(name), ADMISSION_QUEUE_TIMEOUT)
+    for name in ADMISSION_DEFAULTS
+}
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the admission gate of each endpoint class
+    
+    The slot is held until the response is fully sent, so streaming
+    endpoints count as running for as long as they stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        gate = None
+        if scope["type"] == "http" and scope["method"] != "OPTIONS":
+            gate = admission_gates.get(ADMISSION_ROUTES.get(scope["path"].rstrip("/") or "/"))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        
+        status = await gate.acquire()
+        if status is not None:
+            retry_after = gate.retry_after()
+            logger.warning(f"Refused {gate.name} request with {status}: {gate.running} running, {gate.waiting} waiting")
+            response = JSONResponse(
+                {"success": False, "error": f"Server busy: too many {gate.name} requests, retry in {retry_after} seconds"},
+                status_code=status,
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.monotonic() - start)
+
+app.add_middleware(AdmissionMiddleware)
+
+# ===== Metrics =====
+http_requests = metrics.Counter("hfs_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+http_duration = metrics.Histogram("hfs_http_request_duration_seconds", "HTTP request latency, including admission queueing", ["route"])
+http_response_bytes = metrics.Counter("hfs_http_response_bytes_total", "Response body bytes sent", ["route"])
+http_in_flight = metrics.Gauge("hfs_http_requests_in_flight", "HTTP requests being handled")
+admission_running = metrics.Gauge("hfs_admission_running", "Requests running per endpoint class", ["class"])
+admission_waiting = metrics.Gauge("hfs_admission_waiting", "Requests queued per endpoint class", ["class"])
+admission_rejected = metrics.Counter("hfs_admission_rejected_total", "Requests refused per endpoint class", ["class", "reason"])
+process_spawns = metrics.Counter("hfs_process_spawns_total", "Processes started, by kind", ["kind"])
+process_duration = metrics.Histogram("hfs_process_duration_seconds", "Run time of commands and scripts", ["kind"])
+process_exits = metrics.Counter("hfs_process_exits_total", "Finished commands by exit code", ["kind", "code"])
+process_timeouts = metrics.Counter("hfs_process_timeouts_total", "Commands killed for exceeding their timeout", ["kind"])
+process_output_bytes = metrics.Counter("hfs_process_output_bytes_total", "Output bytes returned by commands", ["kind"])
+processes_running = metrics.Gauge("hfs_processes_running", "Commands running now", ["kind"])
+process_cpu_seconds = metrics.Counter("hfs_process_cpu_seconds_total", "CPU time used by commands", ["kind", "mode"])
+process_max_rss = metrics.Histogram("hfs_process_max_rss_bytes", "Peak resident memory of commands", ["kind"],
+                                    buckets=tuple(2 ** n * 1024 * 1024 for n in range(0, 14)))
+eval_duration = metrics.Histogram("hfs_eval_duration_seconds", "Python evaluation time", ["mode"])
+worker_runs = metrics.Histogram("hfs_worker_run_duration_seconds", "Run time of requests served by worker pools", ["pool"])
+worker_restarts = metrics.Counter("hfs_worker_restarts_total", "Pool workers replaced", ["pool", "reason"])
+ai_upstream_duration = metrics.Histogram("hfs_ai_upstream_duration_seconds", "Latency of OpenAI API calls until the response starts", ["model", "outcome"])
+ai_hedges = metrics.Counter("hfs_ai_hedged_requests_total", "AI requests also sent to a second model")
+
+for _name in admission_gates:
+    # Present from the start, so rate() sees the first refusal
+    admission_rejected.inc(_name, "queue_full", amount=0)
+    admission_rejected.inc(_name, "timeout", amount=0)
+
+def record_process(kind, started, returncode=None, timed_out=False, output_bytes=0, usage=None):
+    """Record a finished command in the process metrics"""
+    process_duration.observe(time.monotonic() - started, kind)
+    if timed_out:
+        process_timeouts.inc(kind)
+    else:
+        # Negative codes mean the process was killed by a signal
+        process_exits.inc(kind, returncode if returncode is not None and returncode >= 0 else "signal")
+    process_output_bytes.inc(kind, amount=output_bytes)
+    if usage:
+        if usage["cpu_user"] is not None:
+            process_cpu_seconds.inc(kind, "user", amount=usage["cpu_user"])
+            process_cpu_seconds.inc(kind, "system", amount=usage["cpu_system"])
+        if usage["max_rss"] is not None:
+            process_max_rss.observe(usage["max_rss"], kind)
+
+_route_labels = {}
+
+def route_label(scope, path):
+    """Route template of a handled request, keeping label values bounded"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        # Refused before routing
+        return path if path in ADMISSION_ROUTES else "unmatched"
+    if endpoint not in _route_labels:
+        for route in app.routes:
+            _route_labels[getattr(route, "endpoint", None) or getattr(route, "app", None)] = route.path
+    return _route_labels.get(endpoint, "unmatched")
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests, latency and response bytes per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        path = scope["path"]
+        status = 500
+        sent = 0
+        
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+        
+        start = time.monotonic()
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            route = route_label(scope, path)
+            http_requests.inc(scope["method"], route, status)
+            http_duration.observe(time.monotonic() - start, route)
+            http_response_bytes.inc(route, amount=sent)
+
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics")
+async def metrics_endpoint(admin_id: str = ""):
+    """Metrics in the Prometheus text exposition format
+    
+    Scrapers pass admin_id as a URL parameter (`params` in the Prometheus
+    scrape config).
+    """
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=403)
+    
+    for name, gate in admission_gates.items():
+        admission_running.set(gate.running, name)
+        admission_waiting.set(gate.waiting, name)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admission")
+async def admission_info(admin_id: str = ""):
+    """Running and waiting requests and refusals per endpoint class"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    return {
+        "success": True,
+        "queue_timeout": ADMISSION_QUEUE_TIMEOUT,
+        "classes": {name: gate.stats() for name, gate in admission_gates.items()}
+    }
+
+# Starting state for new shell sessions
 shell_state = {
     "cwd": os.getcwd(),  # Current working directory
     "env": dict(os.environ)  # Environment variables
 }
 
 # Load config for authentication
+CONFIG_PATH = "config"
+CONFIG_CHECK_INTERVAL = float(os.environ.get("HFS_CONFIG_CHECK_INTERVAL", 1.0))
+
+class ConfigCache:
+    """Parsed config file kept in memory
+
+    The file is stat'ed at most once per check_interval and only re-parsed
+    when its inode, mtime or size changes.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.config = None
+        self.admin_cid = None
+        self._signature = None
+        self._checked = None
+
+    def _reload(self, signature):
+        self._signature = signature
+        self.config = None
+        self.admin_cid = None
+        if signature is None:
+            # WARNING: This is insecure in production. Always use a config file with proper admin_id
+            logger.warning("No config file found - running in insecure demo mode")
+            return
+        config = configparser.ConfigParser()
+        config.read(self.path)
+        self.config = config
+        if "SecretConfig" in config:
+            self.admin_cid = config["SecretConfig"].get("admincid", "").encode()
+        logger.info("Loaded config file")
+
+    def get(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            first_load = self._checked is None
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature = None
+            if first_load or signature != self._signature:
+                self._reload(signature)
+        return self.config
+
+config_cache = ConfigCache(CONFIG_PATH, CONFIG_CHECK_INTERVAL)
+
 def load_config():
     """Load configuration file"""
-    config = configparser.ConfigParser()
-    if os.path.exists("config"):
-        config.read("config")
-        return config
-    return None
+    return config_cache.get()
 
 def verify_admin(chat_id: str):
     """Verify if the provided chat_id matches admin"""
-    config = load_config()
+    config = config_cache.get()
     if config and "SecretConfig" in config:
-        admin_cid = config["SecretConfig"].get("admincid", "")
-        return str(chat_id) == str(admin_cid)
+        return hmac.compare_digest(str(chat_id).encode(), config_cache.admin_cid)
     # If no config, allow access for demo purposes in restricted environments
-    # WARNING: This is insecure in production. Always use a config file with proper admin_id
-    logger.warning("No config file found - running in insecure demo mode")
     return True
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Root endpoint that returns a professional web interface"""
+# ===== Execution Engine =====
+# Processes never block the event loop. Uploaded scripts, and JavaScript run
+# without a warm worker, go through run_subprocess(), and terminal commands
+# through the session's ShellSession; both hold a slot of the execution semaphore while
+# they run, so a slow command only occupies its own slot. Warm Python and
+# Node.js workers are bounded by the size of their pools, and background jobs
+# by JOB_CONCURRENCY.
+EXEC_TIMEOUT = 30
+EXEC_MAX_CONCURRENCY = int(os.environ.get("HFS_EXEC_CONCURRENCY", (os.cpu_count() or 1) * 4))
+
+_exec_semaphore = None
+
+def _get_exec_semaphore():
+    """Create the concurrency semaphore lazily inside the running loop"""
+    global _exec_semaphore
+    if _exec_semaphore is None:
+        _exec_semaphore = asyncio.Semaphore(EXEC_MAX_CONCURRENCY)
+    return _exec_semaphore
+
+# ===== Resource Limits =====
+# Every process spawned for /api/execute, /api/run-file, /api/run-javascript
+# and background jobs gets rlimits (CPU seconds, address space, file size, process count), and, when
+# HFS_CGROUP_ROOT names a delegated cgroup v2 directory, a cgroup of its own
+# with memory, process and CPU bandwidth limits. Executions report their CPU
+# time, peak RSS and wall time. A limit of 0 means unlimited.
+RLIMIT_CPU = int(os.environ.get("HFS_RLIMIT_CPU", 120))
+RLIMIT_MEMORY_MB = int(os.environ.get("HFS_RLIMIT_MEMORY_MB", 0))
+RLIMIT_FSIZE_MB = int(os.environ.get("HFS_RLIMIT_FSIZE_MB", 1024))
+RLIMIT_NPROC = int(os.environ.get("HFS_RLIMIT_NPROC", 4096))
+CGROUP_ROOT = os.environ.get("HFS_CGROUP_ROOT", "")
+CGROUP_MEMORY_MB = int(os.environ.get("HFS_CGROUP_MEMORY_MB", 0))
+CGROUP_PIDS = int(os.environ.get("HFS_CGROUP_PIDS", 0))
+CGROUP_CPUS = float(os.environ.get("HFS_CGROUP_CPUS", 0))
+CGROUP_PERIOD_USEC = 100000
+# Seconds between SIGXCPU at the CPU limit and SIGKILL
+RLIMIT_CPU_GRACE = 5
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+def _rlimits(cpu=RLIMIT_CPU):
+    """(resource, soft, hard) for each configured limit, within the hard limits we have"""
+    limits = []
+    for name, value in (("RLIMIT_CPU", cpu), ("RLIMIT_AS", RLIMIT_MEMORY_MB * 1024 * 1024),
+                        ("RLIMIT_FSIZE", RLIMIT_FSIZE_MB * 1024 * 1024), ("RLIMIT_NPROC", RLIMIT_NPROC)):
+        if value <= 0 or not hasattr(resource, name):
+            continue
+        limit = getattr(resource, name)
+        soft = hard = value
+        if name == "RLIMIT_CPU":
+            hard += RLIMIT_CPU_GRACE
+        current = resource.getrlimit(limit)[1]
+        if current != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current), min(hard, current)
+        limits.append((limit, soft, hard))
+    return limits
+
+EXEC_RLIMITS = _rlimits()
+PRLIMIT = shutil.which("prlimit")
+PRLIMIT_OPTIONS = {"RLIMIT_CPU": "--cpu", "RLIMIT_AS": "--as", "RLIMIT_FSIZE": "--fsize", "RLIMIT_NPROC": "--nproc"}
+
+if EXEC_RLIMITS and not PRLIMIT:
+    logger.warning("prlimit (util-linux) not found; rlimits are applied after each process starts "
+                   "and miss any children it forks before that")
+
+def _process_rlimits(warm, limits=None):
+    """limits (EXEC_RLIMITS by default) for a new process
+
+    Warm workers run many executions, so their CPU limit is only a soft one
+    that renew_cpu_limit() moves forward before each run.
+    """
+    return [(limit, soft, resource.RLIM_INFINITY if warm and limit == resource.RLIMIT_CPU else hard)
+            for limit, soft, hard in (EXEC_RLIMITS if limits is None else limits)]
+
+def exec_wrapper(args, cgroup=None, tty=None, warm=False, limits=None):
+    """args wrapped in a small sh script that sets the process up before exec'ing them
+
+    The script moves itself into cgroup, makes tty (a terminal path) its stdio
+    and, as the session leader, its controlling terminal, and runs args under
+    prlimit with limits (EXEC_RLIMITS by default). This takes the place of a
+    preexec_fn, which isn't safe to use from a process with threads. Pass the
+    process to apply_rlimits() once it has started in case prlimit isn't
+    installed.
+    """
+    steps = []
+    if cgroup is not None:
+        procs = os.path.join(cgroup.path, "cgroup.procs")
+        steps.append(f"echo $$ > {shlex.quote(procs)} || exit 126")
+    if tty:
+        steps.append(f"exec 0<>{shlex.quote(tty)} 1>&0 2>&0")
+    limits = _process_rlimits(warm, limits) if PRLIMIT else []
+    if not steps and not limits:
+        return list(args)
+    command = ["exec"]
+    if limits:
+        names = {getattr(resource, name): option for name, option in PRLIMIT_OPTIONS.items()}
+        command.append(PRLIMIT)
+        for limit, soft, hard in limits:
+            hard = "unlimited" if hard == resource.RLIM_INFINITY else hard
+            command.append(f"{names[limit]}={soft}:{hard}")
+        command.append("--")
+    steps.append(" ".join(shlex.quote(part) for part in command) + ' "$@"')
+    return ["/bin/sh", "-c", "; ".join(steps), "hfs-exec", *args]
+
+def apply_rlimits(pid, warm=False, limits=None):
+    """Apply limits (EXEC_RLIMITS by default) to a started process when exec_wrapper() couldn't"""
+    if PRLIMIT:
+        return
+    for limit, soft, hard in _process_rlimits(warm, limits):
+        try:
+            resource.prlimit(pid, limit, (soft, hard))
+        except OSError:
+            pass
+
+def proc_cpu_times(pid):
+    """User and system CPU seconds of a live process, including children it has reaped"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    utime, stime, cutime, cstime = (int(value) / CLOCK_TICKS for value in fields[11:15])
+    return utime + cutime, stime + cstime
+
+def proc_cpu_since(pid, before):
+    """CPU seconds a live process has used since proc_cpu_times() returned before"""
+    after = proc_cpu_times(pid)
+    if not before or not after:
+        return None
+    return after[0] - before[0], after[1] - before[1]
+
+def reset_peak_rss(pid):
+    """Restart the peak RSS (VmHWM) count of a live process"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss(pid):
+    """Peak RSS of a live process in bytes since start or reset_peak_rss()"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def renew_cpu_limit(pid):
+    """Give a warm worker RLIMIT_CPU seconds of CPU on top of what it has used so far"""
+    if RLIMIT_CPU <= 0:
+        return
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+        used = math.ceil((int(fields[11]) + int(fields[12])) / CLOCK_TICKS)
+        hard = resource.prlimit(pid, resource.RLIMIT_CPU)[1]
+        resource.prlimit(pid, resource.RLIMIT_CPU, (used + RLIMIT_CPU, hard))
+    except (OSError, ValueError):
+        pass
+
+def usage_info(wall, cpu=None, max_rss=None):
+    """The usage block of an execution's response"""
+    return {
+        "wall_time": round(wall, 3),
+        "cpu_user": round(cpu[0], 3) if cpu else None,
+        "cpu_system": round(cpu[1], 3) if cpu else None,
+        "max_rss": max_rss,
+    }
+
+class ExecCgroup:
+    """A cgroup v2 group for one execution or session, below CGROUP_ROOT"""
+
+    # Names of groups in use, which the sweeper must leave alone
+    live = set()
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def create(cls):
+        """Make a group with the configured limits; None when cgroups are off or unusable"""
+        if not CGROUP_ROOT:
+            return None
+        name = f"hfs-{uuid.uuid4().hex}"
+        path = os.path.join(CGROUP_ROOT, name)
+        limits = {}
+        if CGROUP_MEMORY_MB > 0:
+            limits["memory.max"] = str(CGROUP_MEMORY_MB * 1024 * 1024)
+            limits["memory.swap.max"] = "0"
+        if CGROUP_PIDS > 0:
+            limits["pids.max"] = str(CGROUP_PIDS)
+        if CGROUP_CPUS > 0:
+            limits["cpu.max"] = f"{int(CGROUP_CPUS * CGROUP_PERIOD_USEC)} {CGROUP_PERIOD_USEC}"
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            logger.warning(f"Could not create cgroup {path}: {e}")
+            return None
+        cls.live.add(name)
+        for filename, value in limits.items():
+            try:
+                with open(os.path.join(path, filename), "w") as f:
+                    f.write(value)
+            except OSError:
+                # Controller not enabled in the parent's cgroup.subtree_control;
+                # check_cgroup_root() has warned about it
+                pass
+        return cls(path)
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.path, filename)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def cpu_times(self):
+        """User and system CPU seconds of everything that ran in the group"""
+        stat = self._read("cpu.stat")
+        if not stat:
+            return None
+        values = dict(line.split() for line in stat.splitlines() if line.count(" ") == 1)
+        try:
+            return int(values["user_usec"]) / 1e6, int(values["system_usec"]) / 1e6
+        except (KeyError, ValueError):
+            return None
+
+    def peak_memory(self):
+        value = self._read("memory.peak")
+        return int(value) if value and value.strip().isdigit() else None
+
+    def kill(self):
+        """Kill every process in the group"""
+        try:
+            with open(os.path.join(self.path, "cgroup.kill"), "w") as f:
+                f.write("1")
+        except OSError:
+            pass
+
+    def remove(self):
+        """Kill anything left in the group and delete it
+
+        A group that is still draining is left for the sweeper.
+        """
+        ExecCgroup.live.discard(os.path.basename(self.path))
+        self.kill()
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+def sweep_cgroups():
+    """Remove leftover groups below CGROUP_ROOT that are no longer in use"""
+    try:
+        entries = list(os.scandir(CGROUP_ROOT))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith("hfs-") and entry.name not in ExecCgroup.live and entry.is_dir():
+            ExecCgroup(entry.path).remove()
+
+async def _cgroup_sweeper():
+    while True:
+        sweep_cgroups()
+        await asyncio.sleep(60)
+
+@app.on_event("startup")
+async def check_cgroup_root():
+    if not CGROUP_ROOT:
+        return
+    try:
+        with open(os.path.join(CGROUP_ROOT, "cgroup.subtree_control")) as f:
+            enabled = set(f.read().split())
+    except OSError as e:
+        logger.warning(f"HFS_CGROUP_ROOT {CGROUP_ROOT} is not a usable cgroup v2 directory: {e}")
+        return
+    wanted = {"memory": CGROUP_MEMORY_MB, "pids": CGROUP_PIDS, "cpu": CGROUP_CPUS}
+    missing = [name for name, value in wanted.items() if value > 0 and name not in enabled]
+    if missing:
+        logger.warning(f"Controllers {', '.join(missing)} are not enabled in {CGROUP_ROOT}/cgroup.subtree_control; "
+                       f"their limits will not apply")
+    asyncio.ensure_future(_cgroup_sweeper())
+
+class ExecProcess:
+    """A child process reaped with wait4() so its resource usage is known
+
+    Stands in for asyncio.subprocess.Process in the execution engine, with
+    pid, returncode, stdout and stderr stream readers and wait(), and runs
+    with EXEC_RLIMITS in a cgroup of its own when those are enabled. When it
+    exits, anything it left running in its cgroup is killed.
+    """
+
+    def __init__(self, popen, cgroup):
+        self._popen = popen
+        self.pid = popen.pid
+        self.cgroup = cgroup
+        self.returncode = None
+        self.rusage = None
+        self.stdout = None
+        self.stderr = None
+        self._started = time.monotonic()
+        self._finished = None
+        self._exit = asyncio.get_running_loop().create_future()
+
+    @classmethod
+    async def spawn(cls, args, shell=False, cwd=None, env=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    limits=None):
+        """Start args (a command string when shell is True) with stdout and stderr piped
+
+        stdout and stderr take the same values as for subprocess.Popen;
+        limits replaces EXEC_RLIMITS.
+        """
+        loop = asyncio.get_running_loop()
+        if shell:
+            args = ["/bin/sh", "-c", args]
+        cgroup = ExecCgroup.create()
+        try:
+            popen = subprocess.Popen(
+                exec_wrapper(args, cgroup, limits=limits),
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=stderr,
+                cwd=cwd,
+                env=env,
+                start_new_session=True,
+            )
+        except BaseException:
+            if cgroup is not None:
+                cgroup.remove()
+            raise
+        apply_rlimits(popen.pid, limits=limits)
+        
+        self = cls(popen, cgroup)
+        if popen.stdout is not None:
+            self.stdout = await self._connect(popen.stdout)
+        if popen.stderr is not None:
+            self.stderr = await self._connect(popen.stderr)
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # No pidfd (Linux before 5.3): wait on a thread instead
+            future = loop.run_in_executor(_get_wait_executor(), os.wait4, self.pid, 0)
+            future.add_done_callback(lambda f: self._reaped(*f.result()))
+        else:
+            def on_exit():
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+                self._reaped(*os.wait4(self.pid, 0))
+            loop.add_reader(pidfd, on_exit)
+        return self
+
+    @staticmethod
+    async def _connect(pipe):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(loop=loop)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+        return reader
+
+    def _reaped(self, pid, status, rusage):
+        self._finished = time.monotonic()
+        self.returncode = os.waitstatus_to_exitcode(status)
+        # Keeps subprocess from trying to reap it again
+        self._popen.returncode = self.returncode
+        self.rusage = rusage
+        if self.cgroup is not None:
+            # Background processes it left behind would hold the pipes open
+            self.cgroup.kill()
+        self._exit.set_result(self.returncode)
+
+    async def wait(self):
+        return await asyncio.shield(self._exit)
+
+    def usage(self):
+        """CPU time, peak RSS and wall time of the process and the children it waited for
+
+        With a cgroup, CPU and memory cover everything that ran in it. Peak
+        RSS needs the cgroup: wait4()'s ru_maxrss also counts the server's
+        memory the child was forked with, so without one it is None.
+        """
+        cpu = max_rss = None
+        if self.rusage is not None:
+            cpu = (self.rusage.ru_utime, self.rusage.ru_stime)
+        if self.cgroup is not None:
+            cpu = self.cgroup.cpu_times() or cpu
+            max_rss = self.cgroup.peak_memory()
+        return usage_info((self._finished or time.monotonic()) - self._started, cpu, max_rss)
+
+    def close(self):
+        """Release the process's cgroup, killing anything left in it"""
+        if self.cgroup is not None:
+            self.cgroup.remove()
+            self.cgroup = None
+
+_wait_executor = None
+
+def _get_wait_executor():
+    global _wait_executor
+    if _wait_executor is None:
+        _wait_executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXEC_MAX_CONCURRENCY, thread_name_prefix="wait4")
+    return _wait_executor
+
+# ===== Output Capture =====
+# Process output is kept as bytes. The first OUTPUT_MEMORY_LIMIT bytes stay in
+# memory for the response; once output grows past that, all of it goes to a
+# spill file under OUTPUT_SPILL_DIR that clients fetch in ranges by its ID.
+OUTPUT_MEMORY_LIMIT = int(os.environ.get("HFS_OUTPUT_MEMORY_KB", 1024)) * 1024
+OUTPUT_SPILL_MAX = int(os.environ.get("HFS_OUTPUT_SPILL_MAX_MB", 1024)) * 1024 * 1024
+OUTPUT_SPILL_DIR = os.environ.get("HFS_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "hfs-output"))
+OUTPUT_SPILL_MAX_AGE = int(os.environ.get("HFS_OUTPUT_MAX_AGE", 3600))
+OUTPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_RANGE_MAX = 8 * 1024 * 1024
+# Output is binary if its start contains NUL bytes or isn't valid UTF-8
+BINARY_SNIFF_SIZE = 8192
+
+class OutputCapture:
+    """Bounded, binary-safe buffer for one output stream of a process"""
+
+    def __init__(self):
+        self.head = bytearray()
+        self.size = 0
+        self.output_id = None
+        self.stored = 0
+        self._file = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is None and len(self.head) + len(data) <= OUTPUT_MEMORY_LIMIT:
+            self.head += data
+            return
+        if self._file is None:
+            self._spill()
+            room = OUTPUT_MEMORY_LIMIT - len(self.head)
+            self.head += data[:room]
+        data = data[:OUTPUT_SPILL_MAX - self.stored]
+        if data:
+            self._file.write(data)
+            self.stored += len(data)
+
+    def write_file(self, path):
+        """Append the contents of path, then delete it"""
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(OUTPUT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.write(chunk)
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _spill(self):
+        os.makedirs(OUTPUT_SPILL_DIR, exist_ok=True)
+        self.output_id = uuid.uuid4().hex
+        self._file = open(os.path.join(OUTPUT_SPILL_DIR, self.output_id), "wb")
+        self._file.write(self.head)
+        self.stored = len(self.head)
+
+    def finish(self):
+        """Close the spill file; binary output is spilled too so it can be downloaded"""
+        if self.binary and self._file is None:
+            self._spill()
+        if self._file is not None:
+            self._file.close()
+
+    def discard(self):
+        """Drop the output, removing any spill file"""
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except FileNotFoundError:
+                pass
+        self.head = bytearray()
+        self.size = self.stored = 0
+        self.output_id = self._file = None
+
+    @property
+    def binary(self):
+        sample = bytes(self.head[:BINARY_SNIFF_SIZE])
+        if b"\0" in sample:
+            return True
+        try:
+            # Not final: a character cut off by the sample size is fine
+            codecs.getincrementaldecoder("utf-8")().decode(sample)
+        except UnicodeDecodeError:
+            return True
+        return False
+
+    @property
+    def truncated(self):
+        return self.size > len(self.head)
+
+    def text(self):
+        """The in-memory part as text, without a character cut off at the end"""
+        return codecs.getincrementaldecoder("utf-8")(errors="replace").decode(bytes(self.head))
+
+    def info(self):
+        return {"output_bytes": self.size, "truncated": self.truncated, "binary": self.binary, "output_id": self.output_id}
+
+def output_response(capture, empty_message):
+    """The output text and capture details for a JSON response"""
+    if capture.binary:
+        output = f"[Binary output, {capture.size} bytes]"
+    else:
+        output = capture.text() or empty_message
+    if capture.output_id:
+        stored = "" if capture.stored == capture.size else f" (first {capture.stored} bytes kept)"
+        shown = "" if capture.binary else f"Showing {len(capture.head)} of {capture.size} bytes. "
+        output += f"\n\n[{shown}Full output{stored}: GET /api/output/{capture.output_id}]"
+    return {"output": output, **capture.info()}
+
+def clean_output_spills():
+    """Remove spill files older than OUTPUT_SPILL_MAX_AGE"""
+    try:
+        cutoff = time.time() - OUTPUT_SPILL_MAX_AGE
+        for entry in os.scandir(OUTPUT_SPILL_DIR):
+            if entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not clean output spill files: {e}")
+
+async def _output_spill_reaper():
+    while True:
+        await asyncio.get_running_loop().run_in_executor(None, clean_output_spills)
+        await asyncio.sleep(60)
+
+@app.on_event("startup")
+async def start_output_spill_reaper():
+    asyncio.ensure_future(_output_spill_reaper())
+
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        total = os.fstat(f.fileno()).st_size
+        f.seek(start)
+        return f.read(length), total
+
+async def byte_range_response(path, request, offset, length, missing_error):
+    """Serve part of a file, chosen by offset/length or a Range header (bytes=start-end)"""
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("range", "").strip())
+    if match:
+        offset = int(match.group(1))
+        if match.group(2):
+            length = int(match.group(2)) - offset + 1
+    offset = max(offset, 0)
+    length = max(0, min(length, OUTPUT_RANGE_MAX))
     
-    # Read and return the new UI template
-    template_path = os.path.join(os.path.dirname(__file__), "ui_template.html")
     try:
-        with open(template_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        data, total = await asyncio.get_running_loop().run_in_executor(None, _read_range, path, offset, length)
     except FileNotFoundError:
+        return JSONResponse({"success": False, "error": missing_error}, status_code=404)
+    
+    if offset >= total and total > 0:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+    headers = {"Accept-Ranges": "bytes", "X-Output-Size": str(total)}
+    if data:
+        headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/{total}"
+    partial = match is not None or len(data) < total
+    return Response(data, status_code=206 if partial else 200, media_type="application/octet-stream", headers=headers)
+
+@app.get("/api/output/{output_id}")
+async def get_output(output_id: str, request: Request, admin_id: str = "", offset: int = 0, length: int = OUTPUT_RANGE_MAX):
+    """Fetch a byte range of spilled output
+    
+    The range comes from offset/length or a standard Range header
+    (bytes=start-end); at most OUTPUT_RANGE_MAX bytes are returned at a time.
+    """
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    if not re.fullmatch(r"[0-9a-f]{32}", output_id):
+        return JSONResponse({"success": False, "error": "Invalid output ID"}, status_code=400)
+    return await byte_range_response(os.path.join(OUTPUT_SPILL_DIR, output_id), request, offset, length,
+                                     "Output not found or expired")
+
+class ExecResult:
+    """Outcome of a process started by run_subprocess()
+
+    stdout and stderr are OutputCapture objects; usage is the usage_info()
+    of the process.
+    """
+    __slots__ = ("stdout", "stderr", "returncode", "timed_out", "usage")
+
+    def __init__(self, stdout=None, stderr=None, returncode=None, timed_out=False, usage=None):
+        self.stdout = stdout or OutputCapture()
+        self.stderr = stderr or OutputCapture()
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.usage = usage
+
+def _kill_process_group(proc):
+    """Kill a process started with start_new_session=True and all its children"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def run_subprocess(args, shell=False, cwd=None, env=None, timeout=EXEC_TIMEOUT):
+    """Run a process without blocking the event loop
+
+    args is a command string when shell is True, otherwise an argv list.
+    At most EXEC_MAX_CONCURRENCY processes run at once; further callers wait
+    for a free slot. The process runs with the configured resource limits and
+    the result carries its usage. Raises FileNotFoundError if the executable
+    is missing.
+    """
+    async with _get_exec_semaphore():
+        proc = await ExecProcess.spawn(args, shell=shell, cwd=cwd, env=env)
+        kind = "shell" if shell else os.path.basename(args[0])
+        process_spawns.inc(kind)
+        processes_running.inc(kind)
+        started = time.monotonic()
+        stdout, stderr = OutputCapture(), OutputCapture()
+        
+        async def drain(pipe, capture):
+            while True:
+                chunk = await pipe.read(OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                capture.write(chunk)
+        
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(drain(proc.stdout, stdout), drain(proc.stderr, stderr), proc.wait()),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            _kill_process_group(proc)
+            await proc.wait()
+            usage = proc.usage()
+            record_process(kind, started, timed_out=True, usage=usage)
+            stdout.discard()
+            stderr.discard()
+            return ExecResult(returncode=proc.returncode, timed_out=True, usage=usage)
+        except asyncio.CancelledError:
+            # Client went away - don't leave the process running
+            _kill_process_group(proc)
+            stdout.discard()
+            stderr.discard()
+            raise
+        else:
+            usage = proc.usage()
+        finally:
+            processes_running.dec(kind)
+            proc.close()
+        
+        stdout.finish()
+        stderr.finish()
+        record_process(kind, started, proc.returncode, output_bytes=stdout.size + stderr.size, usage=usage)
+        return ExecResult(stdout, stderr, proc.returncode, usage=usage)
+
+# ===== Session Store =====
+# State that must look the same whichever worker process (HFS_WORKERS)
+# handles a request: each terminal session's working directory and exported
+# environment, and which worker owns a session's Python kernel. "memory" is
+# enough for a single worker; "sqlite" shares state between workers on one
+# host and "redis" between hosts.
+SESSION_STORE = os.environ.get("HFS_SESSION_STORE", "memory").strip().lower()
+SESSION_DB = os.environ.get("HFS_SESSION_DB", os.path.join(tempfile.gettempdir(), "hfs-sessions.sqlite3"))
+SESSION_TTL = int(os.environ.get("HFS_SESSION_TTL", 7 * 24 * 3600))
+REDIS_URL = os.environ.get("HFS_REDIS_URL", "redis://localhost:6379/0")
+# Identifies this worker process in ownership records
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class MemorySessionStore:
+    """Session state for a single worker process"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    async def delete(self, key):
+        self._entries.pop(key, None)
+
+    async def close(self):
+        pass
+
+class SQLiteSessionStore:
+    """Session state shared by the worker processes on one host"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        # sqlite3 connections belong to the thread that made them
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS session_state "
+                               "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def _get(self, key):
+        row = self._connect().execute("SELECT value FROM session_state WHERE key = ? AND expires > ?",
+                                      (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO session_state (key, value, expires) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), time.time() + self.ttl))
+            # Expired rows are cleared out as a side effect of writes
+            conn.execute("DELETE FROM session_state WHERE expires <= ?", (time.time(),))
+
+    def _delete(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM session_state WHERE key = ?", (key,))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, key):
+        return await self._run(self._get, key)
+
+    async def set(self, key, value):
+        await self._run(self._set, key, value)
+
+    async def delete(self, key):
+        await self._run(self._delete, key)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+class RedisSessionStore:
+    """Session state shared through Redis"""
+
+    def __init__(self, url, ttl, prefix="hfs:session:"):
+        import redis.asyncio
+        self.redis = redis.asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.redis.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value):
+        await self.redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    async def delete(self, key):
+        await self.redis.delete(self.prefix + key)
+
+    async def close(self):
+        await self.redis.close()
+
+def _make_session_store():
+    if SESSION_STORE == "redis":
+        try:
+            return RedisSessionStore(REDIS_URL, SESSION_TTL)
+        except ImportError:
+            logger.warning("redis library not available, sharing session state through SQLite")
+            return SQLiteSessionStore(SESSION_DB, SESSION_TTL)
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore(SESSION_DB, SESSION_TTL)
+    if SESSION_STORE != "memory":
+        logger.warning(f"Unknown HFS_SESSION_STORE {SESSION_STORE!r}, keeping session state in memory")
+    return MemorySessionStore(SESSION_TTL)
+
+session_store = _make_session_store()
+
+async def session_state_get(key):
+    """Read from the session store, treating errors as a missing entry"""
+    try:
+        return await session_store.get(key)
+    except Exception as e:
+        logger.warning(f"Session store read failed for {key}: {e}")
+        return None
+
+async def session_state_set(key, value):
+    try:
+        await session_store.set(key, value)
+    except Exception as e:
+        logger.warning(f"Session store write failed for {key}: {e}")
+
+async def session_state_delete(key):
+    try:
+        await session_store.delete(key)
+    except Exception as e:
+        logger.warning(f"Session store delete failed for {key}: {e}")
+
+def worker_alive(worker_id):
+    """Whether the worker process named by a WORKER_ID may still be running"""
+    host, _, pid = (worker_id or "").rpartition(":")
+    if host != socket.gethostname():
+        # Can't check other hosts; assume it is
+        return bool(host)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+# ===== Shell Sessions =====
+# Each client session gets a long-lived bash process attached to a PTY, so cd,
+# export, source and shell functions persist between commands exactly as they
+# would in a real terminal.
+SHELL_IDLE_TIMEOUT = int(os.environ.get("HFS_SHELL_IDLE_TIMEOUT", 900))
+SHELL_MAX_SESSIONS = int(os.environ.get("HFS_SHELL_MAX_SESSIONS", 16))
+SHELL_INTERRUPT_GRACE = 2
+
+# Shell function that reports the exit status and working directory of the
+# previous command, framed so it can be found in the PTY output. It also
+# snapshots the exported environment into $__hfs_env for the session store.
+_SHELL_INIT = (
+    "PS1=''; PS2=''; unset PROMPT_COMMAND; HISTFILE=\n"
+    "__hfs_done() { local s=$?; [ -n \"$__hfs_env\" ] && export -p > \"$__hfs_env\"; "
+    "printf '\\036HFS%s %d %s\\036' \"$1\" \"$s\" \"$PWD\"; }\n"
+)
+
+# Names declared by `export -p` output
+_EXPORT_NAME = re.compile(r"^declare -[a-zA-Z-]*x[a-zA-Z-]* ([A-Za-z_][A-Za-z0-9_]*)", re.M)
+
+class ShellSessionError(Exception):
+    """Raised when a shell session cannot be created or has died"""
+
+class ShellSession:
+    """A persistent interactive bash process driven through a PTY"""
+
+    def __init__(self, session_id, cwd, env):
+        self.session_id = session_id
+        self.cwd = cwd
+        self.env = env
+        self.proc = None
+        self.master_fd = None
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self._queue = asyncio.Queue()
+        self._closed = False
+        # Exported environment and cwd as last saved to or restored from the
+        # session store, and the version of that state
+        self.exports = ""
+        self._saved_cwd = cwd
+        self.version = None
+        self._state_path = None
+        # Limits apply to the whole session; usage is measured per command
+        self.cgroup = None
+        self.last_usage = None
+
+    @property
+    def alive(self):
+        return not self._closed and self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        """Spawn bash on a new PTY and wait until it is ready for commands"""
+        master_fd, slave_fd = pty.openpty()
+        # Raw-ish output: no echo of our input and no \n -> \r\n translation
+        attrs = termios.tcgetattr(slave_fd)
+        attrs[1] &= ~termios.OPOST
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attrs)
+        
+        env = dict(self.env, TERM="dumb")
+        self.cgroup = ExecCgroup.create()
+        try:
+            # Reopening the terminal as session leader makes it the
+            # controlling one, so Ctrl-C reaches the foreground job
+            self.proc = await asyncio.create_subprocess_exec(
+                *exec_wrapper(["bash", "--noprofile", "--norc", "--noediting", "-i"],
+                              self.cgroup, tty=os.ttyname(slave_fd)),
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                cwd=self.cwd,
+                env=env,
+                start_new_session=True,
+            )
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            os.close(slave_fd)
+        apply_rlimits(self.proc.pid)
+        
+        self.master_fd = master_fd
+        os.set_blocking(master_fd, False)
+        asyncio.get_running_loop().add_reader(master_fd, self._on_readable)
+        
+        fd, self._state_path = tempfile.mkstemp(prefix="hfs-shell-", suffix=".sh")
+        os.close(fd)
+        os.write(master_fd, _SHELL_INIT.encode())
+        # Not exported, so it stays out of the snapshots
+        os.write(master_fd, f"__hfs_env={shlex.quote(self._state_path)}\n".encode())
+        nonce = uuid.uuid4().hex
+        os.write(master_fd, f"__hfs_done {nonce}\n".encode())
+        try:
+            await asyncio.wait_for(self._read_until_marker(nonce, lambda text: None), timeout=10)
+        except (asyncio.TimeoutError, ShellSessionError):
+            self.close()
+            raise ShellSessionError("Shell did not start")
+        self.exports = self._read_exports()
+
+    @property
+    def _command_path(self):
+        """File each command is written to before the shell sources it"""
+        return self._state_path + ".cmd"
+
+    def _read_exports(self):
+        """The exported environment as of the last completed command"""
+        if self._state_path is None:
+            return self.exports
+        try:
+            with open(self._state_path, encoding="utf-8", errors="replace") as f:
+                return f.read()
+        except OSError:
+            return self.exports
+
+    async def _sync_state(self):
+        """Catch up with cwd and environment changes saved by other workers"""
+        state = await session_state_get(f"shell:{self.session_id}")
+        if not state or state.get("version") == self.version:
+            return
+        stale = set(_EXPORT_NAME.findall(self.exports)) - set(_EXPORT_NAME.findall(state["exports"]))
+        lines = [f"unset -v {name}" for name in sorted(stale)]
+        # bash refuses to change SHLVL's meaning mid-session; keep the local one
+        lines += ["__hfs_shlvl=$SHLVL", state["exports"], "SHLVL=$__hfs_shlvl; unset __hfs_shlvl",
+                  f"cd -- {shlex.quote(state['cwd'])}"]
+        # Sourced from a file: the PTY line discipline caps input lines at 4 KB
+        script = self._state_path + ".restore"
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        nonce = uuid.uuid4().hex
+        os.write(self.master_fd, f"{{ . {shlex.quote(script)}; }} </dev/null >/dev/null 2>&1\n__hfs_done {nonce}\n".encode())
+        try:
+            await asyncio.wait_for(self._read_until_marker(nonce, lambda data: None), timeout=10)
+        except asyncio.TimeoutError:
+            raise ShellSessionError("Shell did not restore session state")
+        finally:
+            os.unlink(script)
+        self.exports = self._read_exports()
+        self._saved_cwd = self.cwd
+        self.version = state["version"]
+
+    async def _save_state(self):
+        """Publish cwd and environment changes made by the last command"""
+        exports = self._read_exports()
+        if self.version is not None and exports == self.exports and self.cwd == self._saved_cwd:
+            return
+        self.exports = exports
+        self._saved_cwd = self.cwd
+        self.version = uuid.uuid4().hex
+        await session_state_set(f"shell:{self.session_id}",
+                                {"cwd": self.cwd, "exports": exports, "version": self.version})
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO: the shell exited and the PTY was hung up
+            data = b""
+        if not data:
+            asyncio.get_running_loop().remove_reader(self.master_fd)
+            self._closed = True
+            self._queue.put_nowait(None)
+        else:
+            self._queue.put_nowait(data)
+
+    async def _read_until_marker(self, nonce, on_data):
+        """Pass output bytes to on_data until the framing marker for nonce arrives
+
+        Returns the exit status reported by the marker.
+        """
+        marker = f"\x1eHFS{nonce} ".encode()
+        pending = b""
+        while True:
+            data = await self._queue.get()
+            if data is None:
+                if pending:
+                    on_data(pending)
+                raise ShellSessionError("Shell exited")
+            pending += data
+            index = pending.find(marker)
+            if index != -1:
+                end = pending.find(b"\x1e", index + len(marker))
+                if end == -1:
+                    # Marker not complete yet
+                    continue
+                if index:
+                    on_data(pending[:index])
+                status, _, cwd = pending[index + len(marker):end].decode(errors="replace").partition(" ")
+                self.cwd = cwd or self.cwd
+                return int(status)
+            # Hold back only a tail that could be the start of a marker split
+            # across reads; everything before it is passed on straight away
+            start = pending.rfind(b"\x1e", max(len(pending) - len(marker) + 1, 0))
+            keep = pending[start:] if start != -1 and marker.startswith(pending[start:]) else b""
+            if len(pending) > len(keep):
+                on_data(pending[:len(pending) - len(keep)])
+                pending = keep
+
+    async def stream(self, command, timeout=EXEC_TIMEOUT, decode=True):
+        """Run command in the shell, yielding ("stdout", text) chunks
+
+        Ends with ("exit", status) or ("timeout", None). stdout and stderr
+        share the PTY, so all output is reported as stdout. With decode=False
+        the chunks are bytes.
+        """
+        async with self.lock, _get_exec_semaphore():
+            self.last_used = time.monotonic()
+            if not self.alive:
+                raise ShellSessionError("Shell session has exited")
+            
+            # Drop anything printed by background jobs since the last command
+            while not self._queue.empty():
+                if self._queue.get_nowait() is None:
+                    raise ShellSessionError("Shell session has exited")
+            await self._sync_state()
+            
+            nonce = uuid.uuid4().hex
+            # Sourced from a file: the PTY line discipline caps input lines at
+            # 4 KB. It reads stdin from /dev/null so a command cannot swallow
+            # the marker, which runs even after a syntax error
+            with open(self._command_path, "w", encoding="utf-8") as f:
+                f.write(command + "\n")
+            os.write(self.master_fd, f". {shlex.quote(self._command_path)} </dev/null; __hfs_done {nonce}\n".encode())
+            
+            chunks = asyncio.Queue()
+            reader = asyncio.ensure_future(self._read_until_marker(nonce, chunks.put_nowait))
+            reader.add_done_callback(lambda _: chunks.put_nowait(None))
+            deadline = asyncio.get_running_loop().time() + timeout
+            processes_running.inc("session")
+            started = time.monotonic()
+            # Foreground commands are reaped by bash before the marker is
+            # printed, so their CPU time shows up in bash's children times
+            cpu_before = proc_cpu_times(self.proc.pid)
+            self.last_usage = None
+            output_bytes = 0
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") if decode else None
+            try:
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    try:
+                        data = await asyncio.wait_for(chunks.get(), timeout=max(remaining, 0))
+                    except asyncio.TimeoutError:
+                        reader.cancel()
+                        await self._interrupt()
+                        self.last_usage = usage_info(time.monotonic() - started, proc_cpu_since(self.proc.pid, cpu_before))
+                        record_process("session", started, timed_out=True, usage=self.last_usage)
+                        yield ("timeout", None)
+                        return
+                    if data is None:
+                        break
+                    output_bytes += len(data)
+                    text = decoder.decode(data) if decoder else data
+                    if text:
+                        yield ("stdout", text)
+                if decoder:
+                    tail = decoder.decode(b"", final=True)
+                    if tail:
+                        yield ("stdout", tail)
+                
+                try:
+                    status = reader.result()
+                except ShellSessionError:
+                    # The command exited the shell (e.g. 'exit 3')
+                    await self.proc.wait()
+                    status = self.proc.returncode
+                else:
+                    await self._save_state()
+                self.last_usage = usage_info(time.monotonic() - started, proc_cpu_since(self.proc.pid, cpu_before))
+                record_process("session", started, status, output_bytes=output_bytes, usage=self.last_usage)
+                yield ("exit", status)
+            finally:
+                processes_running.dec("session")
+                if not reader.done():
+                    reader.cancel()
+                    await self._interrupt()
+                self.last_used = time.monotonic()
+
+    async def run(self, command, timeout=EXEC_TIMEOUT):
+        """Run command in the shell and return an ExecResult with combined output"""
+        result = ExecResult()
+        try:
+            async for kind, payload in self.stream(command, timeout=timeout, decode=False):
+                if kind == "stdout":
+                    result.stdout.write(payload)
+                elif kind == "timeout":
+                    result.timed_out = True
+                else:
+                    result.returncode = payload
+        except BaseException:
+            result.stdout.discard()
+            raise
+        result.stdout.finish()
+        result.usage = self.last_usage
+        return result
+
+    async def _interrupt(self):
+        """Interrupt the running command with Ctrl-C, or kill the shell if it won't respond"""
+        if not self.alive:
+            return
+        os.write(self.master_fd, b"\x03")
+        # bash discards input that arrives before it has handled SIGINT
+        await asyncio.sleep(0.1)
+        nonce = uuid.uuid4().hex
+        os.write(self.master_fd, f"__hfs_done {nonce}\n".encode())
+        try:
+            await asyncio.wait_for(self._read_until_marker(nonce, lambda text: None), timeout=SHELL_INTERRUPT_GRACE)
+        except (asyncio.TimeoutError, ShellSessionError):
+            logger.warning(f"Shell session {self.session_id} did not respond to interrupt, killing it")
+            self.close()
+
+    def close(self):
+        """Terminate the shell and release the PTY"""
+        self._closed = True
+        if self.proc is not None and self.proc.returncode is None:
+            _kill_process_group(self.proc)
+        if self.master_fd is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.master_fd)
+            except RuntimeError:
+                pass
+            try:
+                os.close(self.master_fd)
+            except OSError:
+                pass
+            self.master_fd = None
+        if self._state_path is not None:
+            for path in (self._state_path, self._command_path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._state_path = None
+        if self.cgroup is not None:
+            self.cgroup.remove()
+            self.cgroup = None
+
+# Live sessions in least-recently-used order
+shell_sessions = OrderedDict()
+# Session ID -> task starting its shell, which concurrent first requests share
+shell_session_starts = {}
+
+def evict_idle_shell_sessions():
+    """Close sessions that are dead or have been idle for longer than SHELL_IDLE_TIMEOUT"""
+    now = time.monotonic()
+    for session_id, session in list(shell_sessions.items()):
+        idle = now - session.last_used > SHELL_IDLE_TIMEOUT and not session.lock.locked()
+        if idle or not session.alive:
+            logger.info(f"Closing shell session {session_id}")
+            session.close()
+            del shell_sessions[session_id]
+
+async def get_shell_session(session_id):
+    """Return the live shell for session_id, starting one if needed"""
+    evict_idle_shell_sessions()
+    session = shell_sessions.get(session_id)
+    if session is not None:
+        shell_sessions.move_to_end(session_id)
+        return session
+    
+    task = shell_session_starts.get(session_id)
+    if task is not None:
+        return await asyncio.shield(task)
+    
+    if len(shell_sessions) + len(shell_session_starts) >= SHELL_MAX_SESSIONS:
+        # Make room by closing the least recently used idle session
+        for old_id, old in shell_sessions.items():
+            if not old.lock.locked():
+                logger.info(f"Closing shell session {old_id} to make room")
+                old.close()
+                del shell_sessions[old_id]
+                break
+        else:
+            raise ShellSessionError(f"Too many active shell sessions (limit {SHELL_MAX_SESSIONS})")
+    
+    async def start():
+        session = ShellSession(session_id, shell_state["cwd"], shell_state["env"])
+        await session.start()
+        shell_sessions[session_id] = session
+        logger.info(f"Started shell session {session_id} (pid {session.proc.pid})")
+        return session
+    
+    def done(task):
+        shell_session_starts.pop(session_id, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+    
+    # Registered only once ready; until then concurrent callers wait here
+    task = asyncio.ensure_future(start())
+    shell_session_starts[session_id] = task
+    task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+async def session_cwd(session_id):
+    """Working directory of a session's shell, or the server default
+
+    The last state saved to the session store wins, so the answer is the
+    same whichever worker holds the session's shell.
+    """
+    state = await session_state_get(f"shell:{session_id}")
+    if state:
+        return state["cwd"]
+    session = shell_sessions.get(session_id)
+    if session is not None and session.alive:
+        return session.cwd
+    return shell_state["cwd"]
+
+async def _shell_session_reaper():
+    while True:
+        await asyncio.sleep(60)
+        evict_idle_shell_sessions()
+
+@app.on_event("startup")
+async def start_shell_session_reaper():
+    asyncio.ensure_future(_shell_session_reaper())
+
+@app.on_event("shutdown")
+async def close_shell_sessions():
+    for session in shell_sessions.values():
+        session.close()
+    shell_sessions.clear()
+
+# ===== Execution History =====
+# Every execution is appended to a SQLite database. Requests only put a record
+# on an in-memory queue; a background task writes the queue out in batches, one
+# transaction each, on a dedicated thread. Pages are fetched by keyset (id <
+# before) so deep pages cost the same as the first one.
+HISTORY_DB = os.environ.get("HFS_HISTORY_DB", os.path.join(tempfile.gettempdir(), "hfs-history.sqlite3"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HFS_HISTORY_FLUSH_INTERVAL", 1.0))
+HISTORY_BATCH_SIZE = 500
+HISTORY_QUEUE_SIZE = int(os.environ.get("HFS_HISTORY_QUEUE_SIZE", 10000))
+HISTORY_COMMAND_CHARS = 4096
+HISTORY_EXCERPT_CHARS = 1024
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS executions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    endpoint TEXT NOT NULL,
+    session_id TEXT,
+    command_hash TEXT NOT NULL,
+    command TEXT NOT NULL,
+    cwd TEXT,
+    duration REAL,
+    exit_code INTEGER,
+    timed_out INTEGER NOT NULL DEFAULT 0,
+    output_bytes INTEGER NOT NULL DEFAULT 0,
+    output_excerpt TEXT,
+    cpu_user REAL,
+    cpu_system REAL,
+    max_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS executions_ts ON executions (ts);
+CREATE INDEX IF NOT EXISTS executions_session ON executions (session_id, id);
+CREATE INDEX IF NOT EXISTS executions_command ON executions (command_hash, id);
+CREATE INDEX IF NOT EXISTS executions_endpoint ON executions (endpoint, id);
+"""
+
+HISTORY_COLUMNS = ("id", "ts", "endpoint", "session_id", "command_hash", "command", "cwd",
+                   "duration", "exit_code", "timed_out", "output_bytes", "output_excerpt",
+                   "cpu_user", "cpu_system", "max_rss")
+# Columns added since the table was first created
+HISTORY_ADDED_COLUMNS = {"cpu_user": "REAL", "cpu_system": "REAL", "max_rss": "INTEGER"}
+
+history_records = metrics.Counter("hfs_history_records_total", "Execution history records by outcome", ["result"])
+
+class HistoryStore:
+    """Append-only execution log in SQLite with batched write-behind"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fts = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._conn = None
+        self._flusher = None
+        # sqlite3 connections belong to the thread that made them
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(HISTORY_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(executions)")}
+        for column, kind in HISTORY_ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE executions ADD COLUMN {column} {kind}")
+        try:
+            # Substring search over commands; needs SQLite 3.34+
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS executions_fts USING fts5("
+                         "command, content='executions', content_rowid='id', tokenize='trigram')")
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.info(f"SQLite full-text search unavailable, history search will scan: {e}")
+        conn.commit()
+        self._conn = conn
+
+    async def start(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    def record(self, entry):
+        """Queue an entry for writing; never blocks"""
+        if len(self._pending) >= HISTORY_QUEUE_SIZE:
+            self.dropped += 1
+            history_records.inc("dropped")
+            return
+        self._pending.append(entry)
+        self._wakeup.set()
+
+    def _write(self, batch):
+        rows = [tuple(entry.get(column) for column in HISTORY_COLUMNS[1:]) for entry in batch]
+        with self._conn:
+            cursor = self._conn.cursor()
+            for row in rows:
+                cursor.execute(f"INSERT INTO executions ({', '.join(HISTORY_COLUMNS[1:])}) "
+                               f"VALUES ({', '.join('?' * len(row))})", row)
+                if self.fts:
+                    cursor.execute("INSERT INTO executions_fts (rowid, command) VALUES (?, ?)",
+                                   (cursor.lastrowid, row[HISTORY_COLUMNS.index("command") - 1]))
+
+    async def _flush(self, batch):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+            self.written += len(batch)
+            history_records.inc("written", amount=len(batch))
+        except Exception as e:
+            # Not just sqlite3.Error: a row that can't be stored must not end
+            # the write-behind task along with everything queued after it
+            self.failed += len(batch)
+            history_records.inc("failed", amount=len(batch))
+            logger.warning(f"Could not write {len(batch)} history records: {e}")
+
+    async def _flush_pending(self):
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(len(self._pending), HISTORY_BATCH_SIZE))]
+            await self._flush(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let more records gather so they share a transaction
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            await self._flush_pending()
+
+    async def close(self):
+        """Write out whatever is still queued and close the database"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self._flush_pending()
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    def _query(self, session_id, endpoint, command_hash, q, since, until, before, limit):
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            where, params = [], []
+            # Records are appended in time order, so the time range becomes an
+            # id range with one index lookup per bound and the primary key
+            # drives both filtering and ordering
+            if since is not None:
+                where.append("id >= coalesce((SELECT id FROM executions WHERE ts >= ? ORDER BY ts LIMIT 1), 1 << 62)")
+                params.append(since)
+            if until is not None:
+                where.append("id <= coalesce((SELECT id FROM executions WHERE ts < ? ORDER BY ts DESC LIMIT 1), 0)")
+                params.append(until)
+            if before is not None:
+                where.append("id < ?")
+                params.append(before)
+            for column, value in (("session_id", session_id), ("endpoint", endpoint), ("command_hash", command_hash)):
+                if value:
+                    where.append(f"{column} = ?")
+                    params.append(value)
+            if q and self.fts and len(q) >= 3:
+                where.append("id IN (SELECT rowid FROM executions_fts WHERE executions_fts MATCH ?)")
+                params.append('"' + q.replace('"', '""') + '"')
+            elif q:
+                where.append("instr(command, ?) > 0")
+                params.append(q)
+            
+            sql = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM executions"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += " ORDER BY id DESC LIMIT ?"
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        finally:
+            conn.close()
+        entries = [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+        for entry in entries:
+            entry["timed_out"] = bool(entry["timed_out"])
+        return entries
+
+    async def query(self, session_id=None, endpoint=None, command_hash=None, q=None,
+                    since=None, until=None, before=None, limit=HISTORY_PAGE_SIZE):
+        """Newest-first page of entries matching every given filter"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._query, session_id, endpoint, command_hash, q, since, until, before, limit)
+
+    def stats(self):
+        return {"written": self.written, "pending": len(self._pending), "dropped": self.dropped,
+                "failed": self.failed, "search": "fts5" if self.fts else "scan"}
+
+history_store = None
+
+def record_execution(endpoint, command, started, session_id=None, cwd=None, exit_code=None,
+                     timed_out=False, output="", output_bytes=None, command_hash=None, usage=None):
+    """Add an execution to the history log
+    
+    output may be just the start of the output when output_bytes gives the
+    full size, as for streamed commands. usage is a usage_info() dict.
+    """
+    if history_store is None:
+        return
+    encoded = output.encode("utf-8", "surrogateescape")
+    history_store.record({
+        "ts": time.time(),
+        "endpoint": endpoint,
+        "session_id": session_id,
+        "command_hash": command_hash or hashlib.sha256(command.encode("utf-8", "surrogateescape")).hexdigest(),
+        "command": command[:HISTORY_COMMAND_CHARS],
+        "cwd": cwd,
+        "duration": round(time.monotonic() - started, 6),
+        "exit_code": exit_code,
+        "timed_out": int(timed_out),
+        "output_bytes": len(encoded) if output_bytes is None else output_bytes,
+        "output_excerpt": encoded[:HISTORY_EXCERPT_CHARS].decode("utf-8", "replace"),
+        **{key: (usage or {}).get(key) for key in ("cpu_user", "cpu_system", "max_rss")},
+    })
+
+@app.on_event("startup")
+async def open_history_store():
+    global history_store
+    if not HISTORY_DB:
+        return
+    store = HistoryStore(HISTORY_DB)
+    try:
+        await store.start()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Execution history disabled, could not open {HISTORY_DB}: {e}")
+        return
+    history_store = store
+    logger.info(f"Recording execution history in {HISTORY_DB}")
+
+@app.on_event("shutdown")
+async def close_history_store():
+    if history_store is not None:
+        await history_store.close()
+
+@app.get("/api/history")
+async def history(admin_id: str = "", session_id: str = "", endpoint: str = "", command_hash: str = "", q: str = "",
+                  since: float = None, until: float = None, before: int = None, limit: int = HISTORY_PAGE_SIZE):
+    """Search the execution history, newest first
+    
+    since/until are Unix timestamps and q matches anywhere in the command.
+    Pass the returned next_before as before to fetch the following page.
+    """
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    if history_store is None:
+        return JSONResponse({"success": False, "error": "Execution history is disabled"})
+    
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    try:
+        entries = await history_store.query(session_id, endpoint, command_hash, q, since, until, before, limit)
+    except sqlite3.Error as e:
+        return JSONResponse({"success": False, "error": f"History query failed: {e}"})
+    return {
+        "success": True,
+        "entries": entries,
+        "next_before": entries[-1]["id"] if len(entries) == limit else None,
+        "store": history_store.stats(),
+    }
+
+# UI assets
+UI_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui_template.html")
+UI_COMPRESS_MIN_SIZE = 1024
+UI_PAGE_CACHE_CONTROL = "no-cache"
+UI_ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Local copy of the Monaco editor, installed by fetch_monaco.py
+MONACO_DIR = os.environ.get("HFS_MONACO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "monaco"))
+MONACO_CDN_PATTERN = r"https://cdnjs\.cloudflare\.com/ajax/libs/monaco-editor/([\w.-]+)/min/vs"
+
+def _accepted_encodings(header):
+    """Content codings allowed by an Accept-Encoding header"""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            accepted.add(name)
+    return accepted
+
+def _etag_matches(header, etag):
+    """Check an If-None-Match header against an ETag"""
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+class StaticAsset:
+    """A response body kept in memory with precompressed variants
+
+    Every variant has its own strong ETag derived from the uncompressed
+    content, so browsers can revalidate with If-None-Match and get a 304.
+    """
+
+    def __init__(self, body, media_type):
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = {None: body}
+        if len(body) >= UI_COMPRESS_MIN_SIZE:
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if BROTLI_AVAILABLE:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding):
+        suffix = f"-{encoding}" if encoding else ""
+        return f'"{self.digest[:32]}{suffix}"'
+
+    def choose_encoding(self, accept_encoding):
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return None
+
+    def response(self, request, cache_control):
+        encoding = self.choose_encoding(request.headers.get("accept-encoding", ""))
+        etag = self.etag(encoding)
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+class UIAssets:
+    """The web interface, split once at startup into fingerprinted assets
+
+    The inline stylesheet and script of ui_template.html are moved to
+    /assets/app.<hash>.css and /assets/app.<hash>.js. Their names change
+    whenever their content does, so they can be cached forever, while the
+    small HTML page is revalidated on each load.
+    """
+
+    def __init__(self, template_path):
+        self.page = None
+        self.assets = {}
+        try:
+            with open(template_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            logger.warning(f"UI template not found at {template_path}, serving basic interface")
+            return
+
+        html = self._use_local_monaco(html)
+        html = self._extract(html, r"<style>(.*?)</style>", "css", "text/css",
+                             lambda url: f'<link rel="stylesheet" href="{url}">')
+        html = self._extract(html, r"<script>(.*?)</script>", "js", "application/javascript; charset=utf-8",
+                             lambda url: f'<script src="{url}"></script>')
+        self.page = StaticAsset(html.encode("utf-8"), "text/html")
+        logger.info(f"UI assets ready: {', '.join(self.assets)}"
+                    f"{'' if BROTLI_AVAILABLE else ' (brotli not installed, gzip only)'}")
+
+    def _use_local_monaco(self, html):
+        """Point the editor at /monaco when the version the template uses is installed"""
+        match = re.search(MONACO_CDN_PATTERN, html)
+        if match is None:
+            return html
+        version = match.group(1)
+        if not os.path.isfile(os.path.join(MONACO_DIR, version, "vs", "loader.js")):
+            logger.info(f"Monaco {version} not installed in {MONACO_DIR}, loading the editor from the CDN")
+            return html
+        base = f"/monaco/{version}/vs"
+        html = re.sub(MONACO_CDN_PATTERN + r"/loader\.min\.js", base + "/loader.js", html)
+        return re.sub(MONACO_CDN_PATTERN, base, html)
+
+    def _extract(self, html, pattern, extension, media_type, make_tag):
+        """Move the first inline block matching pattern into a fingerprinted asset"""
+        match = re.search(pattern, html, re.S)
+        if match is None:
+            return html
+        asset = StaticAsset(match.group(1).encode("utf-8"), media_type)
+        name = f"app.{asset.digest[:12]}.{extension}"
+        self.assets[name] = asset
+        return html[:match.start()] + make_tag(f"/assets/{name}") + html[match.end():]
+
+ui_assets = UIAssets(UI_TEMPLATE_PATH)
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that sends file.br or file.gz in place of file when accepted
+
+    Paths under the mount are versioned, so every response is cacheable
+    for as long as cache_control allows.
+    """
+
+    def __init__(self, *args, cache_control=UI_ASSET_CACHE_CONTROL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        response = None
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            compressed_path = f"{full_path}{suffix}"
+            try:
+                compressed_stat = os.stat(compressed_path)
+            except OSError:
+                continue
+            response = FileResponse(
+                compressed_path, status_code=status_code, stat_result=compressed_stat, method=scope["method"],
+                media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+                headers={"Content-Encoding": encoding},
+            )
+            break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, method=scope["method"])
+        response.headers["Cache-Control"] = self.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+if os.path.isdir(MONACO_DIR):
+    app.mount("/monaco", PrecompressedStaticFiles(directory=MONACO_DIR), name="monaco")
+
+@app.get("/assets/{name}")
+async def ui_asset(name: str, request: Request):
+    """Serve a fingerprinted UI asset"""
+    asset = ui_assets.assets.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return asset.response(request, UI_ASSET_CACHE_CONTROL)
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """Root endpoint that returns a professional web interface"""
+    
+    if ui_assets.page is not None:
+        return ui_assets.page.response(request, UI_PAGE_CACHE_CONTROL)
+    else:
         # Fallback to basic interface if template not found
         return f"""
     <!DOCTYPE html>
@@ -723,93 +2738,468 @@ async def root():
     </html>
     """
 
-@app.post("/api/execute")
-async def execute_command(request: Request):
-    """Execute a shell command with persistent working directory"""
-    try:
-        data = await request.json()
-        command = data.get("command", "").strip()
-        admin_id = data.get("admin_id", "")
-        
-        if not command:
-            return JSONResponse({"success": False, "error": "No command provided"})
-        
-        # Verify admin (basic check)
-        if not verify_admin(admin_id):
-            return JSONResponse({"success": False, "error": "Unauthorized"})
-        
-        logger.info(f"Executing command: {command}")
-        
-        # Execute command with timeout
+@app.post("/api/execute")
+async def execute_command(request: Request):
+    """Execute a shell command with persistent working directory"""
+    try:
+        data = await request.json()
+        command = data.get("command", "").strip()
+        admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
+        
+        if not command:
+            return JSONResponse({"success": False, "error": "No command provided"})
+        
+        # Verify admin (basic check)
+        if not verify_admin(admin_id):
+            return JSONResponse({"success": False, "error": "Unauthorized"})
+        
+        logger.info(f"Executing command: {command}")
+        
+        # Execute command with timeout
+        try:
+            # Execute command in the session's persistent shell
+            started = time.monotonic()
+            session = await get_shell_session(session_id)
+            result = await session.run(command)
+            record_execution("execute", command, started, session_id, session.cwd, result.returncode,
+                             result.timed_out, result.stdout.text(), result.stdout.size, usage=result.usage)
+            
+            if result.timed_out:
+                return JSONResponse({
+                    "success": False,
+                    "error": f"Command timed out after {EXEC_TIMEOUT} seconds",
+                    "usage": result.usage
+                })
+            
+            return JSONResponse({
+                "success": True,
+                **output_response(result.stdout, "Command executed successfully (no output)"),
+                "return_code": result.returncode,
+                "cwd": session.cwd,
+                "usage": result.usage
+            })
+            
+        except Exception as e:
+            return JSONResponse({
+                "success": False,
+                "error": f"Execution error: {str(e)}"
+            })
+            
+    except Exception as e:
+        logger.error(f"Error in execute_command: {e}")
+        return JSONResponse({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        })
+
+def sse_event(event, data):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/execute/stream")
+async def execute_command_stream(request: Request):
+    """Execute a shell command and stream its output as Server-Sent Events
+    
+    Emits 'stdout' events with text chunks as they are produced, then a final
+    'exit' event with the return code, working directory and resource usage,
+    or an 'error' event.
+    Commands run in the same persistent shell session as /api/execute.
+    """
+    try:
+        data = await request.json()
+    except Exception as e:
+        return JSONResponse({"success": False, "error": f"Server error: {str(e)}"})
+    
+    command = data.get("command", "").strip()
+    admin_id = data.get("admin_id", "")
+    session_id = str(data.get("session_id") or "default")
+    
+    if not command:
+        return JSONResponse({"success": False, "error": "No command provided"})
+    
+    # Verify admin (basic check)
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    logger.info(f"Streaming command: {command}")
+    
+    async def events():
+        started = time.monotonic()
+        excerpt = ""
+        output_bytes = 0
+        try:
+            session = await get_shell_session(session_id)
+            async for kind, payload in session.stream(command):
+                if kind == "exit":
+                    record_execution("execute/stream", command, started, session_id, session.cwd, payload,
+                                     output=excerpt, output_bytes=output_bytes, usage=session.last_usage)
+                    yield sse_event("exit", {"return_code": payload, "cwd": session.cwd, "usage": session.last_usage})
+                elif kind == "timeout":
+                    record_execution("execute/stream", command, started, session_id, session.cwd, timed_out=True,
+                                     output=excerpt, output_bytes=output_bytes, usage=session.last_usage)
+                    yield sse_event("error", {"error": f"Command timed out after {EXEC_TIMEOUT} seconds",
+                                              "usage": session.last_usage})
+                else:
+                    if len(excerpt) < HISTORY_EXCERPT_CHARS:
+                        excerpt += payload[:HISTORY_EXCERPT_CHARS - len(excerpt)]
+                    output_bytes += len(payload.encode("utf-8", "surrogateescape"))
+                    yield sse_event(kind, payload)
+        except Exception as e:
+            logger.error(f"Error in execute_command_stream: {e}")
+            yield sse_event("error", {"error": f"Execution error: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ===== Worker Pools =====
+class WorkerPool:
+    """Fixed-size pool of warm worker processes; each worker runs one request at a time
+
+    worker_cls must provide an async spawn() classmethod, an async
+    run(*args, timeout) method, needs_recycle() and kill(). Workers that time
+    out, fail or need recycling are killed and replaced in the background.
+    """
+
+    def __init__(self, worker_cls, size, name):
+        self.worker_cls = worker_cls
+        self.size = size
+        self.name = name
+        self._idle = asyncio.Queue()
+
+    async def start(self):
+        for _ in range(self.size):
+            await self._idle.put(await self.worker_cls.spawn())
+        logger.info(f"Started {self.size} {self.name} workers")
+
+    def _replace(self, worker, reason):
+        """Kill a worker and start a fresh one in the background"""
+        worker.kill()
+        worker_restarts.inc(self.name, reason)
+        
+        async def respawn():
+            try:
+                await self._idle.put(await self.worker_cls.spawn())
+            except Exception as e:
+                logger.error(f"Could not start {self.name} worker: {e}")
+        
+        asyncio.ensure_future(respawn())
+
+    async def run(self, *args, timeout):
+        worker = await self._idle.get()
+        started = time.monotonic()
+        try:
+            response = await worker.run(*args, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._replace(worker, "timeout")
+            process_timeouts.inc(self.name)
+            return {"success": False, "error": f"Execution timed out after {timeout} seconds"}
+        except BaseException:
+            self._replace(worker, "failed")
+            raise
+        finally:
+            worker_runs.observe(time.monotonic() - started, self.name)
+        
+        if worker.needs_recycle():
+            logger.info(f"Recycling {self.name} worker after {worker.runs} runs")
+            self._replace(worker, "recycled")
+        else:
+            self._idle.put_nowait(worker)
+        return response
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+
+# ===== Python Worker Pool =====
+# /api/eval runs code in pre-started interpreter processes (eval_worker.py) so
+# that a busy or runaway snippet can be timed out and killed without touching
+# the web server. Set HFS_EVAL_POOL_SIZE=0 to evaluate inside the server instead.
+EVAL_POOL_SIZE = int(os.environ.get("HFS_EVAL_POOL_SIZE", os.cpu_count() or 1))
+EVAL_TIMEOUT = int(os.environ.get("HFS_EVAL_TIMEOUT", EXEC_TIMEOUT))
+EVAL_WORKER_MAX_RUNS = int(os.environ.get("HFS_EVAL_WORKER_MAX_RUNS", 100))
+EVAL_WORKER_MAX_RSS_MB = int(os.environ.get("HFS_EVAL_WORKER_MAX_RSS_MB", 512))
+EVAL_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_worker.py")
+
+# Compiled-code cache counters summed over all worker processes
+eval_cache_stats = {"hits": 0, "misses": 0}
+
+class PythonWorker:
+    """A warm Python interpreter running eval_worker.py"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.runs = 0
+        self.rss = 0
+
+    @classmethod
+    async def spawn(cls):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, EVAL_WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=shell_state["env"],
+            start_new_session=True,
+            limit=64 * 1024 * 1024,
+        )
+        return cls(proc)
+
+    async def run(self, code, timeout, persist=False):
+        """Send code to the worker and wait for its response dict
+
+        With persist, code runs in the worker's long-lived kernel namespace.
+        """
+        self.runs += 1
+        self.proc.stdin.write((json.dumps({"code": code, "persist": persist}) + "\n").encode())
+        await self.proc.stdin.drain()
+        line = await asyncio.wait_for(self.proc.stdout.readline(), timeout=timeout)
+        if not line:
+            raise RuntimeError("Python worker exited unexpectedly")
+        response = json.loads(line)
+        self.rss = response.pop("rss", 0)
+        eval_cache_stats["hits" if response.pop("cache_hit", False) else "misses"] += 1
+        return response
+
+    def needs_recycle(self):
+        return self.runs >= EVAL_WORKER_MAX_RUNS or self.rss > EVAL_WORKER_MAX_RSS_MB * 1024 * 1024
+
+    def kill(self):
+        _kill_process_group(self.proc)
+
+eval_pool = None
+
+@app.on_event("startup")
+async def start_eval_pool():
+    global eval_pool
+    if EVAL_POOL_SIZE > 0:
+        eval_pool = WorkerPool(PythonWorker, EVAL_POOL_SIZE, "Python eval")
+        await eval_pool.start()
+
+@app.on_event("shutdown")
+async def stop_eval_pool():
+    if eval_pool is not None:
+        eval_pool.close()
+
+# ===== Eval Kernels =====
+# A kernel is a PythonWorker dedicated to one session whose namespace survives
+# between requests, so expensive setup only has to run once.
+EVAL_MAX_KERNELS = int(os.environ.get("HFS_EVAL_MAX_KERNELS", 8))
+EVAL_KERNEL_IDLE_TIMEOUT = int(os.environ.get("HFS_EVAL_KERNEL_IDLE_TIMEOUT", 1800))
+EVAL_KERNEL_MAX_RSS_MB = int(os.environ.get("HFS_EVAL_KERNEL_MAX_RSS_MB", 1024))
+
+class EvalKernel:
+    """A persistent Python namespace living in its own worker process"""
+
+    def __init__(self, session_id, worker):
+        self.session_id = session_id
+        self.worker = worker
+        self.lock = asyncio.Lock()
+        self.created = time.time()
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.worker.proc.returncode is None
+
+    def info(self):
+        return {
+            "session_id": self.session_id,
+            "runs": self.worker.runs,
+            "rss_mb": round(self.worker.rss / (1024 * 1024), 1),
+            "idle_seconds": int(time.monotonic() - self.last_used),
+            "created": self.created,
+            "busy": self.lock.locked(),
+        }
+
+    def close(self):
+        self.worker.kill()
+
+# Live kernels in least-recently-used order
+eval_kernels = OrderedDict()
+# Session ID -> task starting its kernel, which concurrent first requests share
+eval_kernel_starts = {}
+
+def drop_eval_kernel(session_id, reason, kernel=None):
+    """Kill a kernel and forget it; returns False if there was none
+
+    With kernel, only that kernel is dropped: a newer one that has since
+    replaced it for the session is left alone.
+    """
+    if kernel is not None and eval_kernels.get(session_id) is not kernel:
+        kernel.close()
+        return False
+    kernel = eval_kernels.pop(session_id, None)
+    if kernel is None:
+        return False
+    logger.info(f"Dropping eval kernel {session_id}: {reason}")
+    kernel.close()
+    asyncio.ensure_future(release_kernel_owner(session_id))
+    return True
+
+async def release_kernel_owner(session_id):
+    """Forget that this worker owns the session's kernel"""
+    record = await session_state_get(f"kernel:{session_id}")
+    if record and record.get("owner") == WORKER_ID:
+        await session_state_delete(f"kernel:{session_id}")
+
+async def claim_kernel_owner(session_id):
+    """Record this worker as the kernel's owner
+
+    Returns a warning if another live worker already holds a kernel for the
+    session: its variables stay there and are not visible here.
+    """
+    record = await session_state_get(f"kernel:{session_id}")
+    await session_state_set(f"kernel:{session_id}", {"owner": WORKER_ID, "since": time.time()})
+    owner = (record or {}).get("owner")
+    if owner and owner != WORKER_ID and worker_alive(owner):
+        return (f"This session's kernel variables live in worker {owner}; "
+                f"this request started a fresh kernel in worker {WORKER_ID}.")
+    return None
+
+def evict_idle_eval_kernels():
+    """Drop kernels that have died or been idle for longer than EVAL_KERNEL_IDLE_TIMEOUT"""
+    now = time.monotonic()
+    for session_id, kernel in list(eval_kernels.items()):
+        if not kernel.alive:
+            drop_eval_kernel(session_id, "process exited")
+        elif now - kernel.last_used > EVAL_KERNEL_IDLE_TIMEOUT and not kernel.lock.locked():
+            drop_eval_kernel(session_id, "idle")
+
+async def get_eval_kernel(session_id):
+    """Return the kernel for session_id, starting one if needed"""
+    evict_idle_eval_kernels()
+    kernel = eval_kernels.get(session_id)
+    if kernel is not None:
+        eval_kernels.move_to_end(session_id)
+        return kernel
+    
+    task = eval_kernel_starts.get(session_id)
+    if task is not None:
+        return await asyncio.shield(task)
+    
+    if len(eval_kernels) + len(eval_kernel_starts) >= EVAL_MAX_KERNELS:
+        # Make room by dropping the least recently used idle kernel
+        for old_id, old in eval_kernels.items():
+            if not old.lock.locked():
+                drop_eval_kernel(old_id, "evicted to make room")
+                break
+        else:
+            raise RuntimeError(f"Too many active kernels (limit {EVAL_MAX_KERNELS})")
+    
+    async def start():
+        kernel = EvalKernel(session_id, await PythonWorker.spawn())
+        eval_kernels[session_id] = kernel
+        logger.info(f"Started eval kernel {session_id} (pid {kernel.worker.proc.pid})")
+        return kernel
+    
+    def done(task):
+        eval_kernel_starts.pop(session_id, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+    
+    # The spawn runs in its own task so a request going away doesn't orphan it
+    task = asyncio.ensure_future(start())
+    eval_kernel_starts[session_id] = task
+    task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+async def run_in_kernel(session_id, code, timeout=EVAL_TIMEOUT):
+    """Evaluate code in the session's persistent kernel"""
+    started = session_id not in eval_kernels
+    kernel = await get_eval_kernel(session_id)
+    warning = await claim_kernel_owner(session_id) if started else None
+    async with kernel.lock:
+        kernel.last_used = time.monotonic()
         try:
-            # Check if command is 'cd' to update persistent state
-            if command.startswith("cd ") or command == "cd":
-                parts = command.split(maxsplit=1)
-                if len(parts) == 1:
-                    # cd without arguments goes to home
-                    new_dir = os.path.expanduser("~")
-                else:
-                    new_dir = parts[1]
-                    # Handle relative paths
-                    if not os.path.isabs(new_dir):
-                        new_dir = os.path.join(shell_state["cwd"], new_dir)
-                    # Expand ~ and resolve path (realpath resolves symlinks and normalizes)
-                    new_dir = os.path.expanduser(new_dir)
-                    new_dir = os.path.realpath(new_dir)
-                
-                # Check if directory exists and is accessible
-                # Note: This is an admin tool with full system access by design
-                if os.path.isdir(new_dir) and os.access(new_dir, os.R_OK):
-                    shell_state["cwd"] = new_dir
-                    return JSONResponse({
-                        "success": True,
-                        "output": f"Changed directory to: {new_dir}",
-                        "return_code": 0
-                    })
-                else:
-                    return JSONResponse({
-                        "success": False,
-                        "error": f"Directory not found or not accessible: {new_dir}"
-                    })
-            
-            # Execute command in the persistent working directory
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=30,
-                cwd=shell_state["cwd"],
-                env=shell_state["env"]
-            )
-            
-            output = result.stdout if result.stdout else result.stderr
-            if not output:
-                output = "Command executed successfully (no output)"
-            
-            return JSONResponse({
-                "success": True,
-                "output": output,
-                "return_code": result.returncode
-            })
-            
-        except subprocess.TimeoutExpired:
-            return JSONResponse({
-                "success": False,
-                "error": "Command timed out after 30 seconds"
-            })
-        except Exception as e:
-            return JSONResponse({
+            response = await kernel.worker.run(code, timeout, persist=True)
+        except asyncio.TimeoutError:
+            drop_eval_kernel(session_id, "timed out", kernel)
+            return {
                 "success": False,
-                "error": f"Execution error: {str(e)}"
-            })
-            
+                "error": f"Execution timed out after {timeout} seconds. The kernel was restarted and its variables were lost."
+            }
+        except BaseException:
+            drop_eval_kernel(session_id, "worker failed", kernel)
+            raise
+        finally:
+            kernel.last_used = time.monotonic()
+    
+    if kernel.worker.rss > EVAL_KERNEL_MAX_RSS_MB * 1024 * 1024:
+        drop_eval_kernel(session_id, f"memory {kernel.worker.rss // (1024 * 1024)} MB over budget", kernel)
+        response["warning"] = f"Kernel exceeded {EVAL_KERNEL_MAX_RSS_MB} MB and was restarted; its variables were lost."
+    elif warning:
+        response["warning"] = warning
+    return response
+
+async def _eval_kernel_reaper():
+    while True:
+        await asyncio.sleep(60)
+        evict_idle_eval_kernels()
+
+@app.on_event("startup")
+async def start_eval_kernel_reaper():
+    asyncio.ensure_future(_eval_kernel_reaper())
+
+@app.on_event("shutdown")
+async def close_eval_kernels():
+    for session_id, kernel in eval_kernels.items():
+        kernel.close()
+        await release_kernel_owner(session_id)
+    eval_kernels.clear()
+
+# Registered after the kernels, which release their ownership records on the way out
+@app.on_event("shutdown")
+async def close_session_store():
+    await session_store.close()
+
+# Output of in-process evaluations is routed by context variable rather than by
+# swapping sys.stdout, so concurrent evaluations on the event loop (and tasks
+# they create) each write to their own buffer
+_eval_output = contextvars.ContextVar("eval_output", default=None)
+
+class TaskLocalStdout:
+    """sys.stdout replacement that writes to the current evaluation's buffer"""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def _target(self):
+        buffer = _eval_output.get()
+        return self._fallback if buffer is None else buffer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def writelines(self, lines):
+        return self._target().writelines(lines)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._fallback, name)
+
+async def evaluate_in_process(code):
+    """Evaluate code inside the server process (HFS_EVAL_POOL_SIZE=0)"""
+    if not isinstance(sys.stdout, TaskLocalStdout):
+        sys.stdout = TaskLocalStdout(sys.stdout)
+    
+    # Capture stdout
+    buffer = StringIO()
+    token = _eval_output.set(buffer)
+    try:
+        await eval_worker.evaluate(code, eval_worker.make_namespace())
+        return {"success": True, "output": eval_worker.format_output(buffer.getvalue())}
+    except SystemExit as e:
+        # Must not reach the server's own event loop
+        return eval_worker.exit_response(e, buffer.getvalue())
     except Exception as e:
-        logger.error(f"Error in execute_command: {e}")
-        return JSONResponse({
-            "success": False,
-            "error": f"Server error: {str(e)}"
-        })
+        return {"success": False, "error": eval_worker.format_error(e)}
+    finally:
+        _eval_output.reset(token)
 
 @app.post("/api/eval")
 async def evaluate_python(request: Request):
@@ -824,6 +3214,7 @@ async def evaluate_python(request: Request):
         data = await request.json()
         code = data.get("code", "").strip()
         admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
         
         if not code:
             return JSONResponse({"success": False, "error": "No code provided"})
@@ -834,98 +3225,18 @@ async def evaluate_python(request: Request):
         
         logger.info(f"Executing Python code (length: {len(code)})")
         
-        try:
-            # Import necessary modules for async support
-            import sys
-            import asyncio
-            from io import StringIO
-            
-            # Create a namespace for execution
-            namespace = {
-                '__builtins__': __builtins__,
-                'os': os,
-                'subprocess': subprocess,
-                'asyncio': asyncio,
-                'json': json,  # Add json module for better formatting
-            }
-            
-            # Capture stdout
-            old_stdout = sys.stdout
-            sys.stdout = StringIO()
-            
-            try:
-                # Check if code contains await (indicating async code)
-                # Use AST parsing for more accurate detection
-                try:
-                    import ast
-                    # Try to parse the code to detect async usage
-                    tree = ast.parse(code)
-                    has_await = any(isinstance(node, (ast.Await, ast.AsyncWith, ast.AsyncFor)) 
-                                   for node in ast.walk(tree))
-                    has_async_def = any(isinstance(node, ast.AsyncFunctionDef) 
-                                       for node in ast.walk(tree))
-                    is_async = has_await or has_async_def
-                except SyntaxError:
-                    # If parsing fails, fall back to simple string check
-                    is_async = 'await ' in code or code.strip().startswith('async ')
-                
-                if is_async:
-                    # Wrap code in async function and await it
-                    import textwrap
-                    indented_code = textwrap.indent(code, '    ')
-                    async_code = f"""
-async def __async_exec():
-{indented_code}
-"""
-                    # Compile and execute the async function definition
-                    exec(async_code, namespace)
-                    # Now await the async function
-                    result = await namespace['__async_exec']()
-                    if result is not None:
-                        print(result)
-                else:
-                    # Try to evaluate as expression first
-                    try:
-                        result = eval(code, namespace)
-                        if result is not None:
-                            # If result is dict or list, auto-format as JSON
-                            if isinstance(result, (dict, list)):
-                                print(json.dumps(result, indent=2, ensure_ascii=False))
-                            else:
-                                print(result)
-                    except SyntaxError:
-                        # If it fails, execute as statement
-                        exec(code, namespace)
-                
-                output = sys.stdout.getvalue()
-                if not output:
-                    output = "Code executed successfully (no output)"
-                
-                # Try to detect and format JSON output
-                try:
-                    # Check if output looks like JSON (starts with { or [)
-                    stripped = output.strip()
-                    if (stripped.startswith('{') or stripped.startswith('[')) and (stripped.endswith('}') or stripped.endswith(']')):
-                        # Try to parse and reformat as JSON
-                        json_obj = json.loads(stripped)
-                        output = json.dumps(json_obj, indent=2, ensure_ascii=False)
-                except (json.JSONDecodeError, ValueError):
-                    # Not valid JSON, keep original output
-                    pass
-                
-                return JSONResponse({
-                    "success": True,
-                    "output": output
-                })
-                
-            finally:
-                sys.stdout = old_stdout
-                
-        except Exception as e:
-            return JSONResponse({
-                "success": False,
-                "error": f"{type(e).__name__}: {str(e)}\\n{traceback.format_exc()}"
-            })
+        started = time.monotonic()
+        if data.get("persistent"):
+            mode, result = "kernel", await run_in_kernel(session_id, code)
+        elif eval_pool is not None:
+            mode, result = "pool", await eval_pool.run(code, timeout=EVAL_TIMEOUT)
+        else:
+            mode, result = "in_process", await evaluate_in_process(code)
+        eval_duration.observe(time.monotonic() - started, mode)
+        error = result.get("error", "")
+        record_execution("eval", code, started, session_id, exit_code=0 if result.get("success") else 1,
+                         timed_out=error.startswith("Execution timed out"), output=result.get("output") or error)
+        return JSONResponse(result)
             
     except Exception as e:
         logger.error(f"Error in evaluate_python: {e}")
@@ -934,6 +3245,180 @@ async def __async_exec():
             "error": f"Server error: {str(e)}"
         })
 
+@app.get("/api/kernels")
+async def list_kernels(admin_id: str = ""):
+    """List live eval kernels"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    evict_idle_eval_kernels()
+    return {
+        "success": True,
+        "kernels": [kernel.info() for kernel in eval_kernels.values()],
+        "limit": EVAL_MAX_KERNELS
+    }
+
+@app.get("/api/eval/cache")
+async def eval_cache_info(admin_id: str = ""):
+    """Hit and miss counters of the compiled-code cache"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    return {
+        "success": True,
+        "workers": dict(eval_cache_stats, size=eval_worker.code_cache.size),
+        "in_process": eval_worker.code_cache.stats()
+    }
+
+@app.post("/api/kernels/reset")
+async def reset_kernel(request: Request):
+    """Discard all variables of a session's kernel"""
+    try:
+        data = await request.json()
+        admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
+        
+        # Verify admin
+        if not verify_admin(admin_id):
+            return JSONResponse({"success": False, "error": "Unauthorized"})
+        
+        # A fresh process is the only reliable way to forget imported modules,
+        # so reset drops the kernel and the next run starts a new one
+        drop_eval_kernel(session_id, "reset")
+        return JSONResponse({"success": True, "message": "Kernel reset"})
+        
+    except Exception as e:
+        logger.error(f"Error in reset_kernel: {e}")
+        return JSONResponse({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        })
+
+@app.post("/api/kernels/drop")
+async def drop_kernel(request: Request):
+    """Shut down a session's kernel"""
+    try:
+        data = await request.json()
+        admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
+        
+        # Verify admin
+        if not verify_admin(admin_id):
+            return JSONResponse({"success": False, "error": "Unauthorized"})
+        
+        if not drop_eval_kernel(session_id, "dropped"):
+            return JSONResponse({"success": False, "error": f"No kernel for session {session_id}"})
+        return JSONResponse({"success": True, "message": "Kernel dropped"})
+        
+    except Exception as e:
+        logger.error(f"Error in drop_kernel: {e}")
+        return JSONResponse({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        })
+
+# ===== Upload Store =====
+# Uploaded scripts are stored once under the SHA-256 of their content, next to
+# their compiled bytecode, so re-running the same file skips both the write
+# and the compile.
+UPLOAD_STORE_DIR = os.environ.get("HFS_UPLOAD_STORE", os.path.join(tempfile.gettempdir(), "hfs-uploads"))
+UPLOAD_STORE_MAX_MB = int(os.environ.get("HFS_UPLOAD_STORE_MAX_MB", 256))
+UPLOAD_STORE_MAX_AGE = int(os.environ.get("HFS_UPLOAD_STORE_MAX_AGE", 7 * 24 * 3600))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Partial writes older than this were left by a crash or a killed worker
+UPLOAD_PART_MAX_AGE = 3600
+
+# Bytecode can only be reused when python3 on PATH is this interpreter
+_PYTHON3_PATH = shutil.which("python3")
+REUSE_BYTECODE = bool(_PYTHON3_PATH) and os.path.realpath(_PYTHON3_PATH) == os.path.realpath(sys.executable)
+
+async def store_upload(upload):
+    """Store an uploaded file by content hash and return its path
+
+    The upload is hashed in chunks first; the content is only written if the
+    store doesn't already have it.
+    """
+    digest = hashlib.sha256()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    
+    os.makedirs(UPLOAD_STORE_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_STORE_DIR, digest.hexdigest() + ".py")
+    try:
+        # Mark as recently used for cleanup
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        # Not stored yet, or just removed by the cleaner
+        pass
+    
+    await upload.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_STORE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                tmp.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    
+    asyncio.get_running_loop().run_in_executor(None, clean_upload_store)
+    return path
+
+def compile_upload(path):
+    """Return the path of cached bytecode for a stored upload, or None if it can't be used"""
+    if not REUSE_BYTECODE:
+        return None
+    pyc_path = path[:-len(".py")] + ".pyc"
+    if os.path.exists(pyc_path):
+        return pyc_path
+    try:
+        py_compile.compile(path, cfile=pyc_path, doraise=True)
+    except py_compile.PyCompileError:
+        # Run the source so the user sees the normal SyntaxError output
+        return None
+    return pyc_path
+
+def clean_upload_store():
+    """Remove uploads older than UPLOAD_STORE_MAX_AGE, then the least recently
+    used ones until the store fits in UPLOAD_STORE_MAX_MB, and abandoned partial writes"""
+    try:
+        entries = []
+        now = time.time()
+        for entry in os.scandir(UPLOAD_STORE_DIR):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".part") and now - stat.st_mtime > UPLOAD_PART_MAX_AGE:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            if not entry.name.endswith(".py"):
+                continue
+            pyc_path = entry.path[:-len(".py")] + ".pyc"
+            size = stat.st_size + (os.path.getsize(pyc_path) if os.path.exists(pyc_path) else 0)
+            entries.append((stat.st_mtime, size, entry.path, pyc_path))
+        
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        for mtime, size, path, pyc_path in entries:
+            if now - mtime <= UPLOAD_STORE_MAX_AGE and total <= UPLOAD_STORE_MAX_MB * 1024 * 1024:
+                break
+            for stale in (path, pyc_path):
+                try:
+                    os.unlink(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
+    except OSError as e:
+        logger.warning(f"Could not clean upload store: {e}")
+
 @app.post("/api/run-file")
 async def run_python_file(file: UploadFile = File(...), admin_id: str = Form(...)):
     """Upload and execute a Python file"""
@@ -951,50 +3436,616 @@ async def run_python_file(file: UploadFile = File(...), admin_id: str = Form(...
         
         logger.info(f"Executing uploaded file: {file.filename}")
         
-        # Save file to temp location
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as tmp:
-            content = await file.read()
-            tmp.write(content.decode('utf-8'))
-            tmp_path = tmp.name
+        path = await store_upload(file)
+        pyc_path = await asyncio.get_running_loop().run_in_executor(None, compile_upload, path)
         
-        try:
-            # Execute the file
-            result = subprocess.run(
-                ['python3', tmp_path],  # Use python3 from PATH instead of hardcoded path
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            output = result.stdout if result.stdout else result.stderr
-            if not output:
-                output = "File executed successfully (no output)"
-            
-            return JSONResponse({
-                "success": True,
-                "output": output,
-                "return_code": result.returncode,
-                "filename": file.filename
-            })
-            
-        except subprocess.TimeoutExpired:
+        # Execute the file
+        started = time.monotonic()
+        result = await run_subprocess(
+            ['python3', pyc_path or path]  # Use python3 from PATH instead of hardcoded path
+        )
+        # Uploads are stored under their content hash
+        record_execution("run-file", file.filename, started, cwd=os.getcwd(), exit_code=result.returncode,
+                         timed_out=result.timed_out, output=result.stdout.text() + result.stderr.text(),
+                         output_bytes=result.stdout.size + result.stderr.size,
+                         command_hash=os.path.basename(path)[:-len(".py")], usage=result.usage)
+        
+        if result.timed_out:
             return JSONResponse({
                 "success": False,
-                "error": "Execution timed out after 30 seconds"
+                "error": f"Execution timed out after {EXEC_TIMEOUT} seconds",
+                "usage": result.usage
             })
-        finally:
-            # Clean up temp file
+        
+        output = result.stdout if result.stdout.size else result.stderr
+        
+        return JSONResponse({
+            "success": True,
+            **output_response(output, "File executed successfully (no output)"),
+            "return_code": result.returncode,
+            "filename": file.filename,
+            "usage": result.usage
+        })
+                
+    except Exception as e:
+        logger.error(f"Error in run_python_file: {e}")
+        return JSONResponse({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        })
+
+# ===== Background Jobs =====
+# Long-running commands, snippets and uploaded scripts run as jobs: submitting
+# returns a job ID at once, the process's output is copied to an output file
+# (up to OUTPUT_SPILL_MAX bytes), and the job table lives in SQLite so jobs survive page reloads and restarts.
+# Jobs have their own concurrency limit and timeout, separate from the
+# interactive endpoints. With several worker processes the table is shared:
+# any worker can report on or cancel a job, and each job records the worker
+# that runs it.
+JOB_DIR = os.environ.get("HFS_JOB_DIR", os.path.join(tempfile.gettempdir(), "hfs-jobs"))
+JOB_CONCURRENCY = int(os.environ.get("HFS_JOB_CONCURRENCY", 4))
+JOB_MAX_QUEUED = int(os.environ.get("HFS_JOB_MAX_QUEUED", 64))
+JOB_TIMEOUT = int(os.environ.get("HFS_JOB_TIMEOUT", 6 * 3600))
+# Jobs run for much longer than interactive commands, so they get a CPU limit
+# of their own; the other limits are the same
+JOB_RLIMIT_CPU = int(os.environ.get("HFS_JOB_RLIMIT_CPU", JOB_TIMEOUT))
+JOB_RLIMITS = _rlimits(cpu=JOB_RLIMIT_CPU)
+JOB_RETENTION = int(os.environ.get("HFS_JOB_RETENTION", 7 * 24 * 3600))
+JOB_MAX_FINISHED = int(os.environ.get("HFS_JOB_MAX_FINISHED", 200))
+JOB_STREAM_POLL_INTERVAL = 0.25
+JOB_FINAL_STATES = ("succeeded", "failed", "cancelled", "timed_out", "interrupted")
+JOB_LANGUAGES = {"python": ("python3", ".py"), "javascript": ("node", ".js")}
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    command TEXT NOT NULL,
+    session_id TEXT,
+    cwd TEXT,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    exit_code INTEGER,
+    error TEXT,
+    owner TEXT,
+    pid INTEGER,
+    cpu_user REAL,
+    cpu_system REAL,
+    max_rss INTEGER,
+    output_truncated INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+"""
+
+JOB_COLUMNS = ("id", "kind", "command", "session_id", "cwd", "status", "created", "started", "finished", "exit_code",
+               "error", "owner", "pid", "cpu_user", "cpu_system", "max_rss",
+               "output_truncated")
+# Columns added since the table was first created
+JOB_ADDED_COLUMNS = {"owner": "TEXT", "pid": "INTEGER", "cpu_user": "REAL", "cpu_system": "REAL", "max_rss": "INTEGER",
+                     "output_truncated": "INTEGER"}
+
+class Job:
+    """A submitted command, snippet or script and its progress"""
+
+    def __init__(self, id, kind, command, session_id=None, cwd=None, status="queued", created=None,
+                 started=None, finished=None, exit_code=None, error=None, owner=None, pid=None,
+                 cpu_user=None, cpu_system=None, max_rss=None, output_truncated=False):
+        self.id = id
+        self.kind = kind
+        self.command = command
+        self.session_id = session_id
+        self.cwd = cwd
+        self.status = status
+        self.created = created or time.time()
+        self.started = started
+        self.finished = finished
+        self.exit_code = exit_code
+        self.error = error
+        # Worker running the job, and its process group once started
+        self.owner = owner
+        self.pid = pid
+        # Resource usage of the process, as in usage_info()
+        self.cpu_user = cpu_user
+        self.cpu_system = cpu_system
+        self.max_rss = max_rss
+        # Whether output past OUTPUT_SPILL_MAX was dropped
+        self.output_truncated = bool(output_truncated)
+        self.task = None
+        self.proc = None
+        self.script_path = None
+        # Status given to the job if its task is cancelled
+        self.cancel_status = "cancelled"
+
+    @property
+    def output_path(self):
+        return os.path.join(JOB_DIR, self.id + ".out")
+
+    @property
+    def done(self):
+        return self.status in JOB_FINAL_STATES
+
+    def row(self):
+        return tuple(getattr(self, column) for column in JOB_COLUMNS)
+
+    def output_bytes(self):
+        try:
+            return os.path.getsize(self.output_path)
+        except OSError:
+            return 0
+
+    def output_excerpt(self):
+        try:
+            with open(self.output_path, "rb") as f:
+                return f.read(HISTORY_EXCERPT_CHARS).decode("utf-8", "replace")
+        except OSError:
+            return ""
+
+    def info(self):
+        info = dict(zip(JOB_COLUMNS, self.row()))
+        info["output_bytes"] = self.output_bytes()
+        if self.started:
+            info["duration"] = round((self.finished or time.time()) - self.started, 3)
+        return info
+
+class JobStore:
+    """The jobs table, written on a dedicated thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(JOB_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in JOB_ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn = conn
+        return conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE status NOT IN "
+                            f"({', '.join('?' * len(JOB_FINAL_STATES))}) ORDER BY created", JOB_FINAL_STATES).fetchall()
+
+    def _save(self, row):
+        # A job cancelled through another worker stays cancelled whatever its
+        # owner reports once the process has been killed
+        updates = ", ".join(f"{column} = excluded.{column}" for column in JOB_COLUMNS[1:])
+        with self._conn:
+            self._conn.execute(f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(row))}) "
+                               f"ON CONFLICT (id) DO UPDATE SET {updates} WHERE jobs.status != 'cancelled'", row)
+
+    def _get(self, job_id):
+        return self._conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _list(self, status, session_id, limit):
+        where, params = [], []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if session_id:
+            where.append("session_id = ?")
+            params.append(session_id)
+        rows = self._conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                                  f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+                                  f"ORDER BY created DESC LIMIT ?", params + [limit]).fetchall()
+        counts = dict(self._conn.execute("SELECT status, count(*) FROM jobs WHERE status IN ('running', 'queued') "
+                                         "GROUP BY status").fetchall())
+        return rows, counts
+
+    def _prune(self, cutoff, keep):
+        finished = f"status IN ({', '.join('?' * len(JOB_FINAL_STATES))})"
+        ids = [row[0] for row in self._conn.execute(
+            f"SELECT id FROM jobs WHERE {finished} AND coalesce(finished, created) < ? UNION "
+            f"SELECT id FROM (SELECT id FROM jobs WHERE {finished} ORDER BY coalesce(finished, created) DESC "
+            f"LIMIT -1 OFFSET ?)", JOB_FINAL_STATES + (cutoff,) + JOB_FINAL_STATES + (keep,))]
+        self._delete(ids)
+        return ids
+
+    def _delete(self, ids):
+        with self._conn:
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """Open the database and return the unfinished jobs, oldest first"""
+        return [Job(*row) for row in await self._run(self._open)]
+
+    async def save(self, job):
+        try:
+            await self._run(self._save, job.row())
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save job {job.id}: {e}")
+
+    async def get(self, job_id):
+        row = await self._run(self._get, job_id)
+        return Job(*row) if row else None
+
+    async def list(self, status="", session_id="", limit=100):
+        """Jobs newest first, and the number running and queued across all workers"""
+        rows, counts = await self._run(self._list, status, session_id, limit)
+        return [Job(*row) for row in rows], counts
+
+    async def prune(self, cutoff, keep):
+        """Delete finished jobs older than cutoff or beyond the newest keep; returns their IDs"""
+        try:
+            return await self._run(self._prune, cutoff, keep)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not prune jobs: {e}")
+            return []
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+# Jobs started by this worker, in submission order. Once the table is open
+# it is the record of every job, and only unfinished ones are kept here.
+jobs = OrderedDict()
+job_store = None
+_job_semaphore = None
+
+def _get_job_semaphore():
+    global _job_semaphore
+    if _job_semaphore is None:
+        _job_semaphore = asyncio.Semaphore(JOB_CONCURRENCY)
+    return _job_semaphore
+
+async def save_job(job):
+    if job_store is not None:
+        await job_store.save(job)
+
+async def load_job(job_id):
+    """A job by ID, whichever worker started it"""
+    if job_store is None:
+        return jobs.get(job_id)
+    try:
+        return await job_store.get(job_id)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not load job {job_id}: {e}")
+        return jobs.get(job_id)
+
+async def copy_job_output(job, out):
+    """Copy the output of a job's process to out, keeping at most OUTPUT_SPILL_MAX bytes
+
+    The rest is read and dropped so the process doesn't block, and the job is
+    marked as truncated.
+    """
+    stored = 0
+    while True:
+        chunk = await job.proc.stdout.read(OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        kept = chunk[:OUTPUT_SPILL_MAX - stored]
+        if kept:
+            out.write(kept)
+            stored += len(kept)
+        if len(kept) < len(chunk) and not job.output_truncated:
+            job.output_truncated = True
+            await save_job(job)
+
+async def run_job(job, args, shell):
+    """Run a job's process to completion, recording its status"""
+    started = time.monotonic()
+    try:
+        async with _get_job_semaphore():
+            stored = await load_job(job.id) if job_store is not None else None
+            if stored is not None and stored.status == "cancelled":
+                # Cancelled through another worker while queued
+                job.status = "cancelled"
+                return
+            job.status = "running"
+            job.started = time.time()
+            started = time.monotonic()
+            
+            with open(job.output_path, "wb", buffering=0) as out:
+                job.proc = await ExecProcess.spawn(
+                    args, shell=shell, cwd=job.cwd,
+                    # Python block-buffers output to a pipe; followers want it as it comes
+                    env=dict(shell_state["env"], PYTHONUNBUFFERED="1"),
+                    stderr=subprocess.STDOUT, limits=JOB_RLIMITS,
+                )
+                job.pid = job.proc.pid
+                await save_job(job)
+                process_spawns.inc("job")
+                processes_running.inc("job")
+                try:
+                    await asyncio.wait_for(asyncio.gather(copy_job_output(job, out), job.proc.wait()),
+                                           timeout=JOB_TIMEOUT or None)
+                    job.exit_code = job.proc.returncode
+                    job.status = "succeeded" if job.exit_code == 0 else "failed"
+                except asyncio.TimeoutError:
+                    _kill_process_group(job.proc)
+                    await job.proc.wait()
+                    job.status = "timed_out"
+                    job.error = f"Timed out after {JOB_TIMEOUT} seconds"
+                finally:
+                    processes_running.dec("job")
+            usage = job.proc.usage()
+            job.cpu_user, job.cpu_system, job.max_rss = usage["cpu_user"], usage["cpu_system"], usage["max_rss"]
+            record_process("job", started, job.exit_code, job.status == "timed_out", job.output_bytes(), usage)
+    except asyncio.CancelledError:
+        # Cancelled by the user or by server shutdown; the job's task ends here
+        if job.proc is not None and job.proc.returncode is None:
+            _kill_process_group(job.proc)
+        job.status = job.cancel_status
+    except OSError as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished = time.time()
+        if job.proc is not None:
+            job.proc.close()
+            job.proc = None
+        if job.script_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(job.script_path)
+        await save_job(job)
+        if job_store is not None:
+            # The table has it from here on
+            jobs.pop(job.id, None)
+    
+    record_execution("jobs", job.command, started, job.session_id, job.cwd, job.exit_code,
+                     job.status == "timed_out", job.output_excerpt(), job.output_bytes(),
+                     usage={"cpu_user": job.cpu_user, "cpu_system": job.cpu_system, "max_rss": job.max_rss})
+    await prune_jobs()
+
+def job_queue_full():
+    """Whether this worker already has as many unfinished jobs as it takes"""
+    unfinished = sum(1 for job in jobs.values() if not job.done)
+    return unfinished >= JOB_CONCURRENCY + JOB_MAX_QUEUED
+
+def job_queue_full_response():
+    return JSONResponse({
+        "success": False,
+        "error": f"Too many jobs: {JOB_CONCURRENCY} running and {JOB_MAX_QUEUED} queued, retry when some have finished"
+    }, status_code=429)
+
+async def submit_job(kind, command, args, shell=False, session_id=None, script=None):
+    """Start a job and return it without waiting for it to run
+    
+    script is source code to save under JOB_DIR and pass to args[0].
+    """
+    os.makedirs(JOB_DIR, exist_ok=True)
+    cwd = await session_cwd(session_id or "default")
+    job = Job(uuid.uuid4().hex, kind, command, session_id, cwd, owner=WORKER_ID)
+    if script is not None:
+        interpreter, suffix = script
+        job.script_path = os.path.join(JOB_DIR, job.id + suffix)
+        with open(job.script_path, "w", encoding="utf-8") as f:
+            f.write(command)
+        args = [interpreter, job.script_path]
+    jobs[job.id] = job
+    await save_job(job)
+    job.task = asyncio.ensure_future(run_job(job, args, shell))
+    logger.info(f"Submitted {kind} job {job.id}")
+    return job
+
+async def prune_jobs():
+    """Forget finished jobs older than JOB_RETENTION, and the oldest beyond JOB_MAX_FINISHED"""
+    cutoff = time.time() - JOB_RETENTION
+    if job_store is not None:
+        expired = await job_store.prune(cutoff, JOB_MAX_FINISHED)
+    else:
+        finished = sorted((job for job in jobs.values() if job.done), key=lambda job: job.finished or job.created)
+        excess = len(finished) - JOB_MAX_FINISHED
+        expired = [job.id for i, job in enumerate(finished) if i < excess or (job.finished or job.created) < cutoff]
+    for job_id in expired:
+        jobs.pop(job_id, None)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(JOB_DIR, job_id + ".out"))
+
+async def _job_reaper():
+    while True:
+        await asyncio.sleep(60)
+        await prune_jobs()
+
+@app.on_event("startup")
+async def open_job_store():
+    global job_store
+    store = JobStore(os.path.join(JOB_DIR, "jobs.sqlite3"))
+    try:
+        os.makedirs(JOB_DIR, exist_ok=True)
+        stored = await store.open()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Job table unavailable, jobs will not survive restarts: {e}")
+        stored = []
+    else:
+        job_store = store
+    for job in stored:
+        if not worker_alive(job.owner):
+            # Its process went away with the worker that started it
+            job.status = "interrupted"
+            job.finished = time.time()
+            await save_job(job)
+    await prune_jobs()
+    asyncio.ensure_future(_job_reaper())
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    tasks = []
+    for job in jobs.values():
+        if job.task is not None and not job.task.done():
+            job.cancel_status = "interrupted"
+            job.task.cancel()
+            tasks.append(job.task)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if job_store is not None:
+        await job_store.close()
+
+@app.post("/api/jobs")
+async def create_job(request: Request):
+    """Submit a shell command, or code with a language, as a background job"""
+    try:
+        data = await request.json()
+    except Exception as e:
+        return JSONResponse({"success": False, "error": f"Server error: {str(e)}"})
+    
+    if not verify_admin(data.get("admin_id", "")):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    session_id = str(data.get("session_id") or "default")
+    command = data.get("command", "").strip()
+    code = data.get("code", "").strip()
+    language = data.get("language", "python")
+    if job_queue_full():
+        return job_queue_full_response()
+    try:
+        if command:
+            job = await submit_job("command", command, command, shell=True, session_id=session_id)
+        elif code:
+            if language not in JOB_LANGUAGES:
+                return JSONResponse({"success": False, "error": f"Unsupported language: {language}"})
+            job = await submit_job(language, code, None, session_id=session_id, script=JOB_LANGUAGES[language])
+        else:
+            return JSONResponse({"success": False, "error": "No command or code provided"})
+    except OSError as e:
+        return JSONResponse({"success": False, "error": f"Could not start job: {e}"})
+    return {"success": True, "job": job.info()}
+
+@app.post("/api/jobs/file")
+async def create_file_job(file: UploadFile = File(...), admin_id: str = Form(...), session_id: str = Form("default")):
+    """Submit an uploaded Python file as a background job"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    if not file.filename.endswith('.py'):
+        return JSONResponse({"success": False, "error": "Only .py files are allowed"})
+    if job_queue_full():
+        return job_queue_full_response()
+    
+    try:
+        path = await store_upload(file)
+        job = await submit_job("file", file.filename, ["python3", path], session_id=session_id)
+    except OSError as e:
+        return JSONResponse({"success": False, "error": f"Could not start job: {e}"})
+    return {"success": True, "job": job.info()}
+
+@app.get("/api/jobs")
+async def list_jobs(admin_id: str = "", status: str = "", session_id: str = "", limit: int = 100):
+    """List jobs, newest first"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    if job_store is not None:
+        try:
+            selected, counts = await job_store.list(status, session_id, limit)
+            return {"success": True, "jobs": [job.info() for job in selected], "running": counts.get("running", 0),
+                    "queued": counts.get("queued", 0), "concurrency": JOB_CONCURRENCY}
+        except sqlite3.Error as e:
+            logger.warning(f"Could not list jobs: {e}")
+    
+    selected = []
+    for job in reversed(jobs.values()):
+        if len(selected) >= limit:
+            break
+        if (not status or job.status == status) and (not session_id or job.session_id == session_id):
+            selected.append(job.info())
+    return {"success": True, "jobs": selected, "running": sum(1 for job in jobs.values() if job.status == "running"),
+            "queued": sum(1 for job in jobs.values() if job.status == "queued"), "concurrency": JOB_CONCURRENCY}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, admin_id: str = ""):
+    """Status of one job"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    job = await load_job(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "Job not found"}, status_code=404)
+    return {"success": True, "job": job.info()}
+
+@app.get("/api/jobs/{job_id}/output")
+async def get_job_output(job_id: str, request: Request, admin_id: str = "", offset: int = 0, length: int = OUTPUT_RANGE_MAX):
+    """Fetch a byte range of a job's output (stdout and stderr combined)"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    job = await load_job(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "Job not found"}, status_code=404)
+    return await byte_range_response(job.output_path, request, offset, length, "Job has no output yet")
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, admin_id: str = "", offset: int = 0):
+    """Follow a job's output as Server-Sent Events
+    
+    Emits 'output' events with text from byte offset onwards as it is
+    written, then a 'done' event with the job once it has finished.
+    """
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    job = await load_job(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "Job not found"}, status_code=404)
+    
+    async def events():
+        nonlocal job
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        position = max(offset, 0)
+        while True:
+            # Checked before reading so output written just before the end
+            # isn't missed; jobs of other workers are followed through the table
+            job = jobs.get(job_id) or await load_job(job_id) or job
+            done = job.done
             try:
-                os.unlink(tmp_path)
-            except (FileNotFoundError, PermissionError) as e:
-                logger.warning(f"Could not delete temp file {tmp_path}: {e}")
-                
+                data, _ = await asyncio.get_running_loop().run_in_executor(
+                    None, _read_range, job.output_path, position, OUTPUT_CHUNK_SIZE)
+            except FileNotFoundError:
+                data = b""
+            if data:
+                position += len(data)
+                text = decoder.decode(data)
+                if text:
+                    yield sse_event("output", text)
+                continue
+            if done:
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    yield sse_event("output", tail)
+                yield sse_event("done", (await load_job(job_id) or job).info())
+                return
+            await asyncio.sleep(JOB_STREAM_POLL_INTERVAL)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, request: Request):
+    """Cancel a queued or running job, killing its processes"""
+    try:
+        data = await request.json()
     except Exception as e:
-        logger.error(f"Error in run_python_file: {e}")
-        return JSONResponse({
-            "success": False,
-            "error": f"Server error: {str(e)}"
-        })
+        return JSONResponse({"success": False, "error": f"Server error: {str(e)}"})
+    if not verify_admin(data.get("admin_id", "")):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    job = jobs.get(job_id)
+    if job is not None and job.task is not None and not job.done:
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return {"success": True, "job": job.info()}
+    
+    job = await load_job(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "Job not found"}, status_code=404)
+    if job.done or job_store is None:
+        return JSONResponse({"success": False, "error": f"Job already {job.status}", "job": job.info()})
+    # Started by another worker: kill its processes directly, and the table
+    # keeps the job cancelled whatever that worker reports afterwards
+    host = job.owner.rpartition(":")[0]
+    if host != socket.gethostname():
+        return JSONResponse({"success": False, "error": f"Job runs on another host ({host})", "job": job.info()})
+    if job.pid:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(job.pid, signal.SIGKILL)
+    job.status = "cancelled"
+    job.finished = time.time()
+    await save_job(job)
+    return {"success": True, "job": job.info()}
 
 @app.get("/health")
 async def health():
@@ -1002,11 +4053,11 @@ async def health():
     return {"status": "healthy", "bot": "running"}
 
 @app.get("/api/pwd")
-async def get_pwd():
-    """Get current working directory"""
+async def get_pwd(session_id: str = "default"):
+    """Get current working directory of a shell session"""
     return {
         "success": True,
-        "cwd": shell_state["cwd"]
+        "cwd": await session_cwd(session_id)
     }
 
 @app.get("/api/status")
@@ -1019,6 +4070,123 @@ async def status():
         "web_console": "enabled"
     }
 
+# ===== Node.js Worker Pool =====
+# /api/run-javascript sends code to long-lived node processes (node_worker.js)
+# that run it in a fresh vm context, avoiding a V8 cold start per request.
+# Set HFS_NODE_POOL_SIZE=0 to start a new node process for every run instead.
+NODE_POOL_SIZE = int(os.environ.get("HFS_NODE_POOL_SIZE", os.cpu_count() or 1))
+NODE_WORKER_MAX_RUNS = int(os.environ.get("HFS_NODE_WORKER_MAX_RUNS", 200))
+NODE_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node_worker.js")
+NODE_RESPONSE_MARKER = b"\x1eHFS"
+
+class NodeWorker:
+    """A warm node process running node_worker.js"""
+
+    def __init__(self, proc, cgroup=None):
+        self.proc = proc
+        self.cgroup = cgroup
+        self.runs = 0
+        # Set when a run left sockets or requests behind in the worker
+        self.dirty = False
+
+    @classmethod
+    async def spawn(cls):
+        cgroup = ExecCgroup.create()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *exec_wrapper(["node", NODE_WORKER_SCRIPT], cgroup, warm=True),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                env=shell_state["env"],
+                start_new_session=True,
+                limit=64 * 1024 * 1024,
+            )
+        except BaseException:
+            if cgroup is not None:
+                cgroup.remove()
+            raise
+        apply_rlimits(proc.pid, warm=True)
+        return cls(proc, cgroup)
+
+    async def run(self, code, cwd, timeout):
+        """Run code and return {"stdout", "stderr", "return_code", "usage"} with OutputCapture streams"""
+        self.runs += 1
+        # Usage is measured on the worker process around this run
+        renew_cpu_limit(self.proc.pid)
+        reset_peak_rss(self.proc.pid)
+        started = time.monotonic()
+        cpu_before = proc_cpu_times(self.proc.pid)
+        # The worker keeps the start of each stream and writes the rest to
+        # these files, which are then appended to the captures
+        os.makedirs(OUTPUT_SPILL_DIR, exist_ok=True)
+        prefix = os.path.join(OUTPUT_SPILL_DIR, f"node-{uuid.uuid4().hex}")
+        spill = {"stdout": prefix + ".stdout.part", "stderr": prefix + ".stderr.part"}
+        request = {"code": code, "cwd": cwd, "timeout": timeout,
+                   "max_output": OUTPUT_MEMORY_LIMIT, "max_spill": OUTPUT_SPILL_MAX, "spill": spill}
+        self.proc.stdin.write((json.dumps(request) + "\n").encode())
+        await self.proc.stdin.drain()
+        
+        captures = {"stdout": OutputCapture(), "stderr": OutputCapture()}
+        
+        async def read_response():
+            # Child processes may write straight to the worker's stdout;
+            # anything before the marker is treated as program output
+            while True:
+                line = await self.proc.stdout.readline()
+                if not line:
+                    await self.proc.wait()
+                    if self.proc.returncode == -signal.SIGXCPU:
+                        raise RuntimeError(f"CPU time limit of {RLIMIT_CPU} seconds exceeded")
+                    raise RuntimeError("Node.js worker exited unexpectedly")
+                index = line.find(NODE_RESPONSE_MARKER)
+                if index == -1:
+                    captures["stdout"].write(line)
+                    continue
+                captures["stdout"].write(line[:index])
+                response = json.loads(line[index + len(NODE_RESPONSE_MARKER):])
+                if response.pop("recycle", False):
+                    self.dirty = True
+                for name, capture in captures.items():
+                    capture.write(base64.b64decode(response[name]))
+                    capture.write_file(spill[name])
+                    capture.finish()
+                    response[name] = capture
+                response["usage"] = usage_info(time.monotonic() - started, proc_cpu_since(self.proc.pid, cpu_before),
+                                               peak_rss(self.proc.pid))
+                return response
+        
+        try:
+            return await asyncio.wait_for(read_response(), timeout=timeout)
+        except BaseException:
+            for name, capture in captures.items():
+                capture.discard()
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(spill[name])
+            raise
+
+    def needs_recycle(self):
+        return self.dirty or self.runs >= NODE_WORKER_MAX_RUNS
+
+    def kill(self):
+        _kill_process_group(self.proc)
+        if self.cgroup is not None:
+            self.cgroup.remove()
+            self.cgroup = None
+
+node_pool = None
+
+@app.on_event("startup")
+async def start_node_pool():
+    global node_pool
+    if NODE_POOL_SIZE > 0 and shutil.which("node"):
+        node_pool = WorkerPool(NodeWorker, NODE_POOL_SIZE, "Node.js")
+        await node_pool.start()
+
+@app.on_event("shutdown")
+async def stop_node_pool():
+    if node_pool is not None:
+        node_pool.close()
+
 @app.post("/api/run-javascript")
 async def run_javascript(request: Request):
     """Execute JavaScript code using Node.js"""
@@ -1026,6 +4194,7 @@ async def run_javascript(request: Request):
         data = await request.json()
         code = data.get("code", "").strip()
         admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
         
         if not code:
             return JSONResponse({"success": False, "error": "No code provided"})
@@ -1036,6 +4205,26 @@ async def run_javascript(request: Request):
         
         logger.info(f"Executing JavaScript code (length: {len(code)})")
         
+        started = time.monotonic()
+        cwd = await session_cwd(session_id)
+        if node_pool is not None:
+            result = await node_pool.run(code, cwd, timeout=EXEC_TIMEOUT)
+            if "error" in result:
+                record_execution("run-javascript", code, started, session_id, cwd, exit_code=1,
+                                 timed_out=result["error"].startswith("Execution timed out"), output=result["error"])
+                return JSONResponse(result)
+            stdout, stderr = result["stdout"], result["stderr"]
+            record_execution("run-javascript", code, started, session_id, cwd,
+                             result["return_code"], output=stdout.text() + stderr.text(),
+                             output_bytes=stdout.size + stderr.size, usage=result["usage"])
+            
+            return JSONResponse({
+                "success": True,
+                **output_response(stdout if stdout.size else stderr, "Code executed successfully (no output)"),
+                "return_code": result["return_code"],
+                "usage": result["usage"]
+            })
+        
         # Save code to temp file
         with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as tmp:
             tmp.write(code)
@@ -1043,30 +4232,31 @@ async def run_javascript(request: Request):
         
         try:
             # Execute with Node.js
-            result = subprocess.run(
+            result = await run_subprocess(
                 ['node', tmp_path],
-                capture_output=True,
-                text=True,
-                timeout=30,
-                cwd=shell_state["cwd"],
+                cwd=cwd,
                 env=shell_state["env"]
             )
+            record_execution("run-javascript", code, started, session_id, cwd,
+                             result.returncode, result.timed_out, result.stdout.text() + result.stderr.text(),
+                             result.stdout.size + result.stderr.size, usage=result.usage)
+            
+            if result.timed_out:
+                return JSONResponse({
+                    "success": False,
+                    "error": f"Execution timed out after {EXEC_TIMEOUT} seconds",
+                    "usage": result.usage
+                })
             
-            output = result.stdout if result.stdout else result.stderr
-            if not output:
-                output = "Code executed successfully (no output)"
+            output = result.stdout if result.stdout.size else result.stderr
             
             return JSONResponse({
                 "success": True,
-                "output": output,
-                "return_code": result.returncode
+                **output_response(output, "Code executed successfully (no output)"),
+                "return_code": result.returncode,
+                "usage": result.usage
             })
             
-        except subprocess.TimeoutExpired:
-            return JSONResponse({
-                "success": False,
-                "error": "Execution timed out after 30 seconds"
-            })
         except FileNotFoundError:
             return JSONResponse({
                 "success": False,
@@ -1085,6 +4275,533 @@ async def run_javascript(request: Request):
             "error": f"Server error: {str(e)}"
         })
 
+# ===== AI Chat =====
+AI_SYSTEM_PROMPT = "You are a professional coding assistant. Help users write, debug, and improve code. Provide clear, concise, and accurate responses. When providing code, use markdown code blocks with the appropriate language."
+AI_FALLBACK_MODELS = ["gpt-4o", "gpt-4", "gpt-3.5-turbo", "gpt-4o-mini"]
+AI_MAX_TOKENS = 2000
+AI_TEMPERATURE = 0.7
+AI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+AI_CLIENT_CACHE_SIZE = int(os.environ.get("HFS_AI_CLIENT_CACHE_SIZE", 32))
+AI_CLIENT_IDLE_TIMEOUT = int(os.environ.get("HFS_AI_CLIENT_IDLE_TIMEOUT", 600))
+
+class CachedAIClient:
+    """An AsyncOpenAI client shared by requests using the same key and base URL"""
+
+    def __init__(self, client):
+        self.client = client
+        self.active = 0
+        self.evicted = False
+        self.last_used = time.monotonic()
+
+    def release(self):
+        """Close the client once it is evicted and no request is using it"""
+        if self.evicted and self.active == 0:
+            asyncio.ensure_future(self.client.close())
+
+# (sha256 of API key, base URL) -> CachedAIClient, least recently used first
+ai_clients = OrderedDict()
+
+def evict_ai_client(key):
+    entry = ai_clients.pop(key)
+    entry.evicted = True
+    entry.release()
+
+def evict_idle_ai_clients():
+    now = time.monotonic()
+    for key, entry in list(ai_clients.items()):
+        if entry.active == 0 and now - entry.last_used > AI_CLIENT_IDLE_TIMEOUT:
+            evict_ai_client(key)
+
+@contextlib.asynccontextmanager
+async def ai_client(api_key, base_url=None):
+    """Borrow a pooled AsyncOpenAI client, keeping its connections alive between requests"""
+    base_url = base_url or AI_BASE_URL
+    key = (hashlib.sha256(api_key.encode()).hexdigest(), base_url)
+    entry = ai_clients.get(key)
+    if entry is None:
+        entry = CachedAIClient(openai.AsyncOpenAI(api_key=api_key, base_url=base_url))
+        ai_clients[key] = entry
+        while len(ai_clients) > AI_CLIENT_CACHE_SIZE:
+            evict_ai_client(next(iter(ai_clients)))
+    else:
+        ai_clients.move_to_end(key)
+    
+    entry.active += 1
+    try:
+        yield entry.client
+    finally:
+        entry.active -= 1
+        entry.last_used = time.monotonic()
+        entry.release()
+
+async def _ai_client_reaper():
+    while True:
+        await asyncio.sleep(60)
+        evict_idle_ai_clients()
+
+@app.on_event("startup")
+async def start_ai_client_reaper():
+    asyncio.ensure_future(_ai_client_reaper())
+
+@app.on_event("shutdown")
+async def close_ai_clients():
+    for entry in ai_clients.values():
+        await entry.client.close()
+    ai_clients.clear()
+
+def parse_base_url(data):
+    """Optional OpenAI-compatible base URL from a request, or None"""
+    base_url = (data.get("base_url") or "").strip()
+    if base_url and not base_url.startswith(("http://", "https://")):
+        raise ValueError("Base URL must start with http:// or https://")
+    return base_url or None
+
+# Model routing
+AI_MODEL_UNAVAILABLE_TTL = int(os.environ.get("HFS_AI_MODEL_UNAVAILABLE_TTL", 3600))
+AI_MODEL_STATS_WINDOW = 50
+AI_MODEL_MAX_ERROR_RATE = 0.5
+AI_HEDGE_AFTER = float(os.environ.get("HFS_AI_HEDGE_AFTER", 0))
+
+def is_model_unavailable(error):
+    """Whether an OpenAI error means the model can't be used with this key"""
+    if getattr(error, "code", None) == "model_not_found":
+        return True
+    message = str(error).lower()
+    return "model" in message and ("not found" in message or "does not exist" in message)
+
+def is_upstream_failure(error):
+    """Whether an OpenAI error is the provider's fault: a timeout, a failed connection or a 5xx
+    
+    Client errors such as a bad key or a rate limit say nothing about the
+    model and aren't counted against it.
+    """
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class ModelRouter:
+    """Remembers which models each API key can't use and how models perform
+    
+    Models that answered "not found" for a key are skipped for
+    unavailable_ttl seconds. The latency and outcome of the last window
+    requests of each model decide the fallback order and hedge delay; only
+    upstream failures count as errors.
+    """
+
+    def __init__(self, unavailable_ttl, window):
+        self.unavailable_ttl = unavailable_ttl
+        self.window = window
+        self._unavailable = {}  # (client key, model) -> expiry
+        self._history = {}      # (base URL, model) -> deque of (latency, ok)
+
+    @staticmethod
+    def _client_key(client):
+        key_hash = hashlib.sha256(client.api_key.encode()).hexdigest()[:16]
+        return key_hash, str(client.base_url)
+
+    def is_unavailable(self, client, model):
+        key = (self._client_key(client), model)
+        expires = self._unavailable.get(key)
+        if expires is None:
+            return False
+        if time.monotonic() >= expires:
+            del self._unavailable[key]
+            return False
+        return True
+
+    def mark_unavailable(self, client, model):
+        self._unavailable[(self._client_key(client), model)] = time.monotonic() + self.unavailable_ttl
+
+    def record(self, client, model, latency, ok):
+        history = self._history.setdefault((str(client.base_url), model), deque(maxlen=self.window))
+        history.append((latency, ok))
+
+    def stats(self, base_url, model):
+        history = self._history.get((base_url, model), ())
+        latencies = sorted(latency for latency, ok in history if ok)
+        errors = sum(1 for _, ok in history if not ok)
+        return {
+            "requests": len(history),
+            "error_rate": round(errors / len(history), 3) if history else 0.0,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            "p90_ms": round(percentile(latencies, 0.9) * 1000, 1) if latencies else None,
+        }
+
+    def is_failing(self, client, model):
+        stats = self.stats(str(client.base_url), model)
+        return stats["requests"] >= 5 and stats["error_rate"] >= AI_MODEL_MAX_ERROR_RATE
+
+    def candidates(self, client, model):
+        """Models to try in order: model first, then the fallbacks
+        
+        Models known to be unavailable for this key are left out, and models
+        with a high recent error rate are tried last.
+        """
+        models = [model] + [m for m in AI_FALLBACK_MODELS if m != model]
+        available = [m for m in models if not self.is_unavailable(client, m)] or models
+        return sorted(available, key=lambda m: self.is_failing(client, m))
+
+    def hedge_delay(self, client, model):
+        """Seconds to wait for model before also asking another one, or None"""
+        if AI_HEDGE_AFTER <= 0:
+            return None
+        stats = self.stats(str(client.base_url), model)
+        if stats["p90_ms"] is not None and stats["requests"] >= 10:
+            return max(AI_HEDGE_AFTER, stats["p90_ms"] / 1000)
+        return AI_HEDGE_AFTER
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "models": {
+                f"{model} @ {base_url}": self.stats(base_url, model)
+                for base_url, model in self._history
+            },
+            "unavailable": sorted({
+                model for (_, model), expires in self._unavailable.items() if expires > now
+            }),
+        }
+
+model_router = ModelRouter(AI_MODEL_UNAVAILABLE_TTL, AI_MODEL_STATS_WINDOW)
+
+async def _ai_attempt(client, model_name, prompt, stream):
+    """One completion request to one model, recorded by the router"""
+    start = time.monotonic()
+    try:
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": AI_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=AI_MAX_TOKENS,
+            temperature=AI_TEMPERATURE,
+            stream=stream
+        )
+    except asyncio.CancelledError:
+        ai_upstream_duration.observe(time.monotonic() - start, model_name, "cancelled")
+        raise
+    except Exception as e:
+        elapsed = time.monotonic() - start
+        if is_model_unavailable(e):
+            model_router.mark_unavailable(client, model_name)
+            ai_upstream_duration.observe(elapsed, model_name, "unavailable")
+        elif is_upstream_failure(e):
+            model_router.record(client, model_name, elapsed, False)
+            ai_upstream_duration.observe(elapsed, model_name, "error")
+        else:
+            ai_upstream_duration.observe(elapsed, model_name, "client_error")
+        raise
+    elapsed = time.monotonic() - start
+    model_router.record(client, model_name, elapsed, True)
+    ai_upstream_duration.observe(elapsed, model_name, "ok")
+    return model_name, response
+
+async def _hedged_ai_attempt(client, primary, backup, prompt, delay):
+    """Ask primary, and backup too if primary hasn't answered after delay
+    
+    Returns whichever succeeds first and cancels the other.
+    """
+    first = asyncio.ensure_future(_ai_attempt(client, primary, prompt, False))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    
+    logger.info(f"Model {primary} slower than {delay:.1f}s, hedging with {backup}")
+    ai_hedges.inc()
+    pending = {first, asyncio.ensure_future(_ai_attempt(client, backup, prompt, False))}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def ai_completion(client, model, prompt, stream=False):
+    """Request a chat completion, falling back to other models if model is unavailable
+    
+    Returns (model_used, response); with stream=True the response is an
+    async stream of chunks. Models the router knows to be unavailable are
+    skipped, and with HFS_AI_HEDGE_AFTER set a slow first attempt is raced
+    against the next model (not for streams, which would answer twice).
+    """
+    candidates = model_router.candidates(client, model)
+    
+    last_error = None
+    for index, model_name in enumerate(candidates):
+        if index > 0 and model_router.is_unavailable(client, model_name):
+            continue
+        try:
+            delay = model_router.hedge_delay(client, model_name) if not stream else None
+            if index == 0 and delay is not None and len(candidates) > 1:
+                return await _hedged_ai_attempt(client, model_name, candidates[1], prompt, delay)
+            return await _ai_attempt(client, model_name, prompt, stream)
+        except Exception as model_error:
+            last_error = model_error
+            # If model not found, try next one
+            if is_model_unavailable(model_error):
+                logger.warning(f"Model {model_name} not available, trying next...")
+                continue
+            else:
+                # For other errors, don't try other models
+                raise
+    
+    # If we get here, all models failed
+    raise last_error if last_error else Exception("No models available")
+
+@app.get("/api/ai-models")
+async def ai_models_info(admin_id: str = ""):
+    """Rolling latency and error rates per model, and models known to be unavailable"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    return {"success": True, **model_router.snapshot()}
+
+def ai_error_message(error):
+    """User-facing description of an OpenAI API error"""
+    error_msg = str(error)
+    if "api_key" in error_msg.lower() or "authentication" in error_msg.lower():
+        error_msg = "Invalid API key. Please check your OpenAI API key."
+    elif "rate" in error_msg.lower() or "quota" in error_msg.lower():
+        error_msg = "Rate limit or quota exceeded. Please try again later or check your OpenAI account."
+    return f"OpenAI API error: {error_msg}"
+
+# AI response cache (opt-in with HFS_AI_CACHE=memory or HFS_AI_CACHE=redis)
+AI_CACHE_BACKEND = os.environ.get("HFS_AI_CACHE", "").strip().lower()
+AI_CACHE_TTL = int(os.environ.get("HFS_AI_CACHE_TTL", 3600))
+AI_CACHE_SIZE = int(os.environ.get("HFS_AI_CACHE_SIZE", 256))
+
+class MemoryResponseCache:
+    """In-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def entries(self):
+        return len(self._entries)
+
+class RedisResponseCache:
+    """Response cache shared through Redis
+    
+    Entries expire after ttl seconds; the size bound is left to the Redis
+    server's maxmemory policy.
+    """
+
+    def __init__(self, url, ttl, prefix="hfs:ai-cache:"):
+        import redis.asyncio
+        self.redis = redis.asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.redis.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value):
+        await self.redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def entries(self):
+        return None  # unknown without scanning the server
+
+def _make_ai_response_cache():
+    if AI_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+    if AI_CACHE_BACKEND == "redis":
+        try:
+            return RedisResponseCache(REDIS_URL, AI_CACHE_TTL)
+        except ImportError:
+            logger.warning("redis library not available, caching AI responses in memory")
+            return MemoryResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+    if AI_CACHE_BACKEND:
+        logger.warning(f"Unknown HFS_AI_CACHE backend {AI_CACHE_BACKEND!r}, AI response cache disabled")
+    return None
+
+ai_response_cache = _make_ai_response_cache()
+ai_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+# Cache key -> task running the one upstream request for that key
+ai_inflight = {}
+# Cache key -> the one upstream stream for that key, shared by its followers
+ai_stream_inflight = {}
+
+def ai_cache_key(api_key, model, prompt, base_url):
+    """Key identifying a completion by everything that determines its output
+
+    The caller's API key is part of it: an answer is only served to, and an
+    in-flight request only shared with, callers using the key that paid for it.
+    """
+    parts = [hashlib.sha256(api_key.encode()).hexdigest(), base_url or AI_BASE_URL or "", model, AI_SYSTEM_PROMPT,
+             prompt, repr(AI_TEMPERATURE), str(AI_MAX_TOKENS)]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8", "surrogatepass")).hexdigest()
+
+async def ai_cache_get(key):
+    try:
+        return await ai_response_cache.get(key)
+    except Exception as e:
+        # A cache outage must not take the AI assistant down with it
+        ai_cache_stats["errors"] += 1
+        logger.warning(f"AI response cache read failed: {e}")
+        return None
+
+async def ai_cache_set(key, value):
+    try:
+        await ai_response_cache.set(key, value)
+    except Exception as e:
+        ai_cache_stats["errors"] += 1
+        logger.warning(f"AI response cache write failed: {e}")
+
+async def cached_ai_completion(api_key, base_url, model, prompt):
+    """Complete prompt through the response cache
+    
+    Returns ({"response", "model_used"}, cached). Identical requests made
+    while one is in flight wait for that request instead of sending their
+    own. The upstream call runs in its own task, so it completes for the
+    remaining waiters even if the request that started it goes away.
+    """
+    key = ai_cache_key(api_key, model, prompt, base_url)
+    result = await ai_cache_get(key)
+    if result is not None:
+        ai_cache_stats["hits"] += 1
+        return result, True
+    
+    task = ai_inflight.get(key)
+    if task is not None:
+        ai_cache_stats["coalesced"] += 1
+        return await asyncio.shield(task), True
+    
+    async def fetch():
+        async with ai_client(api_key, base_url) as client:
+            model_used, response = await ai_completion(client, model, prompt)
+        choice = response.choices[0]
+        result = {"response": choice.message.content, "model_used": model_used}
+        # Only complete replies are worth serving again
+        if choice.finish_reason == "stop":
+            await ai_cache_set(key, result)
+        return result
+    
+    def done(task):
+        ai_inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+    
+    ai_cache_stats["misses"] += 1
+    task = asyncio.ensure_future(fetch())
+    ai_inflight[key] = task
+    task.add_done_callback(done)
+    return await asyncio.shield(task), False
+
+class AIStreamFanout:
+    """One upstream streamed completion, replayed to every request following it
+
+    A follower joining late first gets the tokens sent so far. The upstream
+    stream runs in its own task, which is cancelled when the last follower
+    goes away. With a cache key, the fan-out is shared through
+    ai_stream_inflight and a complete reply is cached.
+    """
+
+    def __init__(self, api_key, base_url, model, prompt, cache_key=None):
+        self.tokens = []
+        self.model_used = None
+        self.finish_reason = None
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self.cache_key = cache_key
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(api_key, base_url, model, prompt))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _forget(self):
+        if self.cache_key and ai_stream_inflight.get(self.cache_key) is self:
+            del ai_stream_inflight[self.cache_key]
+
+    async def _run(self, api_key, base_url, model, prompt):
+        try:
+            async with ai_client(api_key, base_url) as client:
+                self.model_used, stream = await ai_completion(client, model, prompt, stream=True)
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        choice = chunk.choices[0]
+                        if choice.delta and choice.delta.content:
+                            self.tokens.append(choice.delta.content)
+                            self._notify()
+                        if choice.finish_reason:
+                            self.finish_reason = choice.finish_reason
+                finally:
+                    await stream.close()
+            # Only complete replies are worth serving again
+            if self.cache_key and self.finish_reason == "stop":
+                await ai_cache_set(self.cache_key, {"response": "".join(self.tokens), "model_used": self.model_used})
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._forget()
+            self._notify()
+
+    async def follow(self):
+        """Yield the reply's tokens from the start; check error once done"""
+        self.followers += 1
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.tokens):
+                    index += 1
+                    yield self.tokens[index - 1]
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done:
+                # Nobody is left to read it; later requests start afresh
+                self._forget()
+                self._task.cancel()
+
+@app.get("/api/ai-cache")
+async def ai_cache_info(admin_id: str = ""):
+    """Counters of the AI response cache"""
+    if not verify_admin(admin_id):
+        return JSONResponse({"success": False, "error": "Unauthorized"})
+    
+    return {
+        "success": True,
+        "backend": AI_CACHE_BACKEND if ai_response_cache is not None else None,
+        "entries": ai_response_cache.entries() if ai_response_cache is not None else 0,
+        "in_flight": len(ai_inflight) + len(ai_stream_inflight),
+        **ai_cache_stats
+    }
+
 @app.post("/api/ai-chat")
 async def ai_chat(request: Request):
     """Chat with OpenAI GPT for code assistance
@@ -1113,6 +4830,11 @@ async def ai_chat(request: Request):
         if not api_key:
             return JSONResponse({"success": False, "error": "No API key provided"})
         
+        try:
+            base_url = parse_base_url(data)
+        except ValueError as e:
+            return JSONResponse({"success": False, "error": str(e)})
+        
         # Verify admin
         if not verify_admin(admin_id):
             return JSONResponse({"success": False, "error": "Unauthorized"})
@@ -1120,57 +4842,23 @@ async def ai_chat(request: Request):
         logger.info(f"AI Chat request (prompt length: {len(prompt)}, model: {model})")
         
         try:
-            # Create OpenAI client
-            client = openai.OpenAI(api_key=api_key)
+            if ai_response_cache is not None and data.get("cache", True):
+                result, cached = await cached_ai_completion(api_key, base_url, model, prompt)
+                return JSONResponse({"success": True, **result, "cached": cached})
             
-            # List of models to try in order of preference
-            # User's selected model first, then fallbacks (with duplicates removed)
-            fallback_models = ["gpt-4o", "gpt-4", "gpt-3.5-turbo", "gpt-4o-mini"]
-            models_to_try = [model] + [m for m in fallback_models if m != model]
-            
-            last_error = None
-            for model_name in models_to_try:
-                try:
-                    # Make API call
-                    response = client.chat.completions.create(
-                        model=model_name,
-                        messages=[
-                            {"role": "system", "content": "You are a professional coding assistant. Help users write, debug, and improve code. Provide clear, concise, and accurate responses. When providing code, use markdown code blocks with the appropriate language."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        max_tokens=2000,
-                        temperature=0.7
-                    )
-                    
-                    ai_response = response.choices[0].message.content
-                    
-                    return JSONResponse({
-                        "success": True,
-                        "response": ai_response,
-                        "model_used": model_name
-                    })
-                except Exception as model_error:
-                    last_error = model_error
-                    # If model not found, try next one
-                    if "model" in str(model_error).lower() and "not found" in str(model_error).lower():
-                        logger.warning(f"Model {model_name} not available, trying next...")
-                        continue
-                    else:
-                        # For other errors, don't try other models
-                        raise
+            async with ai_client(api_key, base_url) as client:
+                model_used, response = await ai_completion(client, model, prompt)
             
-            # If we get here, all models failed
-            raise last_error if last_error else Exception("No models available")
+            return JSONResponse({
+                "success": True,
+                "response": response.choices[0].message.content,
+                "model_used": model_used
+            })
             
         except Exception as e:
-            error_msg = str(e)
-            if "api_key" in error_msg.lower() or "authentication" in error_msg.lower():
-                error_msg = "Invalid API key. Please check your OpenAI API key."
-            elif "rate" in error_msg.lower() or "quota" in error_msg.lower():
-                error_msg = "Rate limit or quota exceeded. Please try again later or check your OpenAI account."
             return JSONResponse({
                 "success": False,
-                "error": f"OpenAI API error: {error_msg}"
+                "error": ai_error_message(e)
             })
             
     except Exception as e:
@@ -1180,6 +4868,90 @@ async def ai_chat(request: Request):
             "error": f"Server error: {str(e)}"
         })
 
+@app.post("/api/ai-chat/stream")
+async def ai_chat_stream(request: Request):
+    """Chat with OpenAI GPT, streaming the reply as Server-Sent Events
+    
+    Emits 'token' events with text as the model generates it, then a 'done'
+    event with the model used and finish reason, or an 'error' event. Takes
+    the same fields as /api/ai-chat. Cached replies arrive as a single token;
+    a request identical to one already streaming follows that stream.
+    """
+    try:
+        if not OPENAI_AVAILABLE:
+            return JSONResponse({
+                "success": False,
+                "error": "OpenAI library is not installed. Please install it with: pip install openai"
+            })
+        
+        data = await request.json()
+        prompt = data.get("prompt", "").strip()
+        api_key = data.get("api_key", "").strip()
+        admin_id = data.get("admin_id", "")
+        model = data.get("model", "gpt-4o")
+        
+        if not prompt:
+            return JSONResponse({"success": False, "error": "No prompt provided"})
+        
+        if not api_key:
+            return JSONResponse({"success": False, "error": "No API key provided"})
+        
+        try:
+            base_url = parse_base_url(data)
+        except ValueError as e:
+            return JSONResponse({"success": False, "error": str(e)})
+        
+        # Verify admin
+        if not verify_admin(admin_id):
+            return JSONResponse({"success": False, "error": "Unauthorized"})
+    except Exception as e:
+        logger.error(f"Error in ai_chat_stream: {e}")
+        return JSONResponse({"success": False, "error": f"Server error: {str(e)}"})
+    
+    logger.info(f"AI Chat stream request (prompt length: {len(prompt)}, model: {model})")
+    
+    use_cache = ai_response_cache is not None and data.get("cache", True)
+    cache_key = ai_cache_key(api_key, model, prompt, base_url) if use_cache else None
+    
+    async def events():
+        try:
+            fanout = None
+            if use_cache:
+                result = await ai_cache_get(cache_key)
+                if result is not None:
+                    ai_cache_stats["hits"] += 1
+                    yield sse_event("token", {"text": result["response"]})
+                    yield sse_event("done", {"model_used": result["model_used"], "finish_reason": "stop", "cached": True})
+                    return
+                # Identical requests in flight follow the same upstream stream
+                fanout = ai_stream_inflight.get(cache_key)
+                coalesced = fanout is not None
+                if coalesced:
+                    ai_cache_stats["coalesced"] += 1
+                else:
+                    ai_cache_stats["misses"] += 1
+                    fanout = ai_stream_inflight[cache_key] = AIStreamFanout(api_key, base_url, model, prompt, cache_key)
+            else:
+                fanout = AIStreamFanout(api_key, base_url, model, prompt)
+                coalesced = False
+            
+            async for text in fanout.follow():
+                yield sse_event("token", {"text": text})
+            if fanout.error is not None:
+                raise fanout.error
+            done = {"model_used": fanout.model_used, "finish_reason": fanout.finish_reason}
+            if coalesced:
+                done["cached"] = True
+            yield sse_event("done", done)
+        except Exception as e:
+            yield sse_event("error", {"error": ai_error_message(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/save-file")
 async def save_file(request: Request):
     """Save code to a file on the server"""
@@ -1188,6 +4960,7 @@ async def save_file(request: Request):
         filename = data.get("filename", "").strip()
         content = data.get("content", "")
         admin_id = data.get("admin_id", "")
+        session_id = str(data.get("session_id") or "default")
         
         if not filename:
             return JSONResponse({"success": False, "error": "No filename provided"})
@@ -1201,8 +4974,8 @@ async def save_file(request: Request):
         # Security: prevent path traversal
         filename = os.path.basename(filename)
         
-        # Save to current working directory
-        file_path = os.path.join(shell_state["cwd"], filename)
+        # Save to the session's current working directory
+        file_path = os.path.join(await session_cwd(session_id), filename)
         
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
@@ -1232,15 +5005,43 @@ async def save_file(request: Request):
             "error": f"Server error: {str(e)}"
         })
 
+# Outgoing HTTP client
+HTTP_CLIENT_TIMEOUT = 30
+HTTP_CLIENT_POOL_SIZE = int(os.environ.get("HFS_HTTP_POOL_SIZE", 100))
+HTTP_CLIENT_PER_HOST = int(os.environ.get("HFS_HTTP_PER_HOST", 10))
+HTTP_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS")
+
+_http_session = None
+
+def get_http_session():
+    """Shared client session, keeping connections alive between requests"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_CLIENT_POOL_SIZE,
+            limit_per_host=HTTP_CLIENT_PER_HOST,
+            ttl_dns_cache=300,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_CLIENT_TIMEOUT),
+        )
+    return _http_session
+
+@app.on_event("shutdown")
+async def close_http_session():
+    if _http_session is not None:
+        await _http_session.close()
+
 @app.post("/api/test-api")
 async def test_api(request: Request):
     """Test API endpoints with custom requests"""
     try:
-        # Check if requests library is available
-        if not REQUESTS_AVAILABLE:
+        # Check if aiohttp is available
+        if not AIOHTTP_AVAILABLE:
             return JSONResponse({
                 "success": False,
-                "error": "Requests library is not installed. Please install it with: pip install requests"
+                "error": "aiohttp library is not installed. Please install it with: pip install aiohttp"
             })
         
         data = await request.json()
@@ -1257,6 +5058,12 @@ async def test_api(request: Request):
         if not verify_admin(admin_id):
             return JSONResponse({"success": False, "error": "Unauthorized"})
         
+        if method not in HTTP_METHODS:
+            return JSONResponse({
+                "success": False,
+                "error": f"Unsupported HTTP method: {method}"
+            })
+        
         logger.info(f"API Test: {method} {url}")
         
         try:
@@ -1271,32 +5078,22 @@ async def test_api(request: Request):
                 body = json.loads(body_text)
             
             # Make request
-            if method == 'GET':
-                response = req_lib.get(url, headers=headers, timeout=30)
-            elif method == 'POST':
-                response = req_lib.post(url, headers=headers, json=body, timeout=30)
-            elif method == 'PUT':
-                response = req_lib.put(url, headers=headers, json=body, timeout=30)
-            elif method == 'DELETE':
-                response = req_lib.delete(url, headers=headers, timeout=30)
-            else:
-                return JSONResponse({
-                    "success": False,
-                    "error": f"Unsupported HTTP method: {method}"
-                })
+            async with get_http_session().request(method, url, headers=headers, json=body) as response:
+                response_text = await response.text(errors="replace")
+                status_code = response.status
+                response_headers = dict(response.headers)
             
             # Try to format response as JSON
             try:
-                response_json = response.json()
-                response_text = json.dumps(response_json, indent=2)
-            except:
-                response_text = response.text
+                response_text = json.dumps(json.loads(response_text), indent=2)
+            except ValueError:
+                pass
             
             return JSONResponse({
                 "success": True,
                 "response": response_text,
-                "status_code": response.status_code,
-                "headers": dict(response.headers)
+                "status_code": status_code,
+                "headers": response_headers
             })
             
         except json.JSONDecodeError as e:
@@ -1304,12 +5101,12 @@ async def test_api(request: Request):
                 "success": False,
                 "error": f"Invalid JSON: {str(e)}"
             })
-        except req_lib.exceptions.Timeout:
+        except asyncio.TimeoutError:
             return JSONResponse({
                 "success": False,
-                "error": "Request timed out after 30 seconds"
+                "error": f"Request timed out after {HTTP_CLIENT_TIMEOUT} seconds"
             })
-        except req_lib.exceptions.RequestException as e:
+        except aiohttp.ClientError as e:
             return JSONResponse({
                 "success": False,
                 "error": f"Request error: {str(e)}"
@@ -1327,8 +5124,203 @@ async def test_api(request: Request):
             "error": f"Server error: {str(e)}"
         })
 
+# Load testing
+LOAD_TEST_MAX_REQUESTS = int(os.environ.get("HFS_LOAD_TEST_MAX_REQUESTS", 100000))
+LOAD_TEST_MAX_DURATION = int(os.environ.get("HFS_LOAD_TEST_MAX_DURATION", 300))
+LOAD_TEST_MAX_CONCURRENCY = int(os.environ.get("HFS_LOAD_TEST_MAX_CONCURRENCY", 256))
+LOAD_TEST_PROGRESS_INTERVAL = 0.5
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class LoadTestStats:
+    """Latencies, status codes and errors collected during a load test"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies = []
+        self.status_codes = {}
+        self.errors = {}
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+    def record_error(self, error):
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        completed = len(self.latencies)
+        error_count = sum(self.errors.values())
+        latencies = sorted(self.latencies)
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+        return {
+            "requests": completed + error_count,
+            "completed": completed,
+            "errors": error_count,
+            "elapsed": round(elapsed, 3),
+            "rps": round((completed + error_count) / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 0.50)),
+                "p90": ms(percentile(latencies, 0.90)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None),
+                "mean": ms(sum(latencies) / completed if completed else None),
+            },
+            "status_codes": {str(code): count for code, count in sorted(self.status_codes.items())},
+            "error_types": dict(sorted(self.errors.items(), key=lambda item: -item[1])),
+        }
+
+async def run_load_test(stats, method, url, headers, body, total=None, duration=None, concurrency=10, rps=None):
+    """Send the same request repeatedly, recording each outcome in stats
+
+    Stops after total requests or duration seconds, whichever comes first.
+    concurrency caps the requests in flight; rps, when set, paces their
+    start times evenly. Uses its own connection pool so the run neither
+    competes with nor is limited by the shared client session.
+    """
+    deadline = stats.started + duration if duration else None
+    issued = 0
+    
+    async def worker(session):
+        nonlocal issued
+        while True:
+            if total is not None and issued >= total:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            slot = issued
+            issued += 1
+            if rps:
+                delay = stats.started + slot / rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, headers=headers, json=body) as response:
+                    await response.read()
+                stats.record(time.perf_counter() - start, response.status)
+            except asyncio.TimeoutError:
+                stats.record_error("Timeout")
+            except aiohttp.ClientError as e:
+                stats.record_error(type(e).__name__)
+    
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=0, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_CLIENT_TIMEOUT)) as session:
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+
+def _number_field(data, key, cast, default=None):
+    """Numeric request field, or default when it is missing or blank"""
+    value = data.get(key)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+@app.post("/api/test-api/load")
+async def test_api_load(request: Request):
+    """Load test an endpoint, streaming statistics as Server-Sent Events
+    
+    Accepts the /api/test-api fields plus "requests" (count), "duration"
+    (seconds), "concurrency" and an optional target "rps". Emits 'progress'
+    events with running statistics, then a final 'done' event, or 'error'.
+    """
+    try:
+        if not AIOHTTP_AVAILABLE:
+            return JSONResponse({
+                "success": False,
+                "error": "aiohttp library is not installed. Please install it with: pip install aiohttp"
+            })
+        
+        data = await request.json()
+        method = data.get("method", "GET").upper()
+        url = data.get("url", "").strip()
+        headers_text = data.get("headers", "{}")
+        body_text = data.get("body", "{}")
+        admin_id = data.get("admin_id", "")
+        
+        if not url:
+            return JSONResponse({"success": False, "error": "No URL provided"})
+        
+        # Verify admin
+        if not verify_admin(admin_id):
+            return JSONResponse({"success": False, "error": "Unauthorized"})
+        
+        if method not in HTTP_METHODS:
+            return JSONResponse({"success": False, "error": f"Unsupported HTTP method: {method}"})
+        
+        try:
+            total = _number_field(data, "requests", int)
+            duration = _number_field(data, "duration", float)
+            concurrency = _number_field(data, "concurrency", int, 10)
+            rps = _number_field(data, "rps", float)
+            headers = json.loads(headers_text) if headers_text.strip() else {}
+            body = None
+            if body_text.strip() and method in ['POST', 'PUT', 'PATCH']:
+                body = json.loads(body_text)
+        except json.JSONDecodeError as e:
+            return JSONResponse({"success": False, "error": f"Invalid JSON: {str(e)}"})
+        except (TypeError, ValueError):
+            return JSONResponse({"success": False, "error": "requests, duration, concurrency and rps must be numbers"})
+        
+        if total is None and duration is None:
+            total = 100
+        if total is not None and not 0 < total <= LOAD_TEST_MAX_REQUESTS:
+            return JSONResponse({"success": False, "error": f"requests must be between 1 and {LOAD_TEST_MAX_REQUESTS}"})
+        if duration is not None and not 0 < duration <= LOAD_TEST_MAX_DURATION:
+            return JSONResponse({"success": False, "error": f"duration must be between 0 and {LOAD_TEST_MAX_DURATION} seconds"})
+        if not 0 < concurrency <= LOAD_TEST_MAX_CONCURRENCY:
+            return JSONResponse({"success": False, "error": f"concurrency must be between 1 and {LOAD_TEST_MAX_CONCURRENCY}"})
+        if rps is not None and rps <= 0:
+            return JSONResponse({"success": False, "error": "rps must be positive"})
+        
+    except Exception as e:
+        logger.error(f"Error in test_api_load: {e}")
+        return JSONResponse({"success": False, "error": f"Server error: {str(e)}"})
+    
+    logger.info(f"Load test: {method} {url} requests={total} duration={duration} concurrency={concurrency} rps={rps}")
+    
+    async def events():
+        stats = LoadTestStats()
+        task = asyncio.ensure_future(run_load_test(
+            stats, method, url, headers, body,
+            total=total, duration=duration, concurrency=concurrency, rps=rps,
+        ))
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=LOAD_TEST_PROGRESS_INTERVAL)
+                if not task.done():
+                    yield sse_event("progress", stats.summary())
+            task.result()
+            yield sse_event("done", stats.summary())
+        except Exception as e:
+            logger.error(f"Error in test_api_load: {e}")
+            yield sse_event("error", {"error": f"Load test error: {str(e)}"})
+        finally:
+            # Stop sending requests if the client goes away
+            task.cancel()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     # Run on port 7860 for Hugging Face Spaces
     port = int(os.environ.get("PORT", 7860))
-    logger.info(f"Starting web server on port {port}...")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.environ.get("HFS_WORKERS", 1))
+    if workers > 1 and SESSION_STORE == "memory":
+        # Workers are separate processes and must share session state
+        os.environ["HFS_SESSION_STORE"] = "sqlite"
+        logger.info("HFS_WORKERS > 1: sharing session state through SQLite")
+    logger.info(f"Starting web server on port {port} with {workers} worker(s)...")
+    # Several workers need the app as an import string so each can load it
+    uvicorn.run("server:app" if workers > 1 else app, host="0.0.0.0", port=port, workers=workers)
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LocalServer:
+    """An aiohttp application served on a free local port from a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self._runner = None
+
+        @web.middleware
+        async def count(request, handler):
+            self.requests += 1
+            return await handler(request)
+
+        app.middlewares.append(count)
+
+    async def _start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        return self._runner.addresses[0][1]
+
+    def start(self):
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(10)
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._thread = thread
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+        self.loop.close()
+
+
+@pytest.fixture
+def local_server():
+    """Start aiohttp applications on local ports; they are stopped after the test"""
+    servers = []
+
+    def start(app):
+        server = LocalServer(app)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """A TestClient for the server, without warm worker pools and with its own job and history files"""
+    import server
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "EVAL_POOL_SIZE", 0)
+    monkeypatch.setattr(server, "NODE_POOL_SIZE", 0)
+    monkeypatch.setattr(server, "JOB_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(server, "HISTORY_DB", str(tmp_path / "history.sqlite3"))
+    with TestClient(server.app) as client:
+        yield client
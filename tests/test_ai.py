@@ -0,0 +1,201 @@
+import json
+import threading
+
+import pytest
+
+import mock_openai
+import server
+
+PROMPT = "write a haiku about pipes"
+
+
+@pytest.fixture(autouse=True)
+def fresh_ai_state(monkeypatch):
+    """A fresh in-memory AI response cache and model router for each test"""
+    monkeypatch.setattr(server, "ai_response_cache", server.MemoryResponseCache(16, 60))
+    monkeypatch.setattr(server, "ai_cache_stats", {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0})
+    monkeypatch.setattr(server, "model_router", server.ModelRouter(60, server.AI_MODEL_STATS_WINDOW))
+
+
+def start_mock(local_server, token_delay=0.0, missing_models=(), slow_models=(), slow_delay=0):
+    return local_server(mock_openai.make_app(token_delay, set(missing_models), set(slow_models), slow_delay))
+
+
+def chat(client, upstream, path="/api/ai-chat", **fields):
+    data = {"prompt": PROMPT, "api_key": "test-key", "admin_id": "x", "model": "gpt-4o",
+            "base_url": upstream.url + "/v1", **fields}
+    return client.post(path, json=data)
+
+
+def sse_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_answers_from_upstream(client, local_server):
+    upstream = start_mock(local_server)
+    result = chat(client, upstream).json()
+    assert result["success"] is True
+    assert result["response"] == f"Echo: {PROMPT}"
+    assert result["model_used"] == "gpt-4o"
+    assert result["cached"] is False
+
+
+def test_repeated_chat_is_served_from_cache(client, local_server):
+    upstream = start_mock(local_server)
+    first = chat(client, upstream).json()
+    second = chat(client, upstream).json()
+    assert second["cached"] is True
+    assert second["response"] == first["response"]
+    assert upstream.requests == 1
+    # Opting out of the cache always asks upstream
+    assert chat(client, upstream, cache=False).json()["success"] is True
+    assert upstream.requests == 2
+
+
+def test_cache_key_covers_model_and_base_url(client, local_server):
+    upstream = start_mock(local_server)
+    other = start_mock(local_server)
+    chat(client, upstream)
+    assert chat(client, upstream, model="gpt-4").json()["cached"] is False
+    assert chat(client, other).json()["cached"] is False
+    assert upstream.requests == 2
+    assert other.requests == 1
+
+
+def test_cache_is_scoped_to_the_api_key(client, local_server):
+    upstream = start_mock(local_server)
+    assert chat(client, upstream).json()["success"] is True
+    # Another key must not get the answer the first one paid for
+    result = chat(client, upstream, api_key="invalid").json()
+    assert result["success"] is False
+    assert "Invalid API key" in result["error"]
+    events = sse_events(chat(client, upstream, path="/api/ai-chat/stream", api_key="invalid"))
+    assert [name for name, _ in events] == ["error"]
+    assert upstream.requests == 3
+
+
+def test_identical_requests_in_flight_are_coalesced(client, local_server):
+    # Each word takes 0.1s upstream, so the requests overlap
+    upstream = start_mock(local_server, token_delay=0.1)
+    results = []
+
+    def request():
+        results.append(chat(client, upstream).json())
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert [result["response"] for result in results] == [f"Echo: {PROMPT}"] * 4
+    assert sum(not result["cached"] for result in results) == 1
+    assert upstream.requests == 1
+    stats = client.get("/api/ai-cache", params={"admin_id": "x"}).json()
+    assert stats["misses"] == 1
+    assert stats["coalesced"] == 3
+    assert stats["in_flight"] == 0
+
+
+def test_failed_request_is_not_cached(client, local_server):
+    upstream = start_mock(local_server)
+    result = chat(client, upstream, api_key="invalid").json()
+    assert result["success"] is False
+    assert "Invalid API key" in result["error"]
+    assert chat(client, upstream).json()["cached"] is False
+
+
+def test_missing_model_falls_back(client, local_server):
+    upstream = start_mock(local_server, missing_models={"gpt-4o"})
+    result = chat(client, upstream, cache=False).json()
+    assert result["success"] is True
+    assert result["model_used"] == "gpt-4"
+    assert upstream.requests == 2
+    # The router remembers, so the next request goes straight to the fallback
+    assert chat(client, upstream, cache=False).json()["model_used"] == "gpt-4"
+    assert upstream.requests == 3
+    models = client.get("/api/ai-models", params={"admin_id": "x"}).json()
+    assert models["unavailable"] == ["gpt-4o"]
+
+
+def test_client_errors_do_not_count_against_the_model(client, local_server):
+    upstream = start_mock(local_server)
+    for _ in range(6):
+        assert chat(client, upstream, api_key="invalid", cache=False).json()["success"] is False
+    models = client.get("/api/ai-models", params={"admin_id": "x"}).json()["models"]
+    assert all(stats["error_rate"] == 0 for stats in models.values())
+    assert chat(client, upstream, cache=False).json()["model_used"] == "gpt-4o"
+
+
+def test_stream_sends_tokens_then_done(client, local_server):
+    upstream = start_mock(local_server, token_delay=0.01)
+    response = chat(client, upstream, path="/api/ai-chat/stream")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response)
+    tokens = [data["text"] for name, data in events if name == "token"]
+    assert len(tokens) == len(f"Echo: {PROMPT}".split(" "))
+    assert "".join(tokens) == f"Echo: {PROMPT}"
+    assert events[-1] == ("done", {"model_used": "gpt-4o", "finish_reason": "stop"})
+
+
+def test_completed_stream_is_cached(client, local_server):
+    upstream = start_mock(local_server)
+    chat(client, upstream, path="/api/ai-chat/stream")
+    events = sse_events(chat(client, upstream, path="/api/ai-chat/stream"))
+    assert events == [
+        ("token", {"text": f"Echo: {PROMPT}"}),
+        ("done", {"model_used": "gpt-4o", "finish_reason": "stop", "cached": True}),
+    ]
+    # The non-streaming endpoint shares the cache
+    assert chat(client, upstream).json()["cached"] is True
+    assert upstream.requests == 1
+
+
+def test_stream_falls_back_on_missing_model(client, local_server):
+    upstream = start_mock(local_server, missing_models={"gpt-4o", "gpt-4"})
+    events = sse_events(chat(client, upstream, path="/api/ai-chat/stream", cache=False))
+    assert events[-1] == ("done", {"model_used": "gpt-3.5-turbo", "finish_reason": "stop"})
+
+
+def test_stream_reports_errors_as_events(client, local_server):
+    upstream = start_mock(local_server)
+    events = sse_events(chat(client, upstream, path="/api/ai-chat/stream", api_key="invalid"))
+    assert [name for name, _ in events] == ["error"]
+    assert "Invalid API key" in events[0][1]["error"]
+
+
+def test_slow_model_is_hedged(client, local_server, monkeypatch):
+    monkeypatch.setattr(server, "AI_HEDGE_AFTER", 0.2)
+    upstream = start_mock(local_server, slow_models={"gpt-4o"}, slow_delay=1)
+    result = chat(client, upstream, cache=False).json()
+    assert result["success"] is True
+    assert result["model_used"] == "gpt-4"
+
+
+def test_identical_streams_in_flight_share_one_upstream(client, local_server):
+    upstream = start_mock(local_server, token_delay=0.1)
+    responses = []
+
+    def request():
+        responses.append(chat(client, upstream, path="/api/ai-chat/stream"))
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    for response in responses:
+        events = sse_events(response)
+        # Late followers get the tokens sent before they joined as well
+        assert "".join(data["text"] for name, data in events if name == "token") == f"Echo: {PROMPT}"
+        assert events[-1][0] == "done"
+    assert upstream.requests == 1
+    stats = client.get("/api/ai-cache", params={"admin_id": "x"}).json()
+    assert stats["misses"] == 1
+    assert stats["coalesced"] == 2
+    assert stats["in_flight"] == 0
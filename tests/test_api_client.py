@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+import server
+
+
+def make_app(ports):
+    """A stand-in HTTP server that echoes requests and notes the client port of each"""
+
+    async def echo(request):
+        ports.append(request.transport.get_extra_info("peername")[1])
+        body = await request.text()
+        return web.json_response({
+            "method": request.method,
+            "body": json.loads(body) if body else None,
+            "header": request.headers.get("X-Test"),
+        }, headers={"X-Served-By": "stand-in"})
+
+    async def slow(request):
+        await asyncio.sleep(2)
+        return web.Response(text="late")
+
+    async def text(request):
+        return web.Response(text="plain \xff text", status=418)
+
+    app = web.Application()
+    app.router.add_route("*", "/echo", echo)
+    app.router.add_get("/slow", slow)
+    app.router.add_get("/text", text)
+    return app
+
+
+@pytest.fixture
+def stand_in(local_server):
+    ports = []
+    target = local_server(make_app(ports))
+    target.ports = ports
+    return target
+
+
+def call(client, url, method="GET", **fields):
+    data = {"method": method, "url": url, "admin_id": "x", **fields}
+    return client.post("/api/test-api", json=data).json()
+
+
+@pytest.mark.parametrize("method", ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+def test_methods(client, stand_in, method):
+    result = call(client, stand_in.url + "/echo", method, headers='{"X-Test": "yes"}', body='{"n": 1}')
+    assert result["success"] is True
+    assert result["status_code"] == 200
+    assert result["headers"]["X-Served-By"] == "stand-in"
+    echoed = json.loads(result["response"])
+    assert echoed["method"] == method
+    assert echoed["header"] == "yes"
+    # Only methods with a body send one
+    assert echoed["body"] == ({"n": 1} if method in ("POST", "PUT", "PATCH") else None)
+
+
+def test_head_has_no_body(client, stand_in):
+    result = call(client, stand_in.url + "/echo", "head")
+    assert result["success"] is True
+    assert result["status_code"] == 200
+    assert result["response"] == ""
+
+
+def test_non_json_response_is_returned_as_text(client, stand_in):
+    result = call(client, stand_in.url + "/text")
+    assert result["status_code"] == 418
+    assert result["response"] == "plain \xff text"
+
+
+def test_invalid_input(client, stand_in):
+    assert call(client, stand_in.url + "/echo", "TRACE")["error"] == "Unsupported HTTP method: TRACE"
+    assert call(client, stand_in.url + "/echo", headers="{nope")["error"].startswith("Invalid JSON")
+    assert call(client, "")["error"] == "No URL provided"
+
+
+def test_connection_errors_are_reported(client):
+    # Nothing listens on port 1
+    result = call(client, "http://127.0.0.1:1/echo")
+    assert result["success"] is False
+    assert result["error"].startswith("Request error:")
+
+
+def test_timeout(client, stand_in, monkeypatch):
+    monkeypatch.setattr(server, "HTTP_CLIENT_TIMEOUT", 0.3)
+    monkeypatch.setattr(server, "_http_session", None)
+    result = call(client, stand_in.url + "/slow")
+    assert result == {"success": False, "error": "Request timed out after 0.3 seconds"}
+
+
+def test_connections_are_reused(client, stand_in):
+    for _ in range(5):
+        assert call(client, stand_in.url + "/echo")["success"] is True
+    assert len(stand_in.ports) == 5
+    assert len(set(stand_in.ports)) == 1
+
+
+def test_load_test_reports_status_counts(client, stand_in):
+    data = {"method": "GET", "url": stand_in.url + "/echo", "admin_id": "x", "requests": 40, "concurrency": 4}
+    response = client.post("/api/test-api/load", json=data)
+    block = response.text.strip().split("\n\n")[-1]
+    lines = dict(line.split(": ", 1) for line in block.splitlines())
+    assert lines["event"] == "done"
+    summary = json.loads(lines["data"])
+    assert summary["completed"] == 40
+    assert summary["status_codes"] == {"200": 40}
+    # The load test keeps at most concurrency connections open
+    assert len(set(stand_in.ports)) <= 4
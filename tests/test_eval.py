@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import server
+
+
+def evaluate(client, code, **fields):
+    return client.post("/api/eval", json={"code": code, "admin_id": "x", **fields}).json()
+
+
+def test_kernel_keeps_variables(client):
+    assert evaluate(client, "x = 41", persistent=True, session_id="keep")["success"] is True
+    assert evaluate(client, "print(x + 1)", persistent=True, session_id="keep")["output"].strip() == "42"
+    # Other sessions have their own namespace
+    assert evaluate(client, "print(x)", persistent=True, session_id="other")["success"] is False
+
+
+def test_concurrent_first_requests_share_one_kernel(client, monkeypatch):
+    spawned = []
+    spawn = server.PythonWorker.spawn
+
+    async def counting_spawn():
+        # Slow enough for all the requests to arrive while it starts
+        await asyncio.sleep(0.3)
+        worker = await spawn()
+        spawned.append(worker)
+        return worker
+
+    monkeypatch.setattr(server.PythonWorker, "spawn", counting_spawn)
+    results = []
+
+    def request(n):
+        results.append(evaluate(client, f"import os; v{n} = os.getpid()", persistent=True, session_id="race"))
+
+    threads = [threading.Thread(target=request, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert [result["success"] for result in results] == [True] * 4
+    assert len(spawned) == 1
+    assert evaluate(client, "print(v0 == v1 == v2 == v3)", persistent=True, session_id="race")["output"].strip() == "True"
+    kernels = client.get("/api/kernels", params={"admin_id": "x"}).json()["kernels"]
+    assert [kernel["session_id"] for kernel in kernels] == ["race"]
+
+
+def test_exit_ends_the_snippet_not_the_worker(client):
+    result = evaluate(client, "print('bye'); exit()", persistent=True, session_id="exit")
+    assert result == {"success": True, "output": "bye\n"}
+    result = evaluate(client, "import sys\nkept = 1\nsys.exit(3)", persistent=True, session_id="exit")
+    assert result == {"success": False, "error": "SystemExit: 3", "output": ""}
+    result = evaluate(client, "await asyncio.sleep(0)\nraise SystemExit('stop')", persistent=True, session_id="exit")
+    assert result["error"] == "SystemExit: stop"
+    # The kernel survived with its variables
+    assert evaluate(client, "print(kept)", persistent=True, session_id="exit")["output"] == "1\n"
+
+
+def test_exit_in_process(client, monkeypatch):
+    monkeypatch.setattr(server, "eval_pool", None)
+    assert evaluate(client, "import sys; sys.exit(2)") == {"success": False, "error": "SystemExit: 2", "output": ""}
+    assert evaluate(client, "print(1 + 1)")["output"] == "2\n"
+
+
+def test_late_timeout_leaves_a_newer_kernel_alone(client):
+    async def scenario():
+        slow = asyncio.ensure_future(server.run_in_kernel("late", "import time; time.sleep(2)", timeout=1))
+        await asyncio.sleep(0.3)
+        # Replaced while the slow run is still going, as by a reset
+        old = server.eval_kernels.pop("late")
+        assert (await server.run_in_kernel("late", "kept = 1"))["success"] is True
+        new = server.eval_kernels["late"]
+        assert (await slow)["success"] is False
+        await asyncio.sleep(0.1)
+        return old, new
+
+    old, new = client.portal.call(scenario)
+    assert server.eval_kernels.get("late") is new
+    assert old.worker.proc.returncode is not None
+    assert evaluate(client, "print(kept)", persistent=True, session_id="late")["output"] == "1\n"
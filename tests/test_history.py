@@ -0,0 +1,31 @@
+import time
+
+import server
+
+
+def recorded_commands(client):
+    entries = client.get("/api/history", params={"admin_id": "x"}).json()["entries"]
+    return [entry["command"] for entry in entries]
+
+
+def test_history_keeps_writing_after_a_bad_batch(client, monkeypatch):
+    write = server.HistoryStore._write
+
+    def fail_on_bad(self, batch):
+        if any(entry["command"] == "bad" for entry in batch):
+            raise ValueError("cannot store this row")
+        write(self, batch)
+
+    monkeypatch.setattr(server.HistoryStore, "_write", fail_on_bad)
+    # Recorded on the event loop, like the endpoints do
+    client.portal.call(server.record_execution, "execute", "bad", time.monotonic())
+    deadline = time.monotonic() + 5
+    while server.history_store.failed == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert server.history_store.failed == 1
+
+    client.portal.call(server.record_execution, "execute", "good", time.monotonic())
+    deadline = time.monotonic() + 5
+    while not recorded_commands(client) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert recorded_commands(client) == ["good"]
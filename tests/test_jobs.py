@@ -0,0 +1,80 @@
+import time
+
+import server
+
+
+def submit(client, **fields):
+    return client.post("/api/jobs", json={"admin_id": "x", **fields})
+
+
+def wait_for(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError("timed out waiting")
+
+
+def output(client, job_id):
+    response = client.get(f"/api/jobs/{job_id}/output", params={"admin_id": "x"})
+    return response.content if response.status_code in (200, 206) else b""
+
+
+def test_python_job_output_is_not_buffered(client, monkeypatch):
+    env = {name: value for name, value in server.shell_state["env"].items() if name != "PYTHONUNBUFFERED"}
+    monkeypatch.setitem(server.shell_state, "env", env)
+    job = submit(client, code="import time\nprint('started')\ntime.sleep(5)").json()["job"]
+    # Visible while the job still runs, not only when it exits
+    assert wait_for(lambda: output(client, job["id"]) == b"started\n", timeout=3)
+    status = client.get(f"/api/jobs/{job['id']}", params={"admin_id": "x"}).json()["job"]["status"]
+    assert status == "running"
+    client.post(f"/api/jobs/{job['id']}/cancel", json={"admin_id": "x"})
+
+
+def test_submissions_beyond_the_queue_are_refused(client, monkeypatch):
+    monkeypatch.setattr(server, "JOB_CONCURRENCY", 1)
+    monkeypatch.setattr(server, "JOB_MAX_QUEUED", 1)
+    monkeypatch.setattr(server, "_job_semaphore", None)
+    first = submit(client, command="sleep 5").json()["job"]
+    second = submit(client, command="sleep 5").json()["job"]
+    refused = submit(client, command="sleep 5")
+    assert refused.status_code == 429
+    assert refused.json()["success"] is False
+
+    client.post(f"/api/jobs/{first['id']}/cancel", json={"admin_id": "x"})
+    client.post(f"/api/jobs/{second['id']}/cancel", json={"admin_id": "x"})
+    wait_for(lambda: not server.job_queue_full())
+    third = submit(client, command="true").json()["job"]
+    assert wait_for(lambda: client.get(f"/api/jobs/{third['id']}", params={"admin_id": "x"}).json()["job"]["status"]
+                    == "succeeded")
+
+
+def job_info(client, job_id):
+    return client.get(f"/api/jobs/{job_id}", params={"admin_id": "x"}).json()["job"]
+
+
+def test_jobs_run_with_limits_and_report_usage(client, monkeypatch):
+    monkeypatch.setattr(server, "JOB_RLIMITS", server._rlimits(cpu=1))
+    job = submit(client, command="while :; do :; done").json()["job"]
+    info = wait_for(lambda: (lambda info: info["finished"] and info)(job_info(client, job["id"])))
+    # SIGXCPU at the CPU limit
+    assert info["status"] == "failed"
+    assert info["exit_code"] != 0
+    assert info["cpu_user"] + info["cpu_system"] >= 0.9
+
+
+def test_job_output_is_capped(client, monkeypatch):
+    monkeypatch.setattr(server, "OUTPUT_SPILL_MAX", 1000)
+    job = submit(client, command="yes | head -c 100000; echo done >&2").json()["job"]
+    info = wait_for(lambda: (lambda info: info["finished"] and info)(job_info(client, job["id"])))
+    assert info["status"] == "succeeded"
+    assert info["output_bytes"] == 1000
+    assert info["output_truncated"] is True
+    assert output(client, job["id"]) == b"y\n" * 500
+
+    small = submit(client, command="echo hi").json()["job"]
+    info = wait_for(lambda: (lambda info: info["finished"] and info)(job_info(client, small["id"])))
+    assert info["output_truncated"] is False
+    assert output(client, small["id"]) == b"hi\n"
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import uuid
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def session_id():
+    return uuid.uuid4().hex
+
+
+def execute(client, command, session_id):
+    return client.post("/api/execute", json={"command": command, "admin_id": "x", "session_id": session_id}).json()
+
+
+def pwd(client, session_id):
+    return client.get("/api/pwd", params={"session_id": session_id}).json()["cwd"]
+
+
+def test_cwd_follows_the_shell(client, session_id, tmp_path):
+    assert execute(client, f"cd {tmp_path}", session_id)["cwd"] == str(tmp_path)
+    assert pwd(client, session_id) == str(tmp_path)
+    # Other sessions keep their own directory
+    assert pwd(client, uuid.uuid4().hex) == server.shell_state["cwd"]
+
+
+async def move_to_another_worker(session_id, cwd):
+    """Drop the local shell and save state as if another worker's shell ran cd cwd"""
+    server.shell_sessions.pop(session_id).close()
+    state = await server.session_state_get(f"shell:{session_id}")
+    await server.session_state_set(f"shell:{session_id}", dict(state, cwd=cwd, version=uuid.uuid4().hex))
+
+
+def test_cwd_of_a_shell_in_another_worker(client, session_id, tmp_path):
+    execute(client, "cd /", session_id)
+    # The shell is closed on the event loop, which owns its PTY reader
+    client.portal.call(move_to_another_worker, session_id, str(tmp_path))
+
+    assert pwd(client, session_id) == str(tmp_path)
+    saved = client.post("/api/save-file", json={"filename": "a.txt", "content": "hi", "admin_id": "x",
+                                                "session_id": session_id}).json()
+    assert saved["success"] is True
+    assert (tmp_path / "a.txt").read_text() == "hi"
+    # A new local shell picks the directory up too
+    assert execute(client, "pwd", session_id)["output"].strip() == str(tmp_path)
+
+
+def test_concurrent_first_commands_share_one_shell(client, session_id, monkeypatch):
+    start = server.ShellSession.start
+
+    async def slow_start(self):
+        # Slow enough for all the commands to arrive while it starts
+        await asyncio.sleep(0.3)
+        await start(self)
+
+    monkeypatch.setattr(server.ShellSession, "start", slow_start)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(execute(client, "echo $$", session_id)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert [result["success"] for result in results] == [True] * 4
+    assert len({result["output"] for result in results}) == 1
+
+
+def test_commands_longer_than_a_terminal_line(client, session_id):
+    result = execute(client, f"echo {'a' * 5000} | wc -c", session_id)
+    assert result["output"].strip() == "5001"
+    result = execute(client, f"x={'b' * 100000}; echo ${{#x}}", session_id)
+    assert result["output"].strip() == "100000"
+
+
+def test_syntax_errors_return_straight_away(client, session_id):
+    result = execute(client, "echo 'unterminated", session_id)
+    assert result["success"] is True
+    assert result["return_code"] != 0
+    assert "unexpected EOF" in result["output"]
+    # The shell is still usable afterwards
+    assert execute(client, "echo ok", session_id)["output"].strip() == "ok"
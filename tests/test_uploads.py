@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+import server
+
+SCRIPT = b"print('hello from upload')\n"
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "UPLOAD_STORE_DIR", str(tmp_path / "uploads"))
+    return tmp_path / "uploads"
+
+
+def run_file(client, content=SCRIPT):
+    return client.post("/api/run-file", data={"admin_id": "x"}, files={"file": ("job.py", content)}).json()
+
+
+def test_uploads_are_stored_once_by_content(client, store):
+    assert run_file(client)["output"] == "hello from upload\n"
+    assert run_file(client)["output"] == "hello from upload\n"
+    assert len(list(store.glob("*.py"))) == 1
+
+
+def test_upload_removed_by_the_cleaner_is_written_again(client, store, monkeypatch):
+    run_file(client)
+    utime = os.utime
+
+    def cleaned_first(path, *args, **kwargs):
+        # The cleaner gets to the file just before it is marked as used
+        os.unlink(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(server.os, "utime", cleaned_first)
+    assert run_file(client)["output"] == "hello from upload\n"
+
+
+def test_cleaner_removes_abandoned_partial_writes(store):
+    store.mkdir()
+    old = store / "abandoned.part"
+    fresh = store / "writing.part"
+    old.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    stale = time.time() - server.UPLOAD_PART_MAX_AGE - 60
+    os.utime(old, (stale, stale))
+
+    server.clean_upload_store()
+    assert not old.exists()
+    assert fresh.exists()